@@ -0,0 +1,387 @@
+# -----------------------------------------------------------------------------
+# Out-of-core revenue analysis of transaction logs shaped like dataset.csv
+# (CustomerID, TransactionID, Product, Quantity, Price, Date).
+#
+# The file is never loaded whole. It is cut into byte ranges that end on line
+# boundaries, and every range is read by a worker process in chunks of a
+# bounded number of rows. Each chunk is reduced to partial aggregates: the
+# revenue (Quantity * Price) per customer, per product and per day, plus row
+# counts. Partials merge by adding them, so the workers merge their chunks
+# as they go and the parent merges the workers' results. Memory depends on
+# the chunk size and the number of distinct customers, products and days,
+# not on the size of the file. Rows with a missing value are dropped, as the
+# notebook's dropna() does.
+#
+# Usage:
+#     python transactions_pipeline.py dataset.csv
+#     python transactions_pipeline.py big.csv --jobs 8 --chunk-rows 500000
+#     python transactions_pipeline.py --generate big.csv --rows 10000000
+#     python transactions_pipeline.py --benchmark --sizes 1000000 4000000
+# -----------------------------------------------------------------------------
+
+import argparse
+import concurrent.futures
+import dataclasses
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["CustomerID", "TransactionID", "Product", "Quantity", "Price",
+           "Date"]
+DEFAULT_CHUNK_ROWS = 250_000
+
+# Products, with their unit price, of generated datasets: the ones of
+# dataset.csv first
+PRODUCTS = {"Apple": 0.5, "Orange": 0.75, "Banana": 0.4, "Grape": 1.2,
+            "Mango": 1.5, "Pear": 0.6, "Kiwi": 0.3, "Peach": 0.9,
+            "Cherry": 2.5, "Plum": 0.8, "Lemon": 0.35, "Melon": 2.0}
+
+
+def empty_revenue(name):
+    """ An empty revenue Series indexed by "name". """
+    return pd.Series([], index=pd.Index([], name=name), dtype="float64",
+                     name="Revenue")
+
+
+@dataclasses.dataclass
+class RevenuePartial:
+    """
+    Revenue aggregates of part of a transaction log. Two partials of
+    disjoint parts merge into the partial of both.
+    """
+    rows: int = 0
+    dropped: int = 0
+    customer: pd.Series = dataclasses.field(
+        default_factory=lambda: empty_revenue("CustomerID"))
+    product: pd.Series = dataclasses.field(
+        default_factory=lambda: empty_revenue("Product"))
+    day: pd.Series = dataclasses.field(
+        default_factory=lambda: empty_revenue("Date"))
+
+    @classmethod
+    def from_chunk(cls, chunk):
+        """ The partial of one DataFrame chunk of the log. """
+        valid = chunk.dropna()
+        revenue = valid["Quantity"] * valid["Price"]
+        return cls(
+            rows=len(chunk),
+            dropped=len(chunk) - len(valid),
+            customer=revenue.groupby(
+                valid["CustomerID"].astype("int64")).sum(),
+            product=revenue.groupby(valid["Product"]).sum(),
+            # The day of a date, or of a timestamp
+            day=revenue.groupby(valid["Date"].str.slice(0, 10)).sum())
+
+    def merge(self, other):
+        """ The partial of this part of the log and of another one. """
+        return RevenuePartial(
+            rows=self.rows + other.rows,
+            dropped=self.dropped + other.dropped,
+            customer=self.customer.add(other.customer, fill_value=0),
+            product=self.product.add(other.product, fill_value=0),
+            day=self.day.add(other.day, fill_value=0))
+
+    def result(self):
+        """
+        The final aggregates: {"customer", "product", "day": revenue
+        Series sorted by key, days as dates}, with the row counts.
+        """
+        day = self.day.copy()
+        day.index = pd.to_datetime(day.index, format="%Y-%m-%d")
+        return {"rows": self.rows, "dropped": self.dropped,
+                "customer": self.customer.sort_index().rename("Revenue"),
+                "product": self.product.sort_index().rename("Revenue"),
+                "day": day.sort_index().rename_axis("Date")
+                .rename("Revenue")}
+
+
+class RangeReader(io.RawIOBase):
+    """ A binary file, readable from its current position up to "end". """
+
+    def __init__(self, f, end):
+        self.f = f
+        self.remaining = end - f.tell()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        read = self.f.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+
+def split_ranges(path, parts):
+    """
+    Returns the column names of a CSV file and up to "parts" (start, end)
+    byte ranges covering its data lines, each starting at a line start.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        names = f.readline().decode().strip().split(",")
+        bounds = [f.tell()]
+        for part in range(1, parts):
+            f.seek(max(bounds[0], size * part // parts))
+            # On to the next line start; a range that lands exactly on one
+            # leaves that line to the range before
+            f.readline()
+            bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    if sorted(names) != sorted(COLUMNS):
+        raise ValueError(f"{path} has the columns {names}, expected "
+                         f"{COLUMNS}.")
+    ranges = [(start, end) for start, end in zip(bounds, bounds[1:])
+              if end > start]
+    return names, ranges
+
+
+def aggregate_range(path, names, start, end, chunk_rows):
+    """
+    Reads the lines of a CSV file between two byte offsets in chunks of
+    "chunk_rows" rows and returns their merged RevenuePartial.
+    """
+    partial = RevenuePartial()
+    with open(path, "rb") as f:
+        f.seek(start)
+        reader = io.BufferedReader(RangeReader(f, end))
+        for chunk in pd.read_csv(reader, names=names, header=None,
+                                 dtype={"Product": "str", "Date": "str"},
+                                 chunksize=chunk_rows):
+            partial = partial.merge(RevenuePartial.from_chunk(chunk))
+    return partial
+
+
+def measured_range(*args):
+    """
+    aggregate_range() in a worker, with the worker's peak RSS after it.
+    """
+    return aggregate_range(*args), peak_rss_mb()
+
+
+def analyze(path, jobs=None, chunk_rows=DEFAULT_CHUNK_ROWS, peaks=None):
+    """
+    Computes the revenue per customer, per product and per day of a
+    transaction log over a pool of "jobs" worker processes (default: one
+    per core) and returns RevenuePartial.result(). The file is split in
+    four ranges per worker, so that they finish together. When "peaks" is
+    a list, the peak RSS of the worker of every range is appended to it.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    names, ranges = split_ranges(path, jobs * 4)
+    task = aggregate_range if peaks is None else measured_range
+    total = RevenuePartial()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(task, path, names, start, end, chunk_rows)
+                   for start, end in ranges]
+        for future in concurrent.futures.as_completed(futures):
+            partial = future.result()
+            if peaks is not None:
+                partial, peak = partial
+                peaks.append(peak)
+            total = total.merge(partial)
+    return total.result()
+
+
+def analyze_eager(path):
+    """
+    The same analysis the way the notebook does it, with the whole file in
+    one DataFrame; for checking and benchmarking.
+    """
+    return RevenuePartial.from_chunk(
+        pd.read_csv(path, dtype={"Product": "str", "Date": "str"})).result()
+
+
+def generate_dataset(path, rows, customers=100_000, days=365, seed=0,
+                     missing=0.001, block_rows=1_000_000):
+    """
+    Writes a synthetic transaction log of "rows" rows shaped like
+    dataset.csv, in blocks: random customers, products (at their
+    PRODUCTS price), quantities from 1 to 5 and days from 2022-01-01 on.
+    A "missing" fraction of the rows lack their quantity.
+    """
+    generator = np.random.default_rng(seed)
+    names = np.array(list(PRODUCTS))
+    prices = np.array(list(PRODUCTS.values()))
+    dates = pd.date_range("2022-01-01", periods=days).strftime("%Y-%m-%d") \
+        .to_numpy()
+    with open(path, "w", newline="") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for first in range(0, rows, block_rows):
+            count = min(block_rows, rows - first)
+            product = generator.integers(len(names), size=count)
+            quantity = generator.integers(1, 6, size=count).astype("float64")
+            quantity[generator.random(count) < missing] = np.nan
+            pd.DataFrame({
+                "CustomerID": generator.integers(1, customers + 1,
+                                                 size=count),
+                "TransactionID": np.arange(first, first + count) + 101,
+                "Product": names[product],
+                "Quantity": pd.array(quantity, dtype="Int64"),
+                "Price": prices[product],
+                "Date": dates[generator.integers(days, size=count)],
+            }).to_csv(f, header=False, index=False)
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process alone, in MB: VmHWM, which
+    starts over at exec, where getrusage()'s ru_maxrss carries the peak of
+    the process that started this one.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise OSError("VmHWM is not in /proc/self/status.")
+
+
+def measure(mode, path, jobs, chunk_rows):
+    """
+    Runs one analysis and returns its time, the peak RSS of this process
+    and the largest peak RSS of a worker process (0 for eager).
+    """
+    peaks = [0.0]
+    start = time.perf_counter()
+    if mode == "eager":
+        analyze_eager(path)
+    else:
+        analyze(path, jobs, chunk_rows, peaks)
+    return {"seconds": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(), "worker_peak_rss_mb": max(peaks)}
+
+
+def benchmark(sizes, jobs, chunk_rows):
+    """
+    Generates logs of each size in "sizes" (in rows) and compares the
+    pipeline with the eager analysis, each run in a fresh process so that
+    its peak RSS is its own; both results are checked to be equal first.
+    """
+    workdir = tempfile.mkdtemp()
+    print(f"{'rows':>10} {'MB':>7} {'analysis':>9} {'seconds':>8} "
+          f"{'rows/s':>11} {'peak RSS MB':>12} {'worker MB':>10}")
+    try:
+        for size in sizes:
+            path = os.path.join(workdir, f"transactions_{size}.csv")
+            generate_dataset(path, size)
+            if size == sizes[0]:
+                check_equal(analyze(path, jobs, chunk_rows),
+                            analyze_eager(path))
+            for mode in ("pipeline", "eager"):
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), path,
+                     "--measure", mode, "--jobs", str(jobs or 0),
+                     "--chunk-rows", str(chunk_rows)],
+                    stdout=subprocess.PIPE, text=True, check=True)
+                result = json.loads(completed.stdout)
+                print(f"{size:>10} {os.path.getsize(path) / 2 ** 20:>7.0f} "
+                      f"{mode:>9} {result['seconds']:>8.2f} "
+                      f"{size / result['seconds']:>11,.0f} "
+                      f"{result['peak_rss_mb']:>12.1f} "
+                      f"{result['worker_peak_rss_mb']:>10.1f}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_equal(found, expected):
+    """ Raises AssertionError unless two analyses agree. """
+    assert (found["rows"], found["dropped"]) == \
+        (expected["rows"], expected["dropped"])
+    for key in ("customer", "product", "day"):
+        pd.testing.assert_series_equal(found[key], expected[key],
+                                       check_index_type=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Revenue per customer, product and day of a transaction "
+                    "log, computed in bounded memory over a process pool."
+    )
+    parser.add_argument(
+        "file",
+        help="The transaction log (CSV with the columns of dataset.csv).",
+        nargs="?"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="Number of worker processes (default: one per CPU core).",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        help=f"Rows a worker reads at a time (default: "
+             f"{DEFAULT_CHUNK_ROWS}).",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS
+    )
+    parser.add_argument(
+        "--top",
+        help="Number of customers and products to print (default: 10).",
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        "--generate",
+        help="Write a synthetic transaction log to this file instead.",
+        default=None,
+        metavar="FILE"
+    )
+    parser.add_argument(
+        "--rows",
+        help="Number of rows of the generated log (default: 1000000).",
+        type=int,
+        default=1_000_000
+    )
+    parser.add_argument(
+        "--benchmark",
+        help="Compare time and peak RSS with the eager analysis on "
+             "generated logs of --sizes rows.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Rows of the benchmark logs (default: 1000000 4000000 "
+             "16000000).",
+        type=int,
+        nargs="+",
+        default=[1_000_000, 4_000_000, 16_000_000]
+    )
+    parser.add_argument(
+        "--measure",
+        help=argparse.SUPPRESS,
+        choices=["pipeline", "eager"],
+        default=None
+    )
+    args = parser.parse_args()
+
+    if args.generate is not None:
+        generate_dataset(args.generate, args.rows)
+    elif args.benchmark:
+        benchmark(args.sizes, args.jobs, args.chunk_rows)
+    elif args.file is None:
+        parser.error("the following arguments are required: file")
+    elif args.measure is not None:
+        print(json.dumps(measure(args.measure, args.file, args.jobs or None,
+                                 args.chunk_rows)))
+    else:
+        result = analyze(args.file, args.jobs, args.chunk_rows)
+        print(f"{result['rows']} transactions, {result['dropped']} dropped "
+              f"for a missing value.")
+        for key, label in (("customer", "customers"),
+                           ("product", "products")):
+            print(f"\nTop {label} by revenue:")
+            print(result[key].nlargest(args.top).to_string())
+        print("\nRevenue per day:")
+        print(result["day"].to_string())
@@ -0,0 +1,271 @@
+# -----------------------------------------------------------------------------
+# Join index for queries on the LEGO database (see lego_loader.py).
+#
+# The tables form a snowflake around inventory_parts:
+#     inventory_parts -> inventories -> sets -> themes
+#     inventory_parts -> parts -> part_categories
+#     inventory_parts -> colors
+# Instead of merging DataFrames for every question, every foreign key is
+# resolved once into an integer array of row numbers in the table it points
+# to (-1 when the row it names does not exist), and the keys of the chain
+# are composed, so that each row of inventory_parts knows the row of its
+# set, theme, part category and color. A rollup is then a gather of the
+# dimension of each part row and a np.bincount() of its quantities: no
+# merged DataFrame is ever built.
+#
+# Usage:
+#     from lego_index import LegoIndex
+#     index = LegoIndex.from_archive()
+#     index.parts_by_theme().nlargest(10)
+#
+#     python lego_index.py                   # benchmark against merges
+# -----------------------------------------------------------------------------
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from lego_loader import DEFAULT_ARCHIVE, DEFAULT_CACHE_DIR, load_lego
+
+
+def key_index(keys):
+    """
+    Returns a function mapping keys to their row numbers in "keys" (the
+    unique key column of a table), -1 for keys it does not have. Integer
+    keys are looked up in a direct-address table, others in a hash index.
+    """
+    keys = np.asarray(keys)
+    if keys.dtype.kind in "iu":
+        low = int(keys.min())
+        table = np.full(int(keys.max()) - low + 1, -1, dtype=np.int32)
+        table[keys - low] = np.arange(len(keys), dtype=np.int32)
+
+        def lookup(values):
+            values = np.asarray(values, dtype=np.int64) - low
+            found = (values >= 0) & (values < len(table))
+            rows = np.full(len(values), -1, dtype=np.int32)
+            rows[found] = table[values[found]]
+            return rows
+        return lookup
+
+    hashed = pd.Index(keys)
+    return lambda values: hashed.get_indexer(values).astype(np.int32)
+
+
+def compose(outer, inner):
+    """
+    Follows two foreign keys in a row: the rows "inner" points to for each
+    of the rows "outer" points to, -1 where either is missing.
+    """
+    rows = np.full(len(outer), -1, dtype=np.int32)
+    found = outer >= 0
+    rows[found] = inner[outer[found]]
+    return rows
+
+
+class LegoIndex:
+    """
+    The foreign keys of the LEGO tables as integer row arrays, composed for
+    every row of inventory_parts, with its quantities. Rollups return a
+    Series of the total quantity per key of a dimension, without the keys
+    no part row reaches.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        parts_rows = tables["inventory_parts"]
+
+        # One hop: each table's foreign keys as rows of the table they name
+        inventory = key_index(tables["inventories"]["id"])(
+            parts_rows["inventory_id"].to_numpy())
+        inventory_set = key_index(tables["sets"]["set_num"])(
+            tables["inventories"]["set_num"])
+        set_theme = key_index(tables["themes"]["id"])(
+            tables["sets"]["theme_id"].to_numpy())
+        part_category = key_index(tables["part_categories"]["id"])(
+            tables["parts"]["part_cat_id"].to_numpy())
+        # Part numbers are categorical: look up each category once, then
+        # gather by the codes
+        part_codes = parts_rows["part_num"].cat.codes.to_numpy()
+        part_of_category = key_index(tables["parts"]["part_num"])(
+            parts_rows["part_num"].cat.categories)
+        part = np.where(part_codes >= 0, part_of_category[part_codes], -1) \
+            .astype(np.int32)
+
+        # Composed: every part row straight to each dimension
+        self.set = compose(inventory, inventory_set)
+        self.theme = compose(self.set, set_theme)
+        self.part = part
+        self.part_category = compose(part, part_category)
+        self.color = key_index(tables["colors"]["id"])(
+            parts_rows["color_id"].to_numpy())
+        self.quantity = parts_rows["quantity"].to_numpy()
+        self.is_spare = parts_rows["is_spare"].to_numpy()
+        # Years are a dimension of their own: row 0 is the first year
+        years = tables["sets"]["year"].to_numpy()
+        self.years = pd.Index(np.arange(years.min(), years.max() + 1,
+                                        dtype=np.int16), name="year")
+        self.year = compose(self.set, (years - years.min()).astype(np.int32))
+
+    @classmethod
+    def from_archive(cls, path=DEFAULT_ARCHIVE, cache_dir=DEFAULT_CACHE_DIR):
+        """ Builds the index of the tables load_lego() returns. """
+        return cls(load_lego(path, cache_dir))
+
+    def weights(self, spares):
+        """ The quantity of every part row, zero for spares if excluded. """
+        if spares:
+            return self.quantity
+        return np.where(self.is_spare, 0, self.quantity)
+
+    def rollup(self, rows, keys, spares=True):
+        """
+        Totals the quantities of the part rows by the row of a dimension
+        they point to ("rows", -1 for none) and returns them by the key of
+        that row ("keys", an Index), dropping the keys no part row reaches.
+        """
+        weights = self.weights(spares)
+        found = rows >= 0
+        if not found.all():
+            rows, weights = rows[found], weights[found]
+        totals = np.bincount(rows, weights=weights,
+                             minlength=len(keys)).astype(np.int64)
+        used = np.bincount(rows, minlength=len(keys)) > 0
+        return pd.Series(totals[used], index=keys[used], name="quantity")
+
+    def parts_by_theme(self, spares=True):
+        """ Total quantity of parts in the sets of each theme, by theme id. """
+        themes = pd.Index(self.tables["themes"]["id"], name="theme_id")
+        return self.rollup(self.theme, themes, spares)
+
+    def parts_by_color(self, spares=True):
+        """ Total quantity of parts of each color, by color id. """
+        colors = pd.Index(self.tables["colors"]["id"], name="color_id")
+        return self.rollup(self.color, colors, spares)
+
+    def parts_by_category(self, spares=True):
+        """ Total quantity of parts of each part category, by its id. """
+        categories = pd.Index(self.tables["part_categories"]["id"],
+                              name="part_cat_id")
+        return self.rollup(self.part_category, categories, spares)
+
+    def parts_by_year(self, spares=True):
+        """ Total quantity of parts in the sets released each year. """
+        return self.rollup(self.year, self.years, spares)
+
+    def parts_by_theme_year(self, spares=True):
+        """
+        Total quantity of parts in the sets of each theme released each
+        year, by (theme id, year): one bincount over the combined row.
+        """
+        themes = pd.Index(self.tables["themes"]["id"], name="theme_id")
+        span = len(self.years)
+        cell = np.where((self.theme >= 0) & (self.year >= 0),
+                        self.theme * span + self.year, -1)
+        return self.rollup(cell, pd.MultiIndex.from_product(
+            [themes, self.years]), spares)
+
+
+def merged_rollup(tables, name):
+    """
+    One of the ROLLUPS the naive way, with the chain of merges it needs,
+    for checking and benchmarking the index.
+    """
+    parts_rows = tables["inventory_parts"]
+    if name == "color":
+        return parts_rows.merge(tables["colors"], left_on="color_id",
+                                right_on="id") \
+            .groupby("color_id")["quantity"].sum()
+    if name == "category":
+        return parts_rows.merge(
+            tables["parts"], left_on=parts_rows["part_num"].astype("str"),
+            right_on="part_num").merge(
+            tables["part_categories"], left_on="part_cat_id",
+            right_on="id").groupby("part_cat_id")["quantity"].sum()
+    with_sets = parts_rows.merge(
+        tables["inventories"], left_on="inventory_id", right_on="id") \
+        .merge(tables["sets"], on="set_num")
+    if name == "year":
+        return with_sets.groupby("year")["quantity"].sum()
+    with_themes = with_sets.merge(tables["themes"], left_on="theme_id",
+                                  right_on="id")
+    if name == "theme":
+        return with_themes.groupby("theme_id")["quantity"].sum()
+    return with_themes.groupby(["theme_id", "year"])["quantity"].sum()
+
+
+# The rollups of the benchmark, with the LegoIndex method answering each
+ROLLUPS = {
+    "theme": LegoIndex.parts_by_theme,
+    "color": LegoIndex.parts_by_color,
+    "category": LegoIndex.parts_by_category,
+    "year": LegoIndex.parts_by_year,
+    "theme, year": LegoIndex.parts_by_theme_year,
+}
+
+
+def measure(function, *args, repeat=5):
+    """
+    Returns the result of a call, its best wall time in seconds over
+    "repeat" calls, and the peak of memory it allocated, in bytes, as
+    tracemalloc sees it (NumPy and pandas report their buffers to it).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def benchmark(tables):
+    """
+    Times every rollup answered by the index against the merge chain, with
+    the peak memory of each, and checks that both give the same totals.
+    """
+    index, seconds, peak = measure(LegoIndex, tables)
+    print(f"Index built in {seconds * 1000:.1f} ms, peak "
+          f"{peak / 2 ** 20:.1f} MB.")
+    print(f"{'rollup':<13} {'merges ms':>10} {'index ms':>9} "
+          f"{'merges MB':>10} {'index MB':>9}")
+    for name, method in ROLLUPS.items():
+        expected, merge_seconds, merge_peak = measure(merged_rollup, tables,
+                                                      name)
+        found, index_seconds, index_peak = measure(method, index)
+        pd.testing.assert_series_equal(
+            found, expected.astype(np.int64), check_names=False,
+            check_index_type=False)
+        print(f"{name:<13} {merge_seconds * 1000:>10.1f} "
+              f"{index_seconds * 1000:>9.1f} {merge_peak / 2 ** 20:>10.1f} "
+              f"{index_peak / 2 ** 20:>9.1f}")
+    print("The index and the merges give the same totals.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the LEGO join index against pandas merges."
+    )
+    parser.add_argument(
+        "archive",
+        help=f"The LEGO archive (default: {DEFAULT_ARCHIVE}).",
+        nargs="?",
+        default=DEFAULT_ARCHIVE
+    )
+    parser.add_argument(
+        "--cache",
+        help=f"The cache directory of lego_loader (default: "
+             f"{DEFAULT_CACHE_DIR}).",
+        default=DEFAULT_CACHE_DIR
+    )
+    args = parser.parse_args()
+
+    benchmark(load_lego(args.archive, args.cache))
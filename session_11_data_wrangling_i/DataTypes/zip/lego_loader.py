@@ -0,0 +1,342 @@
+# -----------------------------------------------------------------------------
+# Loader for the LEGO database (lego_database.zip).
+#
+# Every CSV member is read by pandas straight out of the zip archive, as a
+# stream, so nothing is extracted to disk, and with explicit compact dtypes:
+# small integers for ids, years and quantities, booleans for the "t"/"f"
+# flags and categoricals for the text that repeats (color, theme and part
+# category names, part numbers in the inventories). The parsed tables are
+# then written to a columnar cache, one .npy file per column, in a directory
+# named after the SHA-256 of the archive; the next load memory-maps those
+# files instead of parsing any CSV. A changed archive, or a change to the
+# dtypes below, gets a new cache directory.
+#
+# Usage:
+#     from lego_loader import load_lego
+#     tables = load_lego()
+#     tables["inventory_parts"].info(memory_usage="deep")
+#
+#     python lego_loader.py                  # load and describe the tables
+#     python lego_loader.py --benchmark      # time and peak RSS of each way
+# -----------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ARCHIVE = os.path.join(HERE, "lego_database.zip")
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+                                 "lego_database")
+
+# Bumped when the layout of the cache changes
+CACHE_VERSION = 1
+
+# Every table of the archive with the dtype of each of its columns, in file
+# order. "Int16" is a nullable integer (themes without a parent); "str"
+# columns are mostly unique text and stay plain strings.
+TABLES = {
+    "colors": {"id": "int16", "name": "category", "rgb": "str",
+               "is_trans": "bool"},
+    "inventories": {"id": "int16", "version": "int8", "set_num": "str"},
+    "inventory_parts": {"inventory_id": "int16", "part_num": "category",
+                        "color_id": "int16", "quantity": "int16",
+                        "is_spare": "bool"},
+    "inventory_sets": {"inventory_id": "int16", "set_num": "category",
+                       "quantity": "int16"},
+    "part_categories": {"id": "int8", "name": "category"},
+    "parts": {"part_num": "str", "name": "str", "part_cat_id": "int8"},
+    "sets": {"set_num": "str", "name": "str", "year": "int16",
+             "theme_id": "int16", "num_parts": "int16"},
+    "themes": {"id": "int16", "name": "category", "parent_id": "Int16"},
+}
+
+# The archive is hashed in blocks of this size
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def archive_digest(path):
+    """
+    The key of an archive's cache: the SHA-256 of its bytes, of the dtypes
+    it is parsed with and of the cache version.
+    """
+    digest = hashlib.sha256(
+        json.dumps([CACHE_VERSION, TABLES], sort_keys=True).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_table(archive, name):
+    """
+    Parses one table of an open ZipFile, streaming its CSV member, with the
+    dtypes of TABLES. Raises ValueError if its columns are not the expected
+    ones.
+    """
+    dtypes = TABLES[name]
+    with archive.open(f"{name}.csv") as stream:
+        table = pd.read_csv(stream, dtype=dtypes, true_values=["t"],
+                            false_values=["f"])
+    if list(table.columns) != list(dtypes):
+        raise ValueError(f"{name}.csv has the columns {list(table.columns)}, "
+                         f"expected {list(dtypes)}.")
+    return table
+
+
+def read_tables(path, names=None):
+    """ Parses the given tables (default: all) of the archive at "path". """
+    with zipfile.ZipFile(path) as archive:
+        return {name: read_table(archive, name) for name in names or TABLES}
+
+
+def save_text(directory, name, values):
+    """
+    Saves a sequence of strings as two arrays: their UTF-8 text, one after
+    the other, and the offsets in characters where each one starts and ends.
+    """
+    text = "".join(values)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    np.save(os.path.join(directory, f"{name}.text.npy"),
+            np.frombuffer(text.encode(), dtype=np.uint8))
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+
+def load_text(directory, name):
+    """ Loads the strings save_text() saved, as an object array. """
+    text = np.load(os.path.join(directory, f"{name}.text.npy")) \
+        .tobytes().decode()
+    offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"))
+    values = np.empty(len(offsets) - 1, dtype=object)
+    values[:] = [text[start:end]
+                 for start, end in zip(offsets[:-1].tolist(),
+                                       offsets[1:].tolist())]
+    return values
+
+
+def save_table(directory, table, dtypes):
+    """
+    Saves a table column by column into "directory": numbers and booleans
+    as they are, nullable integers as values and a mask, and text as the
+    codes of its categories plus the categories.
+    """
+    for column, dtype in dtypes.items():
+        series = table[column]
+        path = os.path.join(directory, column)
+        if dtype in ("category", "str"):
+            if dtype == "category":
+                codes = series.cat.codes.to_numpy()
+                categories = series.cat.categories
+            else:
+                codes, categories = pd.factorize(series)
+            np.save(f"{path}.codes.npy", codes)
+            save_text(directory, column, list(categories))
+        elif dtype == "Int16":
+            np.save(f"{path}.npy", series.to_numpy(dtype=np.int16,
+                                                   na_value=0))
+            np.save(f"{path}.mask.npy", series.isna().to_numpy())
+        else:
+            np.save(f"{path}.npy", series.to_numpy())
+    with open(os.path.join(directory, "table.json"), "w") as f:
+        json.dump({"rows": len(table), "columns": dtypes}, f)
+
+
+def mapped(path):
+    """
+    Memory-maps a saved array, read-only, as a plain ndarray view of the
+    file.
+    """
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+
+def load_table(directory):
+    """
+    Loads a table save_table() saved. Numbers, booleans and the codes of
+    categoricals are memory-mapped rather than read.
+    """
+    with open(os.path.join(directory, "table.json")) as f:
+        meta = json.load(f)
+    columns = {}
+    for column, dtype in meta["columns"].items():
+        path = os.path.join(directory, column)
+        if dtype in ("category", "str"):
+            values = pd.Categorical.from_codes(
+                mapped(f"{path}.codes.npy"),
+                categories=load_text(directory, column), validate=False)
+            columns[column] = values if dtype == "category" \
+                else pd.array(np.asarray(values, dtype=object), dtype="str")
+        elif dtype == "Int16":
+            columns[column] = pd.arrays.IntegerArray(
+                mapped(f"{path}.npy"), mapped(f"{path}.mask.npy"))
+        else:
+            columns[column] = mapped(f"{path}.npy")
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_lego(path=DEFAULT_ARCHIVE, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns {table name: DataFrame} for every table of the LEGO archive at
+    "path". Loads them from the cache in "cache_dir" when it has this
+    archive, and otherwise parses the archive and fills the cache. With no
+    "cache_dir", the archive is always parsed.
+    """
+    if cache_dir is None:
+        return read_tables(path)
+    directory = os.path.join(cache_dir, archive_digest(path))
+    if not os.path.isdir(directory):
+        tables = read_tables(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written aside and renamed, so a half-written cache is never seen
+        staging = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            for name, table in tables.items():
+                os.mkdir(os.path.join(staging, name))
+                save_table(os.path.join(staging, name), table, TABLES[name])
+            os.rename(staging, directory)
+        except OSError:
+            # Another process filled the cache first
+            if not os.path.isdir(directory):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return tables
+    return {name: load_table(os.path.join(directory, name))
+            for name in TABLES}
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process alone, in MB: VmHWM, which
+    starts over at exec, where getrusage()'s ru_maxrss carries the peak of
+    the process that started this one.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise OSError("VmHWM is not in /proc/self/status.")
+
+
+def read_extracted(path):
+    """
+    The way the notebook loads the tables: extract the archive to a
+    temporary directory and read every CSV with pandas' default dtypes.
+    """
+    workdir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(path) as archive:
+            archive.extractall(workdir)
+        return {name: pd.read_csv(os.path.join(workdir, f"{name}.csv"))
+                for name in TABLES}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure(mode, path, cache_dir):
+    """
+    Loads the tables one way ("extract", "stream" or "cache") and returns
+    the wall time, the peak RSS of the process before and after, and the
+    memory the tables use.
+    """
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "extract":
+        tables = read_extracted(path)
+    elif mode == "stream":
+        tables = read_tables(path)
+    else:
+        tables = load_lego(path, cache_dir)
+    seconds = time.perf_counter() - start
+    memory = sum(table.memory_usage(deep=True).sum()
+                 for table in tables.values())
+    return {"seconds": seconds, "rss_before_mb": before,
+            "peak_rss_mb": peak_rss_mb(), "tables_mb": memory / 2 ** 20}
+
+
+def benchmark(path):
+    """
+    Measures every way of loading the tables, each in a fresh process so
+    that peak RSS is its own: extracting and reading with default dtypes,
+    streaming with compact dtypes, and the cache, cold then warm.
+    """
+    cache_dir = tempfile.mkdtemp()
+    runs = [("extract", "extract + read_csv"), ("stream", "stream, dtypes"),
+            ("cache", "cache (cold)"), ("cache", "cache (warm)")]
+    print(f"{'load':<20} {'seconds':>8} {'peak RSS MB':>12} "
+          f"{'above imports':>14} {'tables MB':>10}")
+    try:
+        for mode, label in runs:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), path,
+                 "--cache", cache_dir, "--measure", mode],
+                stdout=subprocess.PIPE, text=True, check=True)
+            result = json.loads(completed.stdout)
+            print(f"{label:<20} {result['seconds']:>8.3f} "
+                  f"{result['peak_rss_mb']:>12.1f} "
+                  f"{result['peak_rss_mb'] - result['rss_before_mb']:>14.1f} "
+                  f"{result['tables_mb']:>10.1f}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the LEGO database from its zip archive through a "
+                    "memory-mapped columnar cache."
+    )
+    parser.add_argument(
+        "archive",
+        help=f"The LEGO archive (default: {DEFAULT_ARCHIVE}).",
+        nargs="?",
+        default=DEFAULT_ARCHIVE
+    )
+    parser.add_argument(
+        "--cache",
+        help=f"The cache directory (default: {DEFAULT_CACHE_DIR}).",
+        default=DEFAULT_CACHE_DIR
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Parse the archive without reading or writing the cache.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--benchmark",
+        help="Compare the time and peak RSS of extracting, streaming and "
+             "the cache, cold and warm.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--measure",
+        help=argparse.SUPPRESS,
+        choices=["extract", "stream", "cache"],
+        default=None
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.archive)
+    elif args.measure is not None:
+        print(json.dumps(measure(args.measure, args.archive, args.cache)))
+    else:
+        start = time.perf_counter()
+        tables = load_lego(args.archive,
+                           None if args.no_cache else args.cache)
+        seconds = time.perf_counter() - start
+        for name, table in tables.items():
+            memory = table.memory_usage(deep=True).sum() / 2 ** 20
+            print(f"{name:<16} {len(table):>8} rows {memory:>8.1f} MB  "
+                  + ", ".join(f"{column}: {dtype}" for column, dtype
+                              in table.dtypes.items()))
+        print(f"Loaded in {seconds:.3f} s, peak RSS {peak_rss_mb():.1f} MB.")
@@ -0,0 +1,552 @@
+# -----------------------------------------------------------------------------
+# Lazy cleaning plans for CSV files.
+#
+# The cleaning recipe of the notebooks,
+#     df = pd.read_csv("persons.csv")
+#     df = df.drop_duplicates()
+#     df = df.drop(df[df["height"] < 100].index)
+#     missing_count = df.isnull().sum()
+#     df = df.dropna()
+# makes a full copy of the data at every step. Here the same steps are only
+# recorded into a plan, and the plan is optimized before it runs:
+#   - dropping rows by a condition and dropna() decide on each row alone, and
+#     so does drop_duplicates() for identical rows, which meet every
+#     condition alike; they can therefore run in any order. The conditions
+#     and the null checks are pushed down into the CSV scan and fused into
+#     one mask per chunk, so a rejected row never reaches a DataFrame.
+#   - isnull().sum() still counts the rows of its own place in the recipe.
+#     When drop_duplicates() comes before it, only the rows with a missing
+#     value matter (a row without one counts nothing), and they can only
+#     duplicate each other, so they alone are kept and deduplicated.
+#   - the kept text is held as int32 codes into the distinct values seen so
+#     far (TextEncoder), so a value repeated across chunks is stored once;
+#     drop_duplicates() runs once, at the end, on those codes, and only the
+#     rows it keeps are turned back into strings.
+# The file is then read once, chunk by chunk, and the result is equal to the
+# eager pandas chain: same rows, index labels, dtypes and counts.
+#
+# Usage:
+#     from lazy_cleaning import scan_csv
+#     plan = (scan_csv("persons.csv").drop_duplicates()
+#             .drop_where("height", "<", 100).count_nulls().dropna())
+#     print(plan.explain())
+#     result = plan.collect()
+#     result.frame, result.null_counts
+#
+#     python lazy_cleaning.py --benchmark --rows 10000000
+# -----------------------------------------------------------------------------
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import operator
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 500_000
+
+# The comparisons drop_where() accepts
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt,
+             ">=": operator.ge, "==": operator.eq, "!=": operator.ne}
+
+# The steps that decide on each row alone
+ROW_STEPS = ("drop_where", "dropna")
+
+
+@dataclasses.dataclass(frozen=True)
+class Step:
+    """
+    One step of a cleaning plan: "drop_duplicates", "drop_where" (drop the
+    rows where "column" "op" "value"), "dropna" (of the "subset" columns,
+    default all) or "count_nulls".
+    """
+    kind: str
+    column: str = None
+    op: str = None
+    value: object = None
+    subset: tuple = None
+
+    def __str__(self):
+        if self.kind == "drop_where":
+            return (f"df.drop(df[df[{self.column!r}] {self.op} "
+                    f"{self.value!r}].index)")
+        if self.kind == "dropna" and self.subset is not None:
+            return f"df.dropna(subset={list(self.subset)!r})"
+        if self.kind == "count_nulls":
+            return "df.isnull().sum()"
+        return f"df.{self.kind}()"
+
+    def keep(self, frame, missing):
+        """
+        The mask of the rows a row step keeps, given the frame and its
+        isna().
+        """
+        if self.kind == "drop_where":
+            return ~OPERATORS[self.op](frame[self.column], self.value) \
+                .to_numpy(dtype=bool, na_value=False)
+        if self.subset is not None:
+            missing = missing[list(self.subset)]
+        return ~missing.any(axis=1).to_numpy()
+
+    def condition(self):
+        """ What a row must meet to be kept by a row step, in words. """
+        if self.kind == "drop_where":
+            return f"not {self.column} {self.op} {self.value!r}"
+        if self.subset is None:
+            return "no missing value"
+        return f"no missing {', '.join(self.subset)}"
+
+
+@dataclasses.dataclass
+class CleaningResult:
+    """ The cleaned DataFrame and the output of every count_nulls(). """
+    frame: pd.DataFrame
+    null_counts: list
+
+
+class TextEncoder:
+    """
+    The text of one column across the chunks of a scan as int32 codes: each
+    distinct value is kept once, as a single string object, however many
+    chunks it occurs in, and -1 stands for a missing value.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        # The values, in code order, in two indexes: appending to an Index
+        # rebuilds its hash table, so new values go to the small "recent"
+        # one, merged into "known" only once it is a quarter of its size
+        self.known = pd.Index([], dtype=object)
+        self.recent = pd.Index([], dtype=object)
+
+    def encode(self, series):
+        """ The codes of the values of a Series, new values added. """
+        # The object array behind the strings, not a copy
+        values = np.asarray(series.array, dtype=object)
+        codes = self.known.get_indexer(values).astype(np.int32)
+        unseen = np.flatnonzero(codes < 0)
+        if len(self.recent) and len(unseen):
+            found = self.recent.get_indexer(values[unseen])
+            codes[unseen] = np.where(found >= 0, found + len(self.known), -1)
+            unseen = unseen[found < 0]
+        # Only the values seen in no earlier chunk are factorized
+        new_codes, uniques = pd.factorize(values[unseen])
+        first = len(self.known) + len(self.recent)
+        codes[unseen] = np.where(new_codes >= 0, new_codes + first, -1)
+        if len(uniques):
+            self.recent = self.recent.append(pd.Index(uniques, dtype=object))
+            if len(self.recent) * 4 >= len(self.known):
+                self.known = self.known.append(self.recent)
+                self.recent = pd.Index([], dtype=object)
+        return codes
+
+    def decode(self, codes):
+        """ The values of codes, as an array of the column's dtype. """
+        values = np.concatenate([self.known.to_numpy(),
+                                 self.recent.to_numpy(), [np.nan]])
+        return pd.array(values[codes], dtype=self.dtype)
+
+
+class CleaningPlan:
+    """
+    A CSV file to read and the cleaning steps to apply to it, in order.
+    Every method that adds a step returns a new plan; nothing is read until
+    collect() (or collect_eager()) is called.
+    """
+
+    def __init__(self, path, steps=(), **read_options):
+        self.path = path
+        self.steps = tuple(steps)
+        self.read_options = read_options
+
+    def then(self, step):
+        """ The plan with one more step. """
+        return CleaningPlan(self.path, self.steps + (step,),
+                            **self.read_options)
+
+    def drop_duplicates(self):
+        """ Drops the rows identical to an earlier one. """
+        return self.then(Step("drop_duplicates"))
+
+    def drop_where(self, column, op, value):
+        """
+        Drops the rows where the condition holds, as
+        df.drop(df[df[column] < value].index) does for "<"; rows with a
+        missing value in "column" are kept.
+        """
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown comparison {op!r}, expected one of "
+                             f"{', '.join(OPERATORS)}.")
+        return self.then(Step("drop_where", column, op, value))
+
+    def dropna(self, subset=None):
+        """ Drops the rows with a missing value (in "subset", if given). """
+        return self.then(Step("dropna", subset=None if subset is None
+                              else tuple(subset)))
+
+    def count_nulls(self):
+        """ Records isnull().sum() of the rows at this point of the plan. """
+        return self.then(Step("count_nulls"))
+
+    def optimize(self):
+        """
+        Returns the physical plan: (the row steps pushed into the scan,
+        whether to deduplicate the kept rows, and for every count_nulls()
+        the row steps before it and whether a drop_duplicates() is).
+        """
+        row_steps = [step for step in self.steps if step.kind in ROW_STEPS]
+        counts = []
+        before, deduplicated = 0, False
+        for step in self.steps:
+            if step.kind in ROW_STEPS:
+                before += 1
+            elif step.kind == "drop_duplicates":
+                deduplicated = True
+            else:
+                counts.append((before, deduplicated))
+        return row_steps, deduplicated, counts
+
+    def explain(self):
+        """ The recorded steps and the optimized plan, as text. """
+        row_steps, deduplicated, counts = self.optimize()
+        lines = ["Recorded steps:", f"  df = pd.read_csv({self.path!r})"]
+        lines.extend(f"  {step}" for step in self.steps)
+        lines.append("Optimized plan:")
+        lines.append(f"  scan {self.path} in chunks, keeping the rows with "
+                     + (" and ".join(step.condition() for step in row_steps)
+                        or "anything"))
+        for number, (before, counted_deduplicated) in enumerate(counts):
+            conditions = " and ".join(
+                step.condition() for step in row_steps[:before])
+            lines.append(
+                f"  count_nulls #{number + 1}: missing values of "
+                + (f"the rows with {conditions}" if conditions
+                   else "all rows")
+                + (", over the distinct rows with a missing value"
+                   if counted_deduplicated else ", summed per chunk"))
+        if deduplicated:
+            lines.append("  drop_duplicates() once, on the kept rows")
+        return "\n".join(lines)
+
+    def collect(self, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        Runs the optimized plan, reading the file once in chunks of
+        "chunk_rows" rows, and returns a CleaningResult. Each chunk infers
+        its own dtypes: a column that is text in some chunks and not in
+        others (numbers first, then words) is text in the whole file, so
+        the scan starts over with it read as text from the first chunk.
+        """
+        text_columns = set()
+        while True:
+            result, mixed = self.scan(chunk_rows, text_columns)
+            if result is not None:
+                return result
+            text_columns |= mixed
+
+    def scan(self, chunk_rows, text_columns):
+        """
+        One pass of collect(), with "text_columns" read as text. Returns
+        (the CleaningResult, None), or (None, the columns found to be text
+        in some chunks only) as soon as there are any.
+        """
+        row_steps, deduplicated, counts = self.optimize()
+        options = dict(self.read_options)
+        if text_columns:
+            options["dtype"] = {**options.get("dtype", {}),
+                                **dict.fromkeys(text_columns, "str")}
+        pieces = []
+        encoders = None
+        # The dtypes of every column in every chunk, rows kept or not
+        dtypes = {}
+        totals = [None] * len(counts)
+        null_rows = [[] for _ in counts]
+        with pd.read_csv(self.path, chunksize=chunk_rows,
+                         **options) as reader:
+            for chunk in reader:
+                text = {column for column, dtype in chunk.dtypes.items()
+                        if isinstance(dtype, pd.StringDtype)}
+                if encoders is None:
+                    encoders = {column: TextEncoder(chunk[column].dtype)
+                                for column in text}
+                elif text != set(encoders):
+                    return None, text ^ set(encoders)
+                for column, dtype in chunk.dtypes.items():
+                    dtypes.setdefault(column, set()).add(dtype)
+                # Shared by every dropna() and count_nulls()
+                missing = chunk.isna()
+                # The rows kept by the first k row steps, for every k
+                kept = [np.ones(len(chunk), dtype=bool)]
+                for step in row_steps:
+                    kept.append(kept[-1] & step.keep(chunk, missing))
+                if counts:
+                    has_missing = missing.any(axis=1).to_numpy()
+                for number, (before, counted_deduplicated) in \
+                        enumerate(counts):
+                    if counted_deduplicated:
+                        null_rows[number].append(
+                            chunk[kept[before] & has_missing])
+                    else:
+                        found = missing[kept[before]].sum()
+                        totals[number] = found if totals[number] is None \
+                            else totals[number] + found
+                piece = chunk[kept[-1]]
+                pieces.append(piece.assign(**{
+                    column: encoder.encode(piece[column])
+                    for column, encoder in encoders.items()}))
+
+        nonempty = [piece for piece in pieces if len(piece)]
+        frame = pd.concat(nonempty) if nonempty else pieces[0]
+        del pieces, nonempty
+        if deduplicated:
+            # Equal rows have equal codes
+            frame = frame.drop_duplicates()
+        for column, encoder in encoders.items():
+            frame[column] = encoder.decode(frame[column].to_numpy())
+        # The dtype read_csv() infers from the whole column, which the
+        # chunks whose rows were all dropped have a say in too: float64 for
+        # integers with a missing value in some chunk
+        for column, found in dtypes.items():
+            if column not in encoders and len(found) > 1:
+                frame[column] = frame[column].astype(np.result_type(*found))
+        null_counts = []
+        for number, (_, counted_deduplicated) in enumerate(counts):
+            if counted_deduplicated:
+                rows = [piece for piece in null_rows[number] if len(piece)]
+                found = (pd.concat(rows).drop_duplicates().isna().sum()
+                         if rows else pd.Series(0, index=frame.columns))
+            else:
+                found = totals[number]
+            null_counts.append(found.astype("int64"))
+        return CleaningResult(frame, null_counts), None
+
+    def collect_eager(self):
+        """
+        Runs the steps one after the other on the whole DataFrame, the way
+        the notebooks do; the reference collect() is equal to.
+        """
+        df = pd.read_csv(self.path, **self.read_options)
+        null_counts = []
+        for step in self.steps:
+            if step.kind == "drop_duplicates":
+                df = df.drop_duplicates()
+            elif step.kind == "drop_where":
+                df = df.drop(df[OPERATORS[step.op](df[step.column],
+                                                   step.value)].index)
+            elif step.kind == "dropna":
+                df = df.dropna(subset=None if step.subset is None
+                               else list(step.subset))
+            else:
+                null_counts.append(df.isnull().sum())
+        return CleaningResult(df, null_counts)
+
+
+def scan_csv(path, **read_options):
+    """
+    Starts a cleaning plan on a CSV file; "read_options" are passed to
+    pd.read_csv().
+    """
+    return CleaningPlan(path, **read_options)
+
+
+def notebook_plan(path):
+    """ The cleaning recipe of the notebooks, as a plan. """
+    return (scan_csv(path).drop_duplicates().drop_where("height", "<", 100)
+            .count_nulls().dropna())
+
+
+def generate_persons(path, rows, seed=0, block_rows=1_000_000):
+    """
+    Writes a synthetic persons file of "rows" rows for the notebook recipe:
+    names, emails, countries and heights in centimetres, some of them
+    missing, some under 100, and about 5% of the rows repeating an earlier
+    one.
+    """
+    generator = np.random.default_rng(seed)
+    names = np.array(["Leila", "Samuel", "Rodney", "Marc", "Ana", "Omar",
+                      "Mona", "Yuki", "Ivan", "Sara"])
+    countries = np.array(["France", "Egypt", "Madagascar", "Brazil",
+                          "Japan", "Canada", "Kenya", "India"])
+    with open(path, "w", newline="") as f:
+        f.write("first name,email,country,height\n")
+        for first in range(0, rows, block_rows):
+            count = min(block_rows, rows - first)
+            name = names[generator.integers(len(names), size=count)]
+            number = generator.integers(100_000, size=count).astype(str)
+            country = countries[generator.integers(len(countries),
+                                                   size=count)].astype(object)
+            country[generator.random(count) < 0.02] = None
+            height = generator.integers(50, 210, size=count) \
+                .astype("float64")
+            height[generator.random(count) < 0.01] = np.nan
+            block = pd.DataFrame({
+                "first name": name,
+                "email": np.char.add(np.char.add(np.char.lower(name), "_"),
+                                     np.char.add(number, "@example.com")),
+                "country": country,
+                "height": pd.array(height, dtype="Int64"),
+            })
+            # Repeat earlier rows of the block
+            repeats = generator.random(count) < 0.05
+            sources = (generator.random(repeats.sum())
+                       * np.flatnonzero(repeats)).astype(np.int64)
+            block.iloc[np.flatnonzero(repeats)] = block.iloc[sources].values
+            block.to_csv(f, header=False, index=False)
+
+
+# Small files whose chunks of two rows infer different dtypes, with the
+# plan collect() is checked against collect_eager() on
+EDGE_CASES = [
+    # A chunk with a missing height, all of whose rows are dropped
+    ("name,email,country,height\na,x,Egypt,150\nb,y,Egypt,160\n"
+     "c,z,,170\nc,z,,\nd,w,Egypt,50\n", notebook_plan),
+    # A text column whose first values look like numbers
+    ("name,code,height\na,12,150\nb,012,160\nc,x7,170\nc,x7,170\n",
+     notebook_plan),
+    # Text after a chunk where the column is missing altogether
+    ("name,country,height\na,,150\nb,,160\nc,Egypt,170\n",
+     lambda path: scan_csv(path).drop_duplicates().count_nulls()),
+]
+
+
+def check_edge_cases(workdir):
+    """
+    Raises AssertionError unless collect(), in chunks of two rows, gives
+    the result of collect_eager() on every one of EDGE_CASES.
+    """
+    path = os.path.join(workdir, "edge_case.csv")
+    for text, make_plan in EDGE_CASES:
+        with open(path, "w") as f:
+            f.write(text)
+        plan = make_plan(path)
+        found, expected = plan.collect(chunk_rows=2), plan.collect_eager()
+        pd.testing.assert_frame_equal(found.frame, expected.frame)
+        for counts, expected_counts in zip(found.null_counts,
+                                           expected.null_counts, strict=True):
+            pd.testing.assert_series_equal(counts, expected_counts)
+
+
+def result_digest(result):
+    """
+    A digest of a CleaningResult: its rows with their index labels, its
+    dtypes and its null counts, for comparing results across processes.
+    """
+    digest = hashlib.sha256(
+        pd.util.hash_pandas_object(result.frame).to_numpy().tobytes())
+    digest.update(repr(list(result.frame.dtypes.astype(str))).encode())
+    for counts in result.null_counts:
+        digest.update(counts.to_json().encode())
+    return digest.hexdigest()
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process alone, in MB: VmHWM, which
+    starts over at exec, where getrusage()'s ru_maxrss carries the peak of
+    the process that started this one.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise OSError("VmHWM is not in /proc/self/status.")
+
+
+def measure(mode, path, chunk_rows):
+    """ Runs the notebook recipe one way and returns its figures. """
+    plan = notebook_plan(path)
+    start = time.perf_counter()
+    result = plan.collect_eager() if mode == "eager" \
+        else plan.collect(chunk_rows)
+    return {"seconds": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(), "rows": len(result.frame),
+            "digest": result_digest(result)}
+
+
+def benchmark(rows, chunk_rows):
+    """
+    Runs the notebook recipe eagerly and as an optimized plan on a
+    synthetic file of "rows" rows, each in a fresh process so that its peak
+    RSS is its own, and checks that both give the same result.
+    """
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "persons.csv")
+    try:
+        check_edge_cases(workdir)
+        generate_persons(path, rows)
+        print(notebook_plan(path).explain())
+        print(f"\n{'recipe':<8} {'seconds':>8} {'peak RSS MB':>12} "
+              f"{'rows kept':>10}")
+        digests = set()
+        for mode in ("eager", "plan"):
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), path,
+                 "--measure", mode, "--chunk-rows", str(chunk_rows)],
+                stdout=subprocess.PIPE, text=True, check=True)
+            result = json.loads(completed.stdout)
+            digests.add(result["digest"])
+            print(f"{mode:<8} {result['seconds']:>8.2f} "
+                  f"{result['peak_rss_mb']:>12.1f} {result['rows']:>10}")
+        if len(digests) != 1:
+            raise AssertionError("The plan and the eager recipe differ.")
+        print("The plan and the eager recipe give the same result.")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the notebooks' cleaning recipe on a CSV file as an "
+                    "optimized, streaming plan."
+    )
+    parser.add_argument(
+        "file",
+        help="The CSV file to clean (with a numeric height column).",
+        nargs="?"
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        help=f"Rows read at a time (default: {DEFAULT_CHUNK_ROWS}).",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS
+    )
+    parser.add_argument(
+        "--benchmark",
+        help="Compare the plan with the eager recipe on a synthetic file "
+             "of --rows rows.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--rows",
+        help="Rows of the benchmark file (default: 10000000).",
+        type=int,
+        default=10_000_000
+    )
+    parser.add_argument(
+        "--measure",
+        help=argparse.SUPPRESS,
+        choices=["eager", "plan"],
+        default=None
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.rows, args.chunk_rows)
+    elif args.file is None:
+        parser.error("the following arguments are required: file")
+    elif args.measure is not None:
+        print(json.dumps(measure(args.measure, args.file, args.chunk_rows)))
+    else:
+        plan = notebook_plan(args.file)
+        print(plan.explain())
+        result = plan.collect(args.chunk_rows)
+        print("\nMissing values:")
+        print(result.null_counts[0].to_string())
+        print(f"\n{len(result.frame)} rows kept.")
@@ -0,0 +1,407 @@
+# -----------------------------------------------------------------------------
+# Normalization of messy person records, such as persons.csv.
+#
+# The activity cleans each column by hand, value by value. Here every column
+# is normalized as a whole, one batch of rows at a time:
+#   - dates come as 23/01/1990, 04/25/1975 or 12 sept. 1984. Each value is
+#     reduced to its shape (digits become 9, letters a: 99/99/9999), and the
+#     formats of a shape are detected the first time it is met, by trying
+#     DATE_FORMATS on its values, then cached for the next batches. Every
+#     shape is then parsed by pd.to_datetime() with its formats, the best
+#     first: 04/25/1975, which cannot be day first, falls through to month
+#     first. Month names (sept., Sept, sep, déc.) are made "Sep", "Dec" first.
+#   - heights come as 1.49m, 153cm or 1,62 m: one regular expression pulls
+#     out the number and the unit of the whole column, and the column becomes
+#     height_m, a float in metres. A bare number is in metres up to
+#     MAX_METRES, in centimetres above.
+#   - emails come as one address or a comma-joined list: "email" keeps the
+#     first address and "emails" lists all of them, lowercased.
+# Dates and heights repeat, so only the distinct values of a batch are
+# parsed, and spread back to its rows by their codes. Values that cannot be
+# read become missing (NaT or NaN).
+#
+# Usage:
+#     python normalize_persons.py persons.csv -o persons_clean.csv
+#     python normalize_persons.py --benchmark --rows 1000000
+#
+#     from normalize_persons import DateParser, normalize_batch
+#     clean = normalize_batch(pd.read_csv("persons.csv"), DateParser())
+# -----------------------------------------------------------------------------
+
+import argparse
+import datetime
+import re
+import string
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BATCH_ROWS = 100_000
+
+# The date formats tried on every new shape of value, in this order when as
+# many values parse with two of them (01/02/2000 is day first)
+DATE_FORMATS = ["%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y",
+                "%d %b %Y", "%b %d %Y", "%d %b, %Y", "%b %d, %Y"]
+
+# The values of a new shape its formats are detected on
+DETECT_ROWS = 1000
+
+# Month names, in English and French, by the prefix they are known by
+MONTHS = {"jan": "Jan", "feb": "Feb", "fév": "Feb", "fev": "Feb",
+          "mar": "Mar", "apr": "Apr", "avr": "Apr", "may": "May",
+          "mai": "May", "jun": "Jun", "juin": "Jun", "jul": "Jul",
+          "juil": "Jul", "aug": "Aug", "aoû": "Aug", "aou": "Aug",
+          "sep": "Sep", "oct": "Oct", "nov": "Nov", "dec": "Dec",
+          "déc": "Dec"}
+# A month name, the rest of the word and an abbreviation dot
+MONTH_RE = re.compile(
+    r"(?i)\b(" + "|".join(sorted(MONTHS, key=len, reverse=True))
+    + r")[^\W\d_]*\.?")
+
+# Maps every ASCII digit to 9 and letter to a, for the shape of a value
+SHAPE_TABLE = str.maketrans(string.digits + string.ascii_letters,
+                            "9" * 10 + "a" * 52)
+
+# A height: a number, with a decimal point or comma, and an optional unit
+HEIGHT_RE = r"^\s*(\d+(?:[.,]\d*)?)\s*([^\W\d_]*)\s*$"
+
+# Metres per unit of height
+HEIGHT_UNITS = {"m": 1.0, "cm": 0.01, "mm": 0.001}
+
+# The largest height a bare number is taken to be in metres
+MAX_METRES = 3.0
+
+# The columns normalize_batch() normalizes
+DATE_COLUMN, HEIGHT_COLUMN, EMAIL_COLUMN = "date_of_birth", "height", "email"
+
+
+def month_names(values):
+    """ Replaces the month names of a Series of strings by "Jan" to "Dec". """
+    return values.str.replace(
+        MONTH_RE, lambda match: MONTHS[match.group(1).lower()], regex=True)
+
+
+class DateParser:
+    """
+    Parses columns of dates written in any of "formats", a batch at a time.
+    The formats of each shape of value are detected on the first batch the
+    shape occurs in and kept in "cache" for the batches after it.
+    """
+
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = list(formats)
+        self.cache = {}
+
+    def detect(self, values):
+        """
+        Returns the formats to parse a group of values of one shape with:
+        every format, those that parse the most of its first DETECT_ROWS
+        values first.
+        """
+        values = values.iloc[:DETECT_ROWS]
+        parsed = [pd.to_datetime(values, format=date_format,
+                                 errors="coerce").notna().sum()
+                  for date_format in self.formats]
+        order = sorted(range(len(self.formats)), key=lambda i: -parsed[i])
+        return [self.formats[i] for i in order]
+
+    def parse(self, series):
+        """
+        Returns a datetime64 Series of the dates in a Series of strings,
+        NaT where a value is missing or no format parses it.
+        """
+        codes, uniques = pd.factorize(series)
+        dates = self.parse_distinct(pd.Series(uniques, dtype="str"))
+        return pd.Series(np.append(dates, np.datetime64("NaT"))[codes],
+                         index=series.index, name=series.name)
+
+    def parse_distinct(self, values):
+        """ The dates of a Series of distinct strings, as an array. """
+        result = pd.Series(pd.NaT, index=values.index,
+                           dtype="datetime64[ns]")
+        values = values.str.strip()
+        shapes, uniques = pd.factorize(values.str.translate(SHAPE_TABLE))
+        for code, shape in enumerate(uniques):
+            rows = np.flatnonzero(shapes == code)
+            group = values.iloc[rows]
+            if "a" in shape:
+                group = month_names(group)
+            formats = self.cache.get(shape)
+            if formats is None:
+                formats = self.cache[shape] = self.detect(group)
+            # Each format parses what the formats before it could not
+            for date_format in formats:
+                dates = pd.to_datetime(group, format=date_format,
+                                       errors="coerce")
+                found = dates.notna().to_numpy()
+                result.iloc[rows[found]] = dates[found]
+                rows, group = rows[~found], group[~found]
+                if not len(rows):
+                    break
+        return result.to_numpy()
+
+
+def parse_heights(series):
+    """
+    Returns the heights of a Series of strings in metres: 1.49m, 153cm,
+    1,62 m or a bare number; NaN for a missing or unknown value or unit.
+    """
+    # Heights repeat: only the distinct values are parsed
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(uniques, dtype="str").str.extract(HEIGHT_RE)
+    numbers = parts[0].str.replace(",", ".").astype("float64").to_numpy()
+    units = parts[1].str.lower()
+    bare = (units == "").to_numpy(dtype=bool, na_value=False)
+    factors = np.where(bare, np.where(numbers > MAX_METRES, 0.01, 1.0),
+                       units.map(HEIGHT_UNITS).astype("float64"))
+    return pd.Series(np.append(numbers * factors, np.nan)[codes],
+                     index=series.index, name="height_m")
+
+
+def split_emails(series):
+    """
+    Returns the first address of a Series of comma-joined emails and the
+    list of all its addresses, lowercased, with spaces removed.
+    """
+    addresses = series.str.lower().str.replace(" ", "").str.split(",")
+    first = addresses.str[0].astype("str")
+    return first, addresses.rename("emails")
+
+
+def normalize_batch(frame, dates):
+    """
+    Normalizes the dates, heights and emails of a DataFrame of person
+    records, column by column, with a DateParser "dates" shared between
+    batches. Returns a new DataFrame, with height_m instead of height and
+    the "emails" list after "email"; other columns are kept as they are.
+    """
+    columns = {}
+    for column in frame.columns:
+        if column == DATE_COLUMN:
+            columns[column] = dates.parse(frame[column])
+        elif column == HEIGHT_COLUMN:
+            columns["height_m"] = parse_heights(frame[column])
+        elif column == EMAIL_COLUMN:
+            columns[column], columns["emails"] = split_emails(frame[column])
+        else:
+            columns[column] = frame[column]
+    return pd.DataFrame(columns)
+
+
+def normalize_csv(path, batch_rows=DEFAULT_BATCH_ROWS, dates=None):
+    """
+    Yields the normalized batches of "batch_rows" rows of a CSV file, read
+    as text. All batches share one DateParser, so that a date format is
+    detected once.
+    """
+    dates = DateParser() if dates is None else dates
+    with pd.read_csv(path, dtype="str", chunksize=batch_rows) as reader:
+        for batch in reader:
+            yield normalize_batch(batch, dates)
+
+
+def parse_date_value(value):
+    """ One date the way the activity reads them: format after format. """
+    if not isinstance(value, str):
+        return pd.NaT
+    value = MONTH_RE.sub(lambda match: MONTHS[match.group(1).lower()],
+                         value.strip())
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return pd.NaT
+
+
+def parse_height_value(value):
+    """ One height in metres, the way the activity reads them. """
+    if not isinstance(value, str):
+        return np.nan
+    match = re.match(HEIGHT_RE, value)
+    if match is None:
+        return np.nan
+    number = float(match.group(1).replace(",", "."))
+    unit = match.group(2).lower()
+    if not unit:
+        return number / 100 if number > MAX_METRES else number
+    return number * HEIGHT_UNITS.get(unit, np.nan)
+
+
+def split_email_value(value):
+    """ The addresses of one comma-joined email value. """
+    if not isinstance(value, str):
+        return np.nan
+    return value.lower().replace(" ", "").split(",")
+
+
+def normalize_rowwise(frame):
+    """
+    normalize_batch() the way it is usually written, with apply() and a
+    Python function per value: the reference for checking and
+    benchmarking it.
+    """
+    columns = {}
+    for column in frame.columns:
+        if column == DATE_COLUMN:
+            columns[column] = frame[column].apply(parse_date_value) \
+                .astype("datetime64[ns]")
+        elif column == HEIGHT_COLUMN:
+            columns["height_m"] = frame[column].apply(parse_height_value) \
+                .astype("float64")
+        elif column == EMAIL_COLUMN:
+            emails = frame[column].apply(split_email_value)
+            columns[column] = emails.apply(
+                lambda addresses: addresses[0]
+                if isinstance(addresses, list) else np.nan).astype("str")
+            columns["emails"] = emails
+        else:
+            columns[column] = frame[column]
+    return pd.DataFrame(columns)
+
+
+def generate_persons(rows, seed=0):
+    """
+    Returns "rows" synthetic person records as text, as messy as
+    persons.csv: dates day first, month first where the day is over 12, with
+    English or French month names and in ISO format, heights in m or cm,
+    with a decimal comma or none, and one to three emails per person. About
+    5% of the dates and heights are missing.
+    """
+    generator = np.random.default_rng(seed)
+    names = np.array(["Leila", "Samuel", "Rodney", "Marc", "Harry", "Hanna",
+                      "samuël", "Yuki", "Omar", "Ana"])
+    month_words = np.array(["janv.", "Feb", "mars", "avr.", "May", "juin",
+                            "juil.", "août", "sept.", "Oct", "nov.",
+                            "déc."])
+
+    def text(numbers, width=2):
+        return pd.Series(numbers).astype("str").str.zfill(width)
+
+    day = generator.integers(1, 29, size=rows)
+    month = generator.integers(1, 13, size=rows)
+    year = text(generator.integers(1940, 2010, size=rows), 4)
+    style = generator.random(rows)
+    dates = np.where(
+        style < 0.6, text(day) + "/" + text(month) + "/" + year,
+        np.where(
+            (style < 0.75) & (day > 12),
+            text(month) + "/" + text(day) + "/" + year,
+            np.where(style < 0.9,
+                     pd.Series(day).astype("str") + " "
+                     + month_words[month - 1] + " " + year,
+                     year + "-" + text(month) + "-" + text(day))))
+
+    centimetres = generator.integers(140, 200, size=rows)
+    style = generator.random(rows)
+    heights = np.where(
+        style < 0.45,
+        pd.Series(centimetres / 100).map("{:.2f}m".format),
+        np.where(style < 0.9, text(centimetres, 3) + "cm",
+                 pd.Series(centimetres / 100)
+                 .map("{:.2f} m".format).str.replace(".", ",")))
+
+    name = names[generator.integers(len(names), size=rows)]
+    handles = pd.Series(np.char.lower(name.astype(str))) + "_" \
+        + text(generator.integers(10_000, size=rows), 4)
+    emails = handles + "@example.com"
+    extra = generator.random(rows)
+    emails = np.where(extra < 0.2, emails + ", " + handles + "@supermail.eu",
+                      emails)
+    emails = np.where(extra < 0.05, emails + ",  " + handles + "@mail.org",
+                      emails)
+
+    frame = pd.DataFrame({
+        "first name": name, "email": emails,
+        DATE_COLUMN: dates, "country": "France", HEIGHT_COLUMN: heights,
+    }, dtype="str")
+    for column in (DATE_COLUMN, HEIGHT_COLUMN):
+        frame.loc[generator.random(rows) < 0.05, column] = np.nan
+    return frame
+
+
+def benchmark(rows, batch_rows):
+    """
+    Normalizes "rows" synthetic records in batches with normalize_batch()
+    and with normalize_rowwise(), reports the rows per second of each, and
+    checks that both give the same records.
+    """
+    frame = generate_persons(rows)
+    dates = DateParser()
+    results = {}
+    for label, normalize in (
+            ("column-at-a-time", lambda batch: normalize_batch(batch, dates)),
+            ("row-wise apply", normalize_rowwise)):
+        start = time.perf_counter()
+        results[label] = pd.concat(
+            [normalize(frame.iloc[first:first + batch_rows])
+             for first in range(0, rows, batch_rows)])
+        seconds = time.perf_counter() - start
+        print(f"{label:<17} {seconds:>8.2f} s {rows / seconds:>12,.0f} "
+              f"rows/s")
+    found, expected = results.values()
+    if found["emails"].tolist() != expected["emails"].tolist():
+        raise AssertionError("The emails differ.")
+    pd.testing.assert_frame_equal(found.drop(columns="emails"),
+                                  expected.drop(columns="emails"))
+    print("Both ways give the same records; date formats by shape:")
+    for shape, formats in dates.cache.items():
+        print(f"  {shape:<15} {', '.join(formats[:2])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Normalize the dates, heights and emails of person "
+                    "records, a batch of rows at a time."
+    )
+    parser.add_argument(
+        "file",
+        help="The CSV file of person records (such as persons.csv).",
+        nargs="?"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="Write the normalized records to this CSV file instead of "
+             "printing them, with the emails joined by ';'.",
+        default=None
+    )
+    parser.add_argument(
+        "--batch-rows",
+        help=f"Rows normalized at a time (default: {DEFAULT_BATCH_ROWS}).",
+        type=int,
+        default=DEFAULT_BATCH_ROWS
+    )
+    parser.add_argument(
+        "--benchmark",
+        help="Compare with row-wise apply() on --rows synthetic records.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--rows",
+        help="Synthetic records of the benchmark (default: 1000000).",
+        type=int,
+        default=1_000_000
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.rows, args.batch_rows)
+    elif args.file is None:
+        parser.error("the following arguments are required: file")
+    else:
+        rows = 0
+        start = time.perf_counter()
+        for number, batch in enumerate(normalize_csv(args.file,
+                                                     args.batch_rows)):
+            rows += len(batch)
+            if args.output is None:
+                print(batch.to_string())
+            else:
+                # One cell per record: the addresses joined by ";"
+                batch = batch.assign(emails=batch["emails"].str.join(";"))
+                batch.to_csv(args.output, mode="w" if number == 0 else "a",
+                             header=number == 0, index=False)
+        seconds = time.perf_counter() - start
+        print(f"{rows} rows normalized in {seconds:.3f} s "
+              f"({rows / seconds:,.0f} rows/s).")
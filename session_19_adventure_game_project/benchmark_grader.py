@@ -0,0 +1,816 @@
+# -----------------------------------------------------------------------------
+# Benchmarks for the adventure-game grader
+# (unittest_adventure_game_deci-lvl2_v2.py).
+#
+# Generates synthetic student submissions of growing size and times the
+# grader's building blocks on them, so that a change that makes grading
+# slower shows up before a whole cohort is graded with it.
+#
+# Usage:
+#     python benchmark_grader.py detector
+#     python benchmark_grader.py detector --sizes 100 1000 50000
+#     python benchmark_grader.py comments --sizes 2000
+#     python benchmark_grader.py latency --sizes 100 1000
+#     python benchmark_grader.py forkpool --sizes 200
+#     python benchmark_grader.py lines --sizes 20000
+#     python benchmark_grader.py regrade --sizes 300
+#     python benchmark_grader.py store --sizes 100000
+#     python benchmark_grader.py startup --sizes 20
+#     python benchmark_grader.py suite --sizes 50 1000 100000
+#
+# Benchmarks that return measurements are compared with the baseline file
+# (benchmark_baseline.json): the run fails when one of them is worse than
+# its baseline by more than --threshold percent. --update-baseline records
+# the measurements of the run instead. They are absolute timings of the
+# machine they were recorded on: record the baseline again, with
+# --update-baseline, on the machine the comparisons are to run on.
+# -----------------------------------------------------------------------------
+
+import argparse
+import ast
+import functools
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GRADER_PATH = os.path.join(HERE, "unittest_adventure_game_deci-lvl2_v2.py")
+CLIENT_PATH = os.path.join(HERE, "grade_client.py")
+BASELINE_PATH = os.path.join(HERE, "benchmark_baseline.json")
+
+# The least time a check of the regression suite must take over a corpus to
+# be measured: below it, the check's work is done in setUpClass() and what
+# is left is timer noise
+MIN_TIMED_SECONDS = 0.005
+
+
+def load_grader():
+    """
+    Imports the grader script as a module. Its file name is not a valid
+    module name, so it is loaded from its path.
+    """
+    spec = importlib.util.spec_from_file_location("adventure_grader",
+                                                  GRADER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_function(index, depth=3):
+    """
+    Returns the lines of one adventure-game style function: a comment, a
+    score update, an input() validated by a while loop and "depth" levels of
+    nested if statements.
+    """
+    lines = [
+        f"def scene_{index}(score):",
+        f"    # scene number {index}",
+        "    while True:",
+        f"        choice = input(\"Scene {index}: enter 1 or 2\\n\")",
+    ]
+    indent = "        "
+    for level in range(depth):
+        lines.append(f"{indent}if choice == \"{level % 2 + 1}\":")
+        indent += "    "
+        lines.append(f"{indent}score += {level + 1}")
+    lines.append(f"{indent}print(\"Your score is \" + str(score))")
+    lines.append("        if choice in [\"1\", \"2\"]:")
+    lines.append("            return score")
+    lines.append("")
+    lines.append("")
+    return lines
+
+
+def generate_submission(target_lines, depth=3, functions=None):
+    """
+    Builds a syntactically valid submission of roughly "target_lines" lines
+    out of generated scene functions, or of exactly "functions" functions
+    when that is given.
+    """
+    lines = ["import time", "import random", "", ""]
+    index = 0
+    while (index < functions if functions is not None
+           else len(lines) < target_lines):
+        lines.extend(generate_function(index, depth))
+        index += 1
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+
+def generate_scene(index):
+    """ The function of a plain submission: generate_function(). """
+    return generate_function(index)
+
+
+def generate_nested(index):
+    """ A function whose if statements are nested twelve levels deep. """
+    return generate_function(index, depth=12)
+
+
+def generate_step(index):
+    """ A tiny function: submissions made of these have many functions. """
+    return [
+        f"def step_{index}(score):",
+        f"    # step number {index}",
+        f"    return score + {index % 7}",
+        "",
+        "",
+    ]
+
+
+def generate_speech(index):
+    """
+    A function with lines far longer than 79 characters: a comment, a
+    print() call and a condition.
+    """
+    words = " ".join(f"word{number}" for number in range(index % 5, 30))
+    return [
+        f"def speech_{index}(score):",
+        f"    # The narrator reads speech {index} aloud: {words}",
+        f"    print(\"Speech {index}: {words}\")",
+        f"    if score > {index} and score < {index * 2 + 100} and "
+        f"score != {index + 3} and score != {index + 5}:",
+        "        score += 1",
+        "    return score",
+        "",
+        "",
+    ]
+
+
+def generate_dialogue(index):
+    """
+    A function that mixes single, double and triple quotes, f-strings and
+    "#" inside strings, which must not be taken for comments.
+    """
+    return [
+        f"def dialogue_{index}(score):",
+        f"    \'\'\'Dialogue {index}, told with every kind of quote.\'\'\'",
+        "    name = 'traveller'",
+        f"    print(f\"Hello {{name}}, it's scene #{index}\")",
+        "    print('The \"wizard\" says: ' + \"it's late\")",
+        "    print(f'{name!r} has {score} points and says \"go\"')",
+        "    note = \"\"\"A triple-quoted note",
+        "    with 'quotes', \"quotes\" and # no comment",
+        "    \"\"\"",
+        "    score += len(note) - 10  # a comment with 'quotes'",
+        "    return score",
+        "",
+        "",
+    ]
+
+
+# The shapes of submission in the benchmark corpus, each made of one kind
+# of generated function
+CORPUS_SHAPES = {
+    "scenes": generate_scene,
+    "nested": generate_nested,
+    "functions": generate_step,
+    "long lines": generate_speech,
+    "quotes": generate_dialogue,
+}
+
+
+def generate_corpus_submission(shape, target_lines):
+    """
+    Builds a syntactically valid submission of roughly "target_lines" lines
+    out of the functions of one of the CORPUS_SHAPES, with the imports and
+    the main loop every adventure game has.
+    """
+    generate = CORPUS_SHAPES[shape]
+    lines = ["import time", "import random", "", ""]
+    index = 0
+    function = generate(index)
+    # At least one function, and as many more as fit
+    while index == 0 or len(lines) + len(function) <= target_lines - 9:
+        lines.extend(function)
+        index += 1
+        function = generate(index)
+    lines.extend([
+        "def play_game():",
+        "    # Plays every scene, in a random order",
+        "    score = 0",
+        "    while score < 100:",
+        "        time.sleep(random.choice([0.5, 1]))",
+        "        score += random.randint(1, 10)",
+        "",
+        "",
+        "play_game()",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def index_submission(grader, source, path="generated.py"):
+    """ Builds the grader's SourceIndex for a generated submission. """
+    return grader.SourceIndex.from_bytes(path, source.encode("utf-8"))
+
+
+def run_check(grader, index, method_name):
+    """
+    Runs one AdventureGameTests method against an already built SourceIndex,
+    without going through setUpClass, and returns the unittest result.
+    """
+    tests = grader.AdventureGameTests
+    tests.index = index
+    tests.file_content = index.text
+    tests.tree = index.tree
+    result = unittest.TestResult()
+    tests(method_name).run(result)
+    return result
+
+
+def time_call(function, *args, repeat=3):
+    """ Returns the best wall time, in seconds, of "repeat" calls. """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_detector(grader, sizes):
+    """
+    Times a full StudentFileDetector traversal on generated submissions of
+    the given sizes and prints the time per line. Linear scaling shows up as
+    a flat microseconds-per-line column.
+    """
+    print(f"{'lines':>8} {'seconds':>10} {'us/line':>10}")
+    for size in sizes:
+        tree = ast.parse(generate_submission(size))
+
+        def run():
+            grader.StudentFileDetector().visit(tree)
+
+        seconds = time_call(run)
+        print(f"{size:>8} {seconds:>10.4f} {seconds / size * 1e6:>10.2f}")
+
+
+def bench_function_comments(grader, sizes):
+    """
+    Times test_function_comments on submissions with the given numbers of
+    functions. The check is linear, so the time per function stays flat.
+    Every run starts from the index as it was built, without the function
+    summary an earlier run cached on it.
+    """
+    print(f"{'functions':>10} {'seconds':>10} {'us/function':>12}")
+    for count in sizes:
+        index = index_submission(
+            grader, generate_submission(None, functions=count))
+        built = dict(vars(index))
+
+        def run():
+            vars(index).clear()
+            vars(index).update(built)
+            run_check(grader, index, "test_function_comments")
+
+        seconds = time_call(run)
+        print(f"{count:>10} {seconds:>10.4f} {seconds / count * 1e6:>12.2f}")
+
+
+def percentiles(samples):
+    """ Returns the p50 and p99 of a list of timings, in milliseconds. """
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49] * 1000, cuts[98] * 1000
+
+
+def time_process(argv, requests):
+    """ Times "requests" runs of a command, discarding its output. """
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_latency(grader, sizes, requests=50):
+    """
+    Compares per-submission latency of the cold command line (a fresh
+    grader process per file) with the grading server, both through the
+    thin client process and over an already open connection. The cache is
+    disabled so every request is really graded.
+    """
+    import grade_client
+
+    workdir = tempfile.mkdtemp()
+    socket_path = os.path.join(workdir, "grader.sock")
+    server = subprocess.Popen(
+        [sys.executable, GRADER_PATH, "--serve", socket_path, "--no-cache"],
+        stdout=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.05)
+        print(f"{'lines':>8} {'path':>18} {'p50 ms':>10} {'p99 ms':>10}")
+        for size in sizes:
+            path = os.path.join(workdir, f"submission_{size}.py")
+            with open(path, "w") as f:
+                f.write(generate_submission(size))
+            with open(path, "rb") as f:
+                raw = f.read()
+
+            timings = {
+                "cold CLI": time_process(
+                    [sys.executable, GRADER_PATH, path, "--no-cache"],
+                    requests),
+                "client process": time_process(
+                    [sys.executable, CLIENT_PATH, path,
+                     "--socket", socket_path], requests),
+            }
+            samples = []
+            with grade_client.connect(socket_path) as connection:
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    grade_client.request_grade(connection, path, raw)
+                    samples.append(time.perf_counter() - start)
+            timings["open connection"] = samples
+
+            for name, samples in timings.items():
+                p50, p99 = percentiles(samples)
+                print(f"{size:>8} {name:>18} {p50:>10.1f} {p99:>10.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_fork_pool_timeouts(pool, runs=20):
+    """
+    Raises AssertionError unless runs past a wall limit of 0 come back
+    timed out from the same worker of "pool", which also covers a deadline
+    passing before the forked child has made its process group.
+    """
+    worker = pool.idle.queue[0]
+    for _ in range(runs):
+        run = pool.run("import time; time.sleep(1)", wall_limit=0)
+        assert run.timed_out, run
+        assert pool.idle.queue[0] is worker, "The worker died."
+
+
+def bench_fork_pool(grader, sizes):
+    """
+    Compares the time per run of a student game started with
+    subprocess.run and forked from a warm ForkServerPool worker, for a
+    trivial script and for a scripted playthrough through game_runner. Here
+    "sizes" are numbers of runs.
+    """
+    import game_runner
+    from fork_pool import ForkServerPool
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "submission.py")
+    with open(path, "w") as f:
+        f.write(generate_submission(None, functions=4) +
+                "\n\nscene_0(0)\n")
+    workloads = {
+        "print(1)": ("print(1)", ["-c"]),
+        "playthrough": (game_runner.CHILD_BOOTSTRAP,
+                        ["-c", '{"answers": ["1"], "seed": 0}', path]),
+    }
+    print(f"{'runs':>6} {'workload':>12} {'subprocess ms':>14} "
+          f"{'fork pool ms':>13} {'speed-up':>9}")
+    try:
+        with ForkServerPool(workers=1) as pool:
+            check_fork_pool_timeouts(pool)
+            pool.run("pass")
+            for runs in sizes:
+                for name, (code, argv) in workloads.items():
+                    cold = sum(time_process(
+                        [sys.executable, "-c", code] + argv[1:], runs))
+                    start = time.perf_counter()
+                    for _ in range(runs):
+                        pool.run(code, argv)
+                    warm = time.perf_counter() - start
+                    print(f"{runs:>6} {name:>12} {cold / runs * 1000:>14.2f} "
+                          f"{warm / runs * 1000:>13.2f} "
+                          f"{cold / warm:>8.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def legacy_line_checks(lines):
+    """
+    The per-line, per-character loop test_pep8_compliance used before
+    lint_lines(), kept here only as the reference for the lines benchmark.
+    It is run on clean submissions, where it never stops early.
+    """
+    single_quotes = []
+    double_quotes = []
+    for line_number, line in enumerate(lines, start=1):
+        assert "\t" not in line
+        assert len(line) < 80
+        assert not ("," in line and line.lstrip().startswith("import "))
+        in_string = None
+        in_comment = False
+        for char in line:
+            if char == "#" and in_string is None:
+                in_comment = True
+            if in_comment:
+                continue
+            if char == '"' and in_string != "'":
+                if in_string == '"':
+                    in_string = None
+                else:
+                    double_quotes.append(line_number)
+                    in_string = '"'
+            elif char == "'" and in_string != '"':
+                if in_string == "'":
+                    in_string = None
+                else:
+                    single_quotes.append(line_number)
+                    in_string = "'"
+        assert not (single_quotes and double_quotes)
+        assert len(line) == len(line.rstrip())
+        if line.lstrip().startswith("def "):
+            func_name = line.lstrip()[4:].split("(")[0].strip()
+            assert re.match("^[a-z_][a-z0-9_]*$", func_name)
+
+
+def bench_line_checks(grader, sizes):
+    """
+    Times the fused lint_lines() pass against the legacy per-character
+    loop on clean generated submissions, where both look at every line.
+    """
+    print(f"{'lines':>8} {'legacy s':>10} {'fused s':>10} {'speed-up':>9}")
+    for size in sizes:
+        index = index_submission(grader, generate_submission(size))
+        legacy = time_call(legacy_line_checks, index.lines)
+        fused = time_call(grader.lint_lines, index)
+        print(f"{size:>8} {legacy:>10.4f} {fused:>10.4f} "
+              f"{legacy / fused:>8.1f}x")
+
+
+def bench_regrade(grader, sizes, edits=5):
+    """
+    Times regrading a submission after a comment in one of its functions
+    was edited: from scratch, and incrementally, with a cache that holds
+    the results of every function of the previous version. Each edit
+    touches another function, so no whole-file verdict is ever replayed.
+    """
+    workdir = tempfile.mkdtemp()
+    cache_path = os.path.join(workdir, "cache.sqlite3")
+    print(f"{'lines':>8} {'full ms':>10} {'regrade ms':>11} {'speed-up':>9}")
+    try:
+        for size in sizes:
+            source = generate_submission(size)
+            path = f"submission_{size}.py"
+            grader.grade_source(path, source.encode(), cache_path=cache_path)
+            edited = [source.replace(f"# scene number {number}\n",
+                                     f"# scene number {number}, edited\n")
+                      .encode() for number in range(edits)]
+            full = min(time_call(grader.grade_source, path, raw, repeat=1)
+                       for raw in edited)
+            incremental = min(time_call(grader.grade_source, path, raw,
+                                        False, cache_path, repeat=1)
+                              for raw in edited)
+            print(f"{size:>8} {full * 1000:>10.2f} "
+                  f"{incremental * 1000:>11.2f} {full / incremental:>8.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def generate_records(results, checks=8, seed=0):
+    """
+    Generates grader records (the JSON lines of batch mode) holding about
+    "results" check outcomes in all, spread over four cohorts of five
+    groups, graded over six months, with a failure in a quarter of them.
+    """
+    generator = random.Random(seed)
+    start = time.time() - 180 * 86400
+    for number in range(results // checks):
+        outcomes = [generator.random() < 0.75 for _ in range(checks)]
+        yield {
+            "file": f"group_{number % 5}/submission_{number // 20}.py",
+            "valid": True,
+            "successful": all(outcomes),
+            "tests_run": checks,
+            "failures": outcomes.count(False),
+            "errors": 0,
+            "graded_at": start + number * 180 * 86400 * checks / results,
+            "checks": [{
+                "test": f"test_check_{check}",
+                "outcome": "success" if passed else "failure",
+                "failures": [] if passed else [{
+                    "subtest": f"SubTest: check {check}...",
+                    "message": f"The check was met {generator.randrange(3)} "
+                               f"times in your code.",
+                }],
+            } for check, passed in enumerate(outcomes)],
+        }
+
+
+def bench_store(grader, sizes):
+    """
+    Times storing generated records in the results store, and every report
+    of its query CLI over them; "sizes" are numbers of result rows. The
+    reports are expected to come back interactively at 100k rows.
+    """
+    import results_store
+
+    workdir = tempfile.mkdtemp()
+    reports = {
+        "pass-rate": lambda store: store.pass_rate("check"),
+        "by group": lambda store: store.pass_rate("group", "cohort_1"),
+        "latest": lambda store: store.pass_rate("check", latest=True),
+        "failures": lambda store: store.failures(limit=20),
+        "trend": lambda store: store.trend("group", "week"),
+    }
+    print(f"{'results':>8} {'import s':>9} "
+          + " ".join(f"{name + ' ms':>12}" for name in reports))
+    try:
+        for size in sizes:
+            store = results_store.ResultsStore(
+                os.path.join(workdir, f"results_{size}.sqlite3"))
+            try:
+                start = time.perf_counter()
+                records = list(generate_records(size))
+                for cohort in range(4):
+                    store.add_records(records[cohort::4], f"cohort_{cohort}")
+                stored = time.perf_counter() - start
+                timings = [time_call(report, store, repeat=3)
+                           for report in reports.values()]
+            finally:
+                store.close()
+            print(f"{size:>8} {stored:>9.2f} "
+                  + " ".join(f"{timing * 1000:>12.1f}"
+                             for timing in timings))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def import_times(argv):
+    """
+    Runs a command under "python -X importtime" and returns {module:
+    cumulative microseconds} for the modules it imported itself, at the top
+    level of the import tree.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime"] + argv,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        check=False)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench_startup(grader, sizes):
+    """
+    Measures what a single-file invocation costs before any grading is
+    done, the way an editor hook runs the grader: the time spent importing
+    modules, from "-X importtime", and the wall time of the process. The
+    modules every Python process imports are not counted. "sizes" are
+    numbers of runs, of which the medians are reported; the import times
+    are returned to be compared with the baseline.
+    """
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "adventure_game.py")
+    cache_path = os.path.join(workdir, "cache.sqlite3")
+    with open(path, "w") as f:
+        f.write(generate_submission(200))
+    runs = {
+        "help": [GRADER_PATH, "--help"],
+        "cached": [GRADER_PATH, path, "--cache", cache_path],
+        "graded": [GRADER_PATH, path, "--no-cache"],
+    }
+    interpreter = import_times(["-c", "pass"])
+    measurements = {}
+    print(f"{'runs':>6} {'invocation':>11} {'imports ms':>11} "
+          f"{'wall ms':>9}  heaviest imports")
+    try:
+        subprocess.run([sys.executable] + runs["cached"],
+                       stderr=subprocess.DEVNULL, check=False)
+        for size in sizes:
+            for name, argv in runs.items():
+                totals, heaviest = [], {}
+                for _ in range(size):
+                    times = {module: cumulative for module, cumulative
+                             in import_times(argv).items()
+                             if module not in interpreter}
+                    totals.append(sum(times.values()) / 1000)
+                    for module, cumulative in times.items():
+                        heaviest[module] = min(
+                            heaviest.get(module, cumulative), cumulative)
+                wall = statistics.median(time_process(
+                    [sys.executable] + argv, size)) * 1000
+                imports = statistics.median(totals)
+                top = sorted(heaviest, key=heaviest.get, reverse=True)[:4]
+                print(f"{size:>6} {name:>11} {imports:>11.1f} {wall:>9.1f}  "
+                      + ", ".join(f"{module} {heaviest[module] / 1000:.1f}"
+                                  for module in top))
+                measurements[f"startup_{name}_imports_ms"] = imports
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return measurements
+
+
+# The indentation codes test_pep8_compliance asks check_pep8_compliance()
+# about
+PEP8_INDENTATION_CODES = ["E101", "E111", "E112", "E113", "E114", "E115",
+                          "E116", "E117", "E121", "E122", "E123", "E124",
+                          "E125", "E126", "E127", "E128", "E129", "E131",
+                          "E133", "W191"]
+
+
+def suite_checks(grader):
+    """
+    Returns {name: function of the AdventureGameTests class} for every
+    check of the regression suite: remove_comments(), a StudentFileDetector
+    traversal, check_pep8_compliance() and every test method, each run on
+    the SourceIndex setUpClass() built.
+    """
+    tests = grader.AdventureGameTests
+    checks = {
+        "remove_comments": lambda tests: grader.remove_comments(
+            tests.file_content),
+        "StudentFileDetector": lambda tests: grader.StudentFileDetector(
+            tests.rubric).visit(tests.tree),
+        "check_pep8_compliance": lambda tests: grader.check_pep8_compliance(
+            tests.index, PEP8_INDENTATION_CODES),
+    }
+    for name in unittest.TestLoader().getTestCaseNames(tests):
+        checks[name] = functools.partial(
+            lambda tests, name: tests(name).run(unittest.TestResult()),
+            name=name)
+    return checks
+
+
+def time_suite_checks(grader, raw, checks, repeat):
+    """
+    Returns {name: best wall time in seconds of "repeat" runs} for
+    setUpClass() and each of the "checks" on a submission. Every check runs
+    on the SourceIndex as setUpClass() left it: whatever an earlier check
+    computed and cached on it is dropped first, so no check is timed
+    without the work it would do in a real grading.
+    """
+    tests = grader.AdventureGameTests
+    best = dict.fromkeys(["setUpClass"] + list(checks), float("inf"))
+    for _ in range(repeat):
+        tests.source_bytes = raw
+        try:
+            start = time.perf_counter()
+            tests.setUpClass()
+            best["setUpClass"] = min(best["setUpClass"],
+                                     time.perf_counter() - start)
+        finally:
+            tests.source_bytes = None
+        prepared = dict(vars(tests.index))
+        for name, check in checks.items():
+            vars(tests.index).clear()
+            vars(tests.index).update(prepared)
+            start = time.perf_counter()
+            check(tests)
+            best[name] = min(best[name], time.perf_counter() - start)
+    return best
+
+
+def bench_suite(grader, sizes):
+    """
+    The regression suite: runs every check of the grader (see
+    suite_checks()) on a corpus of generated submissions of every one of
+    the CORPUS_SHAPES and of each size in "sizes" (in lines), with
+    pycodestyle on and no cache. Prints the throughput of every check in
+    thousands of lines per second, for each size and overall, and returns
+    them to be compared with the baseline. Small submissions are timed
+    over more runs, keeping the best. A check that takes less than
+    MIN_TIMED_SECONDS on the corpus of a size is printed as "-" and not
+    measured.
+    """
+    grader.file_name = "corpus.py"
+    grader.pycodestyle_run = True
+    checks = suite_checks(grader)
+    corpus = {size: [generate_corpus_submission(shape, size).encode()
+                     for shape in CORPUS_SHAPES] for size in sizes}
+    lines = {size: sum(raw.count(b"\n") for raw in sources)
+             for size, sources in corpus.items()}
+    seconds = {name: dict.fromkeys(sizes, 0.0)
+               for name in ["setUpClass"] + list(checks)}
+    for size, sources in corpus.items():
+        repeat = max(1, min(20, 20000 // size))
+        for raw in sources:
+            for name, timing in time_suite_checks(grader, raw, checks,
+                                                  repeat).items():
+                seconds[name][size] += timing
+
+    measurements = {}
+    print(f"{'klines/s':<32}"
+          + "".join(f"{size:>10}" for size in sizes) + f"{'overall':>10}")
+    for name, timings in seconds.items():
+        timed = [size for size in sizes
+                 if timings[size] >= MIN_TIMED_SECONDS]
+        rates = {size: lines[size] / timings[size] for size in timed}
+        overall = sum(lines[size] for size in timed) \
+            / sum(timings[size] for size in timed) if timed else None
+        print(f"{name:<32}"
+              + "".join(f"{rates[size] / 1000:>10.1f}" if size in rates
+                        else f"{'-':>10}" for size in sizes)
+              + (f"{overall / 1000:>10.1f}" if timed else f"{'-':>10}"))
+        for size, rate in rates.items():
+            measurements[f"suite_{name}_{size}_lines_per_s"] = rate
+    return measurements
+
+
+def compare_with_baseline(measurements, baseline, threshold):
+    """
+    Returns a message for every measurement that is worse than its
+    baseline by more than "threshold" percent: timings ("_ms") that grew,
+    and throughputs that shrank. Measurements without a baseline pass.
+    """
+    regressions = []
+    for name, value in sorted(measurements.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        change = (value - base if name.endswith("_ms") else base - value)
+        if change > base * threshold / 100:
+            regressions.append(f"{name}: {value:.1f}, baseline {base:.1f} "
+                               f"(worse by {change / base:.0%})")
+    return regressions
+
+
+# Each benchmark with the sizes it runs on by default.
+BENCHMARKS = {
+    "detector": (bench_detector, [100, 1000, 10000, 50000]),
+    "comments": (bench_function_comments, [250, 500, 1000, 2000]),
+    "latency": (bench_latency, [100, 1000]),
+    "forkpool": (bench_fork_pool, [200]),
+    "lines": (bench_line_checks, [1000, 20000]),
+    "regrade": (bench_regrade, [100, 300, 1000, 5000]),
+    "store": (bench_store, [10000, 100000, 1000000]),
+    "startup": (bench_startup, [15]),
+    "suite": (bench_suite, [50, 1000, 10000, 100000]),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the adventure-game grader on generated "
+                    "submissions."
+    )
+    parser.add_argument(
+        "benchmark",
+        choices=sorted(BENCHMARKS),
+        help="The benchmark to run."
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Submission sizes, in lines (or in functions for the "
+             "comments benchmark).",
+        type=int,
+        nargs="+",
+        default=None
+    )
+    parser.add_argument(
+        "--baseline",
+        help=f"The baseline file measurements are compared with, recorded "
+             f"on this machine (default: {BASELINE_PATH}).",
+        default=BASELINE_PATH
+    )
+    parser.add_argument(
+        "--threshold",
+        help="How much worse than its baseline a measurement may be, in "
+             "percent, before the run fails (default: 25).",
+        type=float,
+        default=25.0
+    )
+    parser.add_argument(
+        "--update-baseline",
+        help="Record the measurements of this run in the baseline file "
+             "instead of comparing them with it.",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    benchmark, default_sizes = BENCHMARKS[args.benchmark]
+    measurements = benchmark(load_grader(), args.sizes or default_sizes)
+    if measurements:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        if args.update_baseline:
+            baseline.update((name, round(value, 1))
+                            for name, value in measurements.items())
+            with open(args.baseline, "w") as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"Baseline {args.baseline} updated.")
+        else:
+            regressions = compare_with_baseline(measurements, baseline,
+                                                args.threshold)
+            for message in regressions:
+                print(f"Regression: {message}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
@@ -0,0 +1,306 @@
+# -----------------------------------------------------------------------------
+# Pre-forked pool of warm Python interpreters for running student code.
+#
+# Starting a fresh "python" process for every run of a submission costs tens
+# of milliseconds before the first line of the submission executes. This pool
+# keeps a few worker interpreters alive that have already imported the
+# standard library modules student games use. For every run, a worker forks a
+# one-shot child, which
+#   - gets its own stdin (/dev/null), stdout and stderr pipes,
+#   - gets CPU time and memory limits (RLIMIT_CPU and RLIMIT_AS),
+#   - runs the given code as __main__ and exits,
+# so every run starts from the same clean state at the cost of a fork. The
+# worker collects the output, kills the child if it runs past its wall time,
+# and is itself replaced after a number of runs.
+#
+# Usage:
+#     with ForkServerPool(workers=4) as pool:
+#         run = pool.run("print('hello')")
+# -----------------------------------------------------------------------------
+
+import argparse
+import dataclasses
+import json
+import os
+import queue
+import resource
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# What the workers import before their first fork
+DEFAULT_PRELOAD = ("atexit", "builtins", "json", "random", "re", "runpy",
+                   "time", "traceback")
+
+# Output kept per stream and run; anything beyond is read and dropped
+MAX_OUTPUT_BYTES = 4 * 1024 * 1024
+
+
+@dataclasses.dataclass
+class ForkRun:
+    """
+    The outcome of one run in the pool. "returncode" follows subprocess: the
+    exit status, or minus the number of the signal that killed the child.
+    """
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+    timed_out: bool
+    wall_seconds: float
+
+
+def exit_status(code):
+    """ Maps the argument of SystemExit to a process exit status. """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xFF
+    sys.stderr.write(f"{code}\n")
+    return 1
+
+
+def run_child(job, stdout_fd, stderr_fd):
+    """
+    Runs in the forked child: installs the pipes and limits, executes the
+    job's code as __main__ and exits without returning to the worker loop.
+    """
+    status = 1
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        if job["cpu_limit"]:
+            resource.setrlimit(resource.RLIMIT_CPU,
+                               (job["cpu_limit"], job["cpu_limit"] + 1))
+        if job["memory_limit"]:
+            resource.setrlimit(resource.RLIMIT_AS,
+                               (job["memory_limit"], job["memory_limit"]))
+        import atexit
+        import builtins
+        # Exit handlers belong to the worker, not to the code being run
+        atexit._clear()
+        sys.argv = job["argv"]
+        namespace = {"__name__": "__main__", "__builtins__": builtins}
+        try:
+            exec(compile(job["code"], "<string>", "exec"), namespace)
+            status = 0
+        except SystemExit as e:
+            status = exit_status(e.code)
+        except BaseException:
+            # Report from the code's own frames, not from this function's
+            kind, error, tb = sys.exc_info()
+            error.with_traceback(tb.tb_next)
+            sys.excepthook(kind, error, tb.tb_next)
+            status = 1
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(status)
+
+
+def collect(pid, stdout_fd, stderr_fd, wall_limit):
+    """
+    Reads the child's output until both pipes close or the wall time runs
+    out, then reaps the child. Returns (status, stdout, stderr, timed_out).
+    """
+    buffers = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+    deadline = time.monotonic() + wall_limit
+    timed_out = False
+    with selectors.DefaultSelector() as selector:
+        for fd in buffers:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    # The child has not reached setsid() yet, so it has no
+                    # group and no children of its own
+                    os.kill(pid, signal.SIGKILL)
+                break
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fd)
+                elif len(buffers[key.fd]) < MAX_OUTPUT_BYTES:
+                    buffers[key.fd] += chunk[:MAX_OUTPUT_BYTES -
+                                             len(buffers[key.fd])]
+    _, wait_status = os.waitpid(pid, 0)
+    return (os.waitstatus_to_exitcode(wait_status), bytes(buffers[stdout_fd]),
+            bytes(buffers[stderr_fd]), timed_out)
+
+
+def worker_loop(preload):
+    """
+    The main loop of a worker interpreter. Jobs arrive as JSON lines on
+    stdin and results leave as JSON lines on stdout. Both are moved to
+    private descriptors first, so that forked children cannot touch them.
+    """
+    for name in preload:
+        __import__(name)
+    requests = os.fdopen(os.dup(0), "r")
+    answers = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    os.set_inheritable(requests.fileno(), False)
+    os.set_inheritable(answers.fileno(), False)
+
+    for line in requests:
+        job = json.loads(line)
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            requests.close()
+            answers.close()
+            os.close(stdout_read)
+            os.close(stderr_read)
+            run_child(job, stdout_write, stderr_write)
+        os.close(stdout_write)
+        os.close(stderr_write)
+        try:
+            status, stdout, stderr, timed_out = collect(
+                pid, stdout_read, stderr_read, job["wall_limit"])
+        finally:
+            os.close(stdout_read)
+            os.close(stderr_read)
+        # surrogateescape keeps arbitrary bytes through JSON
+        answers.write(json.dumps({
+            "returncode": status, "timed_out": timed_out,
+            "stdout": stdout.decode("utf-8", "surrogateescape"),
+            "stderr": stderr.decode("utf-8", "surrogateescape"),
+        }) + "\n")
+        answers.flush()
+
+
+class Worker:
+    """ The parent's handle on one worker interpreter. """
+
+    def __init__(self, preload):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             ",".join(preload)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            encoding="utf-8", errors="surrogateescape")
+        self.runs = 0
+
+    def run(self, job):
+        """ Sends one job and waits for its result. """
+        self.process.stdin.write(json.dumps(job) + "\n")
+        self.process.stdin.flush()
+        answer = self.process.stdout.readline()
+        if not answer:
+            raise RuntimeError("A fork-server worker died.")
+        self.runs += 1
+        return json.loads(answer)
+
+    def close(self):
+        """ Ends the worker; it exits when its stdin closes. """
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class ForkServerPool:
+    """
+    A pool of warm worker interpreters that run code in freshly forked
+    children. run() is thread-safe: each call borrows an idle worker, so as
+    many runs proceed at once as there are workers. A worker is replaced
+    after "max_runs" runs, or as soon as it fails.
+    """
+
+    def __init__(self, workers=None, max_runs=200, preload=DEFAULT_PRELOAD):
+        self.max_runs = max_runs
+        self.preload = tuple(preload)
+        self.size = workers or os.cpu_count() or 1
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        for _ in range(self.size):
+            self.idle.put(Worker(self.preload))
+
+    def run(self, code, argv=None, cpu_limit=2, memory_limit=512 * 2 ** 20,
+            wall_limit=10):
+        """
+        Runs "code" as __main__ with sys.argv set to "argv" in a fresh child
+        and returns a ForkRun. "cpu_limit" is in CPU seconds and
+        "memory_limit" in bytes of address space; 0 or None disables them.
+        """
+        job = {"code": code, "argv": list(argv or ["-c"]),
+               "cpu_limit": cpu_limit, "memory_limit": memory_limit,
+               "wall_limit": wall_limit}
+        worker = self.idle.get()
+        start = time.perf_counter()
+        try:
+            answer = worker.run(job)
+        except (OSError, RuntimeError, ValueError):
+            worker.process.kill()
+            # None until the replacement is known to be live, so that a
+            # failed replacement never puts the dead worker back
+            failed, worker = worker, None
+            worker = self.replace(failed)
+            raise
+        finally:
+            if worker is not None:
+                if worker.runs >= self.max_runs:
+                    worker = self.replace(worker)
+                self.idle.put(worker)
+        return ForkRun(answer["returncode"],
+                       answer["stdout"].encode("utf-8", "surrogateescape"),
+                       answer["stderr"].encode("utf-8", "surrogateescape"),
+                       answer["timed_out"], time.perf_counter() - start)
+
+    def replace(self, worker):
+        """
+        Ends "worker" and returns a new one. When either step fails, the
+        pool goes on with one worker fewer and the error propagates.
+        """
+        try:
+            worker.close()
+            return Worker(self.preload)
+        except BaseException:
+            with self.lock:
+                self.size -= 1
+            raise
+
+    def close(self):
+        """ Stops every worker. """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for _ in range(self.size):
+            self.idle.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fork-server worker for running student code; started "
+                    "by ForkServerPool, not by hand."
+    )
+    parser.add_argument(
+        "--worker",
+        help="Run as a pool worker, preloading these comma-separated "
+             "modules.",
+        required=True,
+        metavar="MODULES"
+    )
+    args = parser.parse_args()
+    worker_loop([name for name in args.worker.split(",") if name])
@@ -0,0 +1,267 @@
+# -----------------------------------------------------------------------------
+# Randomized explorer for student adventure games.
+#
+# Plays a game many times over, in parallel children forked from a pool of
+# warm interpreters (fork_pool.py), with the fast-forward runner of
+# game_runner.py: sleeps take no time and every answer
+# to input() is drawn at random from
+#   - the string literals the game compares its answers with
+#     (choice == "1", response in ["yes", "no"], ...),
+#   - the choices each prompt offers ("Enter 1 or 2", "[y/n]", ...),
+#   - one invalid answer, to exercise the input validation loops.
+# It then reports which prompts it met, the line and branch coverage of all
+# playthroughs together and the crashes it found, with the seed and the
+# answers that reproduce each one. The same seed always gives the same
+# playthroughs.
+#
+# Usage:
+#     python game_explorer.py adventure_game.py -n 2000 --seed 0
+# -----------------------------------------------------------------------------
+
+import argparse
+import ast
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+from fork_pool import ForkServerPool
+from game_runner import run_game
+
+# An answer no game expects, so that validation loops get exercised
+INVALID_ANSWER = "?"
+
+
+def string_constants(node):
+    """
+    Yields the short strings a comparison operand stands for: a string
+    literal, or the string elements of a list, tuple or set literal.
+    """
+    elements = node.elts if isinstance(node, (ast.List, ast.Tuple,
+                                              ast.Set)) else [node]
+    for element in elements:
+        if (isinstance(element, ast.Constant) and
+                isinstance(element.value, str) and
+                0 < len(element.value) <= 20 and
+                "\n" not in element.value):
+            yield element.value
+
+
+def static_candidates(tree):
+    """
+    Collects the answers a game compares its input with, by looking at the
+    operands of every comparison in its AST. The usual
+    if __name__ == "__main__" test is not about input and is left out.
+    """
+    found = {INVALID_ANSWER}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Compare):
+            operands = [node.left, *node.comparators]
+            if any(isinstance(operand, ast.Name) and
+                   operand.id == "__name__" for operand in operands):
+                continue
+            for operand in operands:
+                found.update(string_constants(operand))
+    return sorted(found)
+
+
+def executable_lines(code):
+    """ Returns the line numbers of a code object and all nested ones. """
+    lines = {line for _, _, line in code.co_lines() if line}
+    for constant in code.co_consts:
+        if hasattr(constant, "co_lines"):
+            lines |= executable_lines(constant)
+    return lines
+
+
+def branch_points(tree):
+    """
+    Returns (line, first body line) for every if, elif, while and for
+    statement. Going from the line to the body is the branch "taken"; going
+    anywhere else is the branch "not taken".
+    """
+    return sorted({(node.lineno, node.body[0].lineno)
+                   for node in ast.walk(tree)
+                   if isinstance(node, (ast.If, ast.While, ast.For))})
+
+
+def play(pool, path, index, seed, candidates, max_inputs, cpu_limit,
+         wall_limit):
+    """
+    Plays one randomized path through the game in a child of the fork
+    pool. The game's random module and the explorer's answers are both
+    seeded from "seed" and "index", so a playthrough can be replayed
+    exactly. Returns only what the report needs.
+    """
+    play_seed = seed * 1000003 + index
+    run = run_game(path, [], seed=play_seed, cpu_limit=cpu_limit,
+                   wall_limit=wall_limit, trace=True, pool=pool,
+                   explore={"seed": play_seed, "candidates": candidates,
+                            "max_inputs": max_inputs})
+    return {"index": index, "seed": play_seed, "status": run.status,
+            "inputs": run.inputs, "lines": run.lines, "arcs": run.arcs,
+            "crash": run.crash}
+
+
+def explore_game(path, playthroughs=1000, seed=0, jobs=None, max_inputs=30,
+                 cpu_limit=2, wall_limit=10, pool=None):
+    """
+    Plays "playthroughs" randomized paths through the game at "path" and
+    returns the exploration report as a dict. As many playthroughs run at
+    once as the ForkServerPool "pool" has workers; without one, a pool of
+    "jobs" workers is started for this game only.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    candidates = static_candidates(tree)
+    executable = executable_lines(compile(source, path, "exec"))
+    branches = branch_points(tree)
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ForkServerPool(jobs)
+    jobs = pool.size
+    start = time.perf_counter()
+    try:
+        # The work happens in the forked children; a thread per worker only
+        # waits for them
+        with concurrent.futures.ThreadPoolExecutor(jobs) as threads:
+            runs = list(threads.map(
+                play, [pool] * playthroughs, [path] * playthroughs,
+                range(playthroughs), [seed] * playthroughs,
+                [candidates] * playthroughs, [max_inputs] * playthroughs,
+                [cpu_limit] * playthroughs, [wall_limit] * playthroughs))
+    finally:
+        if own_pool:
+            pool.close()
+    seconds = time.perf_counter() - start
+
+    statuses = {}
+    prompts = {}
+    lines = set()
+    arcs_from = {}
+    crashes = {}
+    for run in runs:
+        statuses[run["status"]] = statuses.get(run["status"], 0) + 1
+        for prompt, answer in run["inputs"]:
+            prompts.setdefault(prompt.strip(), set()).add(answer)
+        lines.update(run["lines"])
+        for source_line, target_line in run["arcs"]:
+            arcs_from.setdefault(source_line, set()).add(target_line)
+        if run["crash"] is not None:
+            crash = run["crash"]
+            key = (crash["type"], crash["line"])
+            if key not in crashes:
+                crashes[key] = dict(crash, count=0, seed=run["seed"],
+                                    answers=[a for _, a in run["inputs"]])
+            crashes[key]["count"] += 1
+
+    outcomes = 0
+    for line, body_line in branches:
+        targets = arcs_from.get(line, set())
+        outcomes += body_line in targets
+        outcomes += bool(targets - {body_line})
+
+    covered = len(lines & executable)
+    return {
+        "file": path,
+        "seed": seed,
+        "playthroughs": playthroughs,
+        "statuses": statuses,
+        "line_coverage": {"covered": covered, "total": len(executable),
+                          "percent": round(100 * covered /
+                                           max(1, len(executable)), 1)},
+        "branch_coverage": {"covered": outcomes, "total": 2 * len(branches),
+                            "percent": round(100 * outcomes /
+                                             max(1, 2 * len(branches)), 1)},
+        "prompts": {prompt: sorted(answers)
+                    for prompt, answers in sorted(prompts.items())},
+        "crashes": sorted(crashes.values(),
+                          key=lambda crash: (crash["line"] or 0,
+                                             crash["type"])),
+        "seconds": round(seconds, 3),
+        "jobs": jobs,
+        "playthroughs_per_second_per_core": round(
+            playthroughs / seconds / jobs, 1),
+    }
+
+
+def print_report(report):
+    """ Prints an exploration report for a human reader. """
+    print(f"{report['file']}: {report['playthroughs']} playthroughs "
+          f"(seed {report['seed']})")
+    print("  outcomes: " + ", ".join(
+        f"{status} {count}" for status, count in
+        sorted(report["statuses"].items())))
+    for name in ("line_coverage", "branch_coverage"):
+        coverage = report[name]
+        print(f"  {name.replace('_', ' ')}: {coverage['covered']}/"
+              f"{coverage['total']} ({coverage['percent']}%)")
+    print(f"  prompts met: {len(report['prompts'])}")
+    for prompt, answers in report["prompts"].items():
+        print(f"    {prompt!r}: {', '.join(map(repr, answers))}")
+    for crash in report["crashes"]:
+        print(f"  crash: {crash['type']} on line {crash['line']}: "
+              f"{crash['message']} ({crash['count']} times; first with "
+              f"seed {crash['seed']}, answers {crash['answers']})")
+    print(f"  throughput: {report['playthroughs_per_second_per_core']} "
+          f"playthroughs/s per core ({report['jobs']} workers, "
+          f"{report['seconds']} s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Explore student adventure games with randomized "
+                    "playthroughs and report coverage and crashes."
+    )
+    parser.add_argument(
+        "files",
+        help="The games to explore.",
+        nargs="+"
+    )
+    parser.add_argument(
+        "-n", "--playthroughs",
+        help="Number of playthroughs per game (default: 1000).",
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed of the exploration (default: 0).",
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="Number of warm worker interpreters (default: one per CPU "
+             "core).",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--max-inputs",
+        help="Answers given per playthrough before it is stopped "
+             "(default: 30).",
+        type=int,
+        default=30
+    )
+    parser.add_argument(
+        "--json",
+        help="Print one JSON report per line instead of a summary.",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    with ForkServerPool(args.jobs) as workers:
+        for file in args.files:
+            if not os.path.exists(file):
+                print(f"The specified Python file {file} does not exist.")
+                sys.exit(1)
+            result = explore_game(file, args.playthroughs, args.seed,
+                                  max_inputs=args.max_inputs, pool=workers)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print_report(result)
@@ -0,0 +1,306 @@
+# -----------------------------------------------------------------------------
+# Fast-forward runner for student adventure games.
+#
+# The grader (unittest_adventure_game_deci-lvl2_v2.py) only checks a game
+# statically. This module actually plays it: the game runs in a child
+# process where
+#   - time.sleep() advances a virtual clock instead of waiting, and
+#     time.time(), time.monotonic() and time.perf_counter() follow it,
+#   - random is seeded, so the same answers always give the same game,
+#   - input() takes its answers from a scripted list and stops the game
+#     when the list runs out,
+# and where CPU time and wall time are limited, so an infinite loop ends the
+# run instead of hanging the grader. A whole playthrough takes milliseconds.
+#
+# Usage:
+#     python game_runner.py adventure_game.py --answers 1 2 yes no
+# -----------------------------------------------------------------------------
+
+import argparse
+import dataclasses
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+
+# Exit status of a child whose game asked for more input than was scripted
+EXIT_OUT_OF_INPUT = 86
+
+# Code run in the child process before the game. It gets its settings as
+# JSON in argv[1] and the game's path in argv[2].
+CHILD_BOOTSTRAP = r"""
+import atexit, builtins, json, os, random, re, runpy, sys, time
+
+settings = json.loads(sys.argv[1])
+game_path = sys.argv[2]
+answers = settings["answers"]
+explore = settings.get("explore")
+state = {"clock": 0.0, "answers_used": 0, "inputs": [], "crash": None}
+real_time, real_monotonic = time.time, time.monotonic
+real_perf_counter = time.perf_counter
+lines, arcs = set(), set()
+
+
+def report():
+    sys.settrace(None)
+    if settings.get("trace"):
+        state["lines"] = sorted(lines)
+        state["arcs"] = sorted(arcs)
+    sys.stdout.flush()
+    sys.stderr.write("\n@@game_runner@@" + json.dumps(state) + "\n")
+    sys.stderr.flush()
+
+
+def sleep(seconds):
+    if seconds < 0:
+        raise ValueError("sleep length must be non-negative")
+    state["clock"] += seconds
+
+
+def prompt_options(prompt):
+    # Choices a prompt offers: "1 or 2", "[y/n]", "yes/no", ...
+    options = re.findall(r"\b\d{1,2}\b", prompt)
+    for left, right in re.findall(r"(\w+)\s*(?:/|\bor\b)\s*(\w+)", prompt):
+        options += [left, right]
+    return options
+
+
+def choose_answer(prompt):
+    # Picks the next answer of an exploration, or None when it is over
+    if explore is None or len(state["inputs"]) >= explore["max_inputs"]:
+        return None
+    options = sorted(set(prompt_options(prompt)) |
+                     set(explore["candidates"]))
+    return chooser.choice(options) if options else ""
+
+
+def scripted_input(prompt=""):
+    prompt = str(prompt)
+    sys.stdout.write(prompt)
+    if state["answers_used"] < len(answers):
+        answer = answers[state["answers_used"]]
+        state["answers_used"] += 1
+    else:
+        answer = choose_answer(prompt)
+        if answer is None:
+            report()
+            os._exit(EXIT_OUT_OF_INPUT)
+    if explore is not None:
+        state["inputs"].append([prompt, answer])
+    sys.stdout.write(answer + "\n")
+    return answer
+
+
+def trace_calls(frame, event, arg):
+    # Line and arc coverage, for the game's own file only
+    if frame.f_code.co_filename != game_path:
+        return None
+    last = [None]
+
+    def trace_lines(frame, event, arg):
+        if event == "line":
+            line = frame.f_lineno
+            lines.add(line)
+            if last[0] is not None:
+                arcs.add((last[0], line))
+            last[0] = line
+        elif event == "return" and last[0] is not None:
+            # Leaving the function: an arc to minus its first line
+            arcs.add((last[0], -frame.f_code.co_firstlineno))
+        return trace_lines
+    return trace_lines
+
+
+def record_crash(kind, error, tb):
+    line = None
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == game_path:
+            line = tb.tb_lineno
+        tb = tb.tb_next
+    state["crash"] = {"type": kind.__name__, "message": str(error),
+                      "line": line}
+    sys.__excepthook__(kind, error, tb)
+
+
+time.sleep = sleep
+time.time = lambda: real_time() + state["clock"]
+time.monotonic = lambda: real_monotonic() + state["clock"]
+time.perf_counter = lambda: real_perf_counter() + state["clock"]
+random.seed(settings["seed"])
+# The explorer's own choices must not disturb the game's random numbers
+chooser = random.Random(explore["seed"] if explore else 0)
+builtins.input = scripted_input
+sys.excepthook = record_crash
+sys.argv = [game_path]
+sys.path.insert(0, os.path.dirname(os.path.abspath(game_path)))
+# Runs after a traceback has been printed, so the report always comes last
+atexit.register(report)
+if settings.get("trace"):
+    sys.settrace(trace_calls)
+runpy.run_path(game_path, run_name="__main__")
+""".replace("EXIT_OUT_OF_INPUT", str(EXIT_OUT_OF_INPUT))
+
+# Marks the line on which the child reports its virtual clock and answers
+REPORT_MARKER = "\n@@game_runner@@"
+
+
+@dataclasses.dataclass
+class GameRun:
+    """
+    The outcome of one playthrough. "status" is one of "finished",
+    "out_of_input", "crashed", "cpu_limit" or "wall_limit". The answers
+    used and the virtual clock are unknown (0) after a limit was hit.
+
+    Explorations also list every [prompt, answer] pair in "inputs", traced
+    runs list the executed "lines" and [from, to] line "arcs", and an
+    uncaught exception is described in "crash".
+    """
+    status: str
+    returncode: int
+    stdout: str
+    stderr: str
+    answers_used: int
+    virtual_seconds: float
+    wall_seconds: float
+    inputs: list = dataclasses.field(default_factory=list)
+    lines: list = dataclasses.field(default_factory=list)
+    arcs: list = dataclasses.field(default_factory=list)
+    crash: dict = None
+
+
+def limit_cpu(seconds):
+    """
+    Returns a function that lowers the CPU time limit of the child process
+    it runs in. The kernel kills the child once the limit is used up.
+    """
+    def apply():
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+    return apply
+
+
+def parse_report(stderr):
+    """
+    Splits the child's stderr into the game's own error output and the
+    state the child reported when it stopped: the virtual clock and the
+    number of answers used. A child killed by a limit reports nothing.
+    """
+    position = stderr.rfind(REPORT_MARKER)
+    if position == -1:
+        return stderr, {"clock": 0.0, "answers_used": 0, "inputs": [],
+                        "crash": None}
+    return (stderr[:position],
+            json.loads(stderr[position + len(REPORT_MARKER):]))
+
+
+def run_game(path, answers, seed=0, cpu_limit=2, wall_limit=10,
+             explore=None, trace=False, pool=None):
+    """
+    Plays the game at "path" once with the scripted "answers" and returns a
+    GameRun. "cpu_limit" is in whole CPU seconds and "wall_limit" in real
+    seconds; either one ends a game that loops forever.
+
+    Once the scripted answers are used up, an "explore" dict
+    {"seed": int, "candidates": [str], "max_inputs": int} lets the child
+    keep answering by itself: each answer is drawn, with its own seeded
+    generator, from the candidates and the choices the prompt offers. With
+    "trace", the lines and arcs the game executes are recorded.
+
+    With a fork_pool.ForkServerPool as "pool", the child is forked from one
+    of its warm interpreters instead of being started from scratch.
+    """
+    answers = [str(answer) for answer in answers]
+    settings = json.dumps({"answers": answers, "seed": seed,
+                           "explore": explore, "trace": trace})
+    start = time.perf_counter()
+    if pool is not None:
+        run = pool.run(CHILD_BOOTSTRAP, ["-c", settings, path],
+                       cpu_limit=cpu_limit, wall_limit=wall_limit)
+        stdout = run.stdout.decode(errors="replace")
+        stderr = run.stderr.decode(errors="replace")
+        if run.timed_out:
+            return GameRun("wall_limit", run.returncode, stdout, stderr, 0,
+                           0.0, time.perf_counter() - start)
+        return finish_run(run.returncode, stdout, stderr,
+                          time.perf_counter() - start)
+
+    argv = [sys.executable, "-c", CHILD_BOOTSTRAP, settings, path]
+    try:
+        completed = subprocess.run(
+            argv, capture_output=True, text=True, timeout=wall_limit,
+            stdin=subprocess.DEVNULL, preexec_fn=limit_cpu(cpu_limit))
+    except subprocess.TimeoutExpired as e:
+        stdout = (e.stdout or b"").decode(errors="replace")
+        stderr = (e.stderr or b"").decode(errors="replace")
+        return GameRun("wall_limit", -signal.SIGKILL, stdout, stderr, 0,
+                       0.0, time.perf_counter() - start)
+    return finish_run(completed.returncode, completed.stdout,
+                      completed.stderr, time.perf_counter() - start)
+
+
+def finish_run(returncode, stdout, stderr, wall_seconds):
+    """ Builds the GameRun of a child that ended within its wall time. """
+    stderr, state = parse_report(stderr)
+    if returncode == 0:
+        status = "finished"
+    elif returncode == EXIT_OUT_OF_INPUT:
+        status = "out_of_input"
+    elif returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        status = "cpu_limit"
+    else:
+        status = "crashed"
+    return GameRun(status, returncode, stdout, stderr,
+                   state["answers_used"], state["clock"], wall_seconds,
+                   state["inputs"], state.get("lines", []),
+                   state.get("arcs", []), state["crash"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Play a student adventure game with scripted answers, "
+                    "without waiting for its sleeps."
+    )
+    parser.add_argument(
+        "file",
+        help="The game to run."
+    )
+    parser.add_argument(
+        "--answers",
+        help="The answers given to input(), in order.",
+        nargs="*",
+        default=[]
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for the random module (default: 0).",
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        help="CPU time limit in seconds (default: 2).",
+        type=int,
+        default=2
+    )
+    parser.add_argument(
+        "--wall-limit",
+        help="Wall time limit in seconds (default: 10).",
+        type=float,
+        default=10
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"The specified Python file {args.file} does not exist.")
+        sys.exit(1)
+
+    run = run_game(args.file, args.answers, args.seed, args.cpu_limit,
+                   args.wall_limit)
+    print(run.stdout, end="")
+    if run.stderr.strip():
+        print(run.stderr, end="", file=sys.stderr)
+    print(f"\n[{run.status}: {run.answers_used}/{len(args.answers)} answers "
+          f"used, {run.virtual_seconds:.1f} s of game time in "
+          f"{run.wall_seconds * 1000:.0f} ms]", file=sys.stderr)
@@ -0,0 +1,114 @@
+# -----------------------------------------------------------------------------
+# Thin client for the adventure-game grading server.
+#
+# Sends a student file to a grader started with
+#     python unittest_adventure_game_deci-lvl2_v2.py --serve
+# and prints the result exactly as the grader prints it. It only imports a
+# few standard modules, so it starts much faster than the grader itself. If
+# no server is running, it falls back to running the grader directly.
+#
+# Usage:
+#     python grade_client.py adventure_game.py
+#     python grade_client.py adventure_game.py pycodestyle
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+GRADER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "unittest_adventure_game_deci-lvl2_v2.py")
+
+# Must match DEFAULT_SOCKET_PATH in the grader.
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(),
+                                   "adventure_game_grader.sock")
+
+
+def request_grade(connection, name, raw, run_pycodestyle=False):
+    """
+    Sends one submission over an open connection to the grading server and
+    returns the record it answers with. The connection can be reused for
+    further submissions.
+    """
+    header = {"file": name, "size": len(raw),
+              "pycodestyle": bool(run_pycodestyle)}
+    connection.sendall(json.dumps(header).encode() + b"\n" + raw)
+    answer = b""
+    while not answer.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise ConnectionError("The grading server closed the connection.")
+        answer += chunk
+    return json.loads(answer)
+
+
+def connect(socket_path=DEFAULT_SOCKET_PATH):
+    """ Opens a connection to the grading server listening on socket_path. """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run unit tests on a given student file through the "
+                    "grading server."
+    )
+
+    parser.add_argument(
+        "file",
+        help="The name of the file to test."
+    )
+
+    parser.add_argument(
+        "pycodestyle",
+        help="Activate or deactivate pycodestyle check",
+        type=bool,
+        nargs="?",
+        const=True,
+        default=False
+    )
+
+    parser.add_argument(
+        "--socket",
+        help=f"Unix socket of the grading server "
+             f"(default: {DEFAULT_SOCKET_PATH}).",
+        default=DEFAULT_SOCKET_PATH
+    )
+
+    args = parser.parse_args()
+
+    # Validate that the file exists
+    if not os.path.exists(args.file):
+        print(f"The specified Python file {args.file} does not exist.")
+        sys.exit(1)
+
+    try:
+        connection = connect(args.socket)
+    except OSError:
+        # No server: run the grader in this process's place
+        argv = [sys.executable, GRADER_PATH, args.file]
+        if args.pycodestyle:
+            argv.append("pycodestyle")
+        os.execv(sys.executable, argv)
+
+    with open(args.file, "rb") as f:
+        source = f.read()
+    with connection:
+        record = request_grade(connection, args.file, source,
+                               args.pycodestyle)
+
+    if "error" in record:
+        print(record["error"])
+        sys.exit(1)
+    if not record["valid"]:
+        print(record["output"], end="")
+        sys.exit(1)
+    sys.stderr.write(record["output"])
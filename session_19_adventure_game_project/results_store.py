@@ -0,0 +1,322 @@
+# -----------------------------------------------------------------------------
+# Cohort results store for the adventure-game grader.
+#
+# Batch grading (unittest_adventure_game_deci-lvl2_v2.py submissions/ -o
+# results.jsonl) writes one JSON record per submission, with the outcome of
+# every test in its "checks". This script loads those records into an
+# SQLite file, one row per submission, one row per test outcome and one row
+# per failure, with the cohort, the group and the grading time copied into
+# every row so that the reports are answered from the indexes alone:
+#   pass-rate  pass rate of every check, group or cohort
+#   failures   the failures that occur most, by check and reason
+#   trend      pass rate per day, week or month, by group, cohort or check
+# The group of a submission is the directory it was found in (cohort.zip/
+# sat_12/game.py is in group "sat_12") unless --group says otherwise.
+#
+# Usage:
+#     python results_store.py import results.sqlite3 results.jsonl \
+#         --cohort 2024-oct
+#     python results_store.py pass-rate results.sqlite3 --by check
+#     python results_store.py failures results.sqlite3 --cohort 2024-oct
+#     python results_store.py trend results.sqlite3 --by group --period week
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+# What a report can be broken down by, and the column it comes from
+REPORT_KEYS = {"check": "check_name", "group": "grp", "cohort": "cohort"}
+
+# The strftime() format of every trend period
+PERIODS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+# What makes two failure messages differ without being another reason: the
+# name of a function, a line or a count
+FUNCTION_NAME_RE = re.compile(r"'[A-Za-z_][A-Za-z0-9_]*\(\)'")
+NUMBER_RE = re.compile(r"\d+")
+
+
+def failure_reason(message):
+    """
+    Reduces a failure message to its reason, so that failures can be
+    counted together: function names become '...()' and numbers "N".
+    """
+    return NUMBER_RE.sub("N", FUNCTION_NAME_RE.sub("'...()'", message))
+
+
+def submission_group(path):
+    """ The group of a submission: the directory it was found in. """
+    return os.path.basename(os.path.dirname(path)) or "."
+
+
+class ResultsStore:
+    """
+    Graded submissions of any number of cohorts in an SQLite file, with the
+    indexes the reports need. Submissions are only ever added: grading the
+    same file again adds a new submission, which is what the trends are
+    made of, and the reports can be limited to the latest of each file.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "id INTEGER PRIMARY KEY, cohort TEXT NOT NULL, "
+            "grp TEXT NOT NULL, file TEXT NOT NULL, "
+            "graded_at REAL NOT NULL, valid INTEGER NOT NULL, "
+            "successful INTEGER NOT NULL, tests_run INTEGER NOT NULL, "
+            "failures INTEGER NOT NULL, errors INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS submissions_cohort_file "
+            "ON submissions (cohort, file, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_graded_at "
+            "ON submissions (graded_at);"
+            "CREATE TABLE IF NOT EXISTS results ("
+            "submission INTEGER NOT NULL, cohort TEXT NOT NULL, "
+            "grp TEXT NOT NULL, graded_at REAL NOT NULL, "
+            "check_name TEXT NOT NULL, passed INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS results_check "
+            "ON results (check_name, cohort, passed);"
+            "CREATE INDEX IF NOT EXISTS results_cohort "
+            "ON results (cohort, grp, graded_at, passed);"
+            "CREATE INDEX IF NOT EXISTS results_graded_at "
+            "ON results (graded_at, passed);"
+            "CREATE INDEX IF NOT EXISTS results_submission "
+            "ON results (submission);"
+            "CREATE TABLE IF NOT EXISTS failures ("
+            "submission INTEGER NOT NULL, cohort TEXT NOT NULL, "
+            "grp TEXT NOT NULL, graded_at REAL NOT NULL, "
+            "check_name TEXT NOT NULL, subtest TEXT, reason TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS failures_check "
+            "ON failures (check_name, subtest, reason);"
+            "CREATE INDEX IF NOT EXISTS failures_cohort "
+            "ON failures (cohort, check_name, subtest, reason);"
+            "CREATE INDEX IF NOT EXISTS failures_submission "
+            "ON failures (submission);")
+
+    def add_records(self, records, cohort, group=None):
+        """
+        Stores grader records (the JSON lines of batch mode) under
+        "cohort", in one transaction, and returns how many were stored. A
+        record without a grading time is dated now; the group is taken
+        from the record's path unless "group" is given.
+        """
+        count = 0
+        self.connection.execute("BEGIN")
+        try:
+            for record in records:
+                graded_at = record.get("graded_at")
+                if graded_at is None:
+                    graded_at = time.time()
+                grp = group or submission_group(record["file"])
+                submission = self.connection.execute(
+                    "INSERT INTO submissions (cohort, grp, file, graded_at, "
+                    "valid, successful, tests_run, failures, errors) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cohort, grp, record["file"], graded_at,
+                     record["valid"], record["successful"],
+                     record["tests_run"], record["failures"],
+                     record["errors"])).lastrowid
+                checks = record.get("checks", [])
+                self.connection.executemany(
+                    "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                    [(submission, cohort, grp, graded_at, check["test"],
+                      check["outcome"] == "success") for check in checks])
+                self.connection.executemany(
+                    "INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(submission, cohort, grp, graded_at, check["test"],
+                      failure["subtest"],
+                      failure_reason(failure["message"]))
+                     for check in checks for failure in check["failures"]])
+                count += 1
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return count
+
+    @staticmethod
+    def filters(cohort=None, check=None, latest=False):
+        """
+        Returns the WHERE clause and its parameters shared by the reports:
+        one cohort, one check, and only the latest grading of each file.
+        """
+        conditions, parameters = [], []
+        if cohort is not None:
+            conditions.append("cohort = ?")
+            parameters.append(cohort)
+        if check is not None:
+            conditions.append("check_name = ?")
+            parameters.append(check)
+        if latest:
+            conditions.append("submission IN (SELECT MAX(id) FROM "
+                              "submissions GROUP BY cohort, file)")
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, parameters
+
+    def pass_rate(self, by="check", cohort=None, latest=False):
+        """
+        Returns [(key, results, passed, rate)] with the pass rate, in
+        percent, of every check, group or cohort ("by"), worst first.
+        """
+        where, parameters = self.filters(cohort, None, latest)
+        column = REPORT_KEYS[by]
+        return self.connection.execute(
+            f"SELECT {column}, COUNT(*), SUM(passed), "
+            f"100.0 * AVG(passed) AS rate FROM results{where} "
+            f"GROUP BY {column} ORDER BY rate, {column}",
+            parameters).fetchall()
+
+    def failures(self, cohort=None, check=None, latest=False, limit=20):
+        """
+        Returns [(check, subtest, reason, failures, submissions)] for the
+        "limit" reasons of failure that occur most.
+        """
+        where, parameters = self.filters(cohort, check, latest)
+        return self.connection.execute(
+            f"SELECT check_name, subtest, reason, COUNT(*) AS failures, "
+            f"COUNT(DISTINCT submission) FROM failures{where} "
+            f"GROUP BY check_name, subtest, reason "
+            f"ORDER BY failures DESC, check_name, subtest, reason LIMIT ?",
+            parameters + [limit]).fetchall()
+
+    def trend(self, by="group", period="week", cohort=None, check=None):
+        """
+        Returns [(period, key, results, rate)] with the pass rate, in
+        percent, of every group, cohort or check ("by") in every day, week
+        or month ("period") results were graded in, oldest first.
+        """
+        where, parameters = self.filters(cohort, check)
+        column = REPORT_KEYS[by]
+        return self.connection.execute(
+            f"SELECT strftime(?, graded_at, 'unixepoch') AS period, "
+            f"{column}, COUNT(*), 100.0 * AVG(passed) FROM results{where} "
+            f"GROUP BY period, {column} ORDER BY period, {column}",
+            [PERIODS[period]] + parameters).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def read_records(paths):
+    """
+    Yields the records of JSON lines files, or of the standard input for
+    "-", skipping blank lines.
+    """
+    for path in paths:
+        f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def print_table(header, rows):
+    """ Prints rows under a header, each column as wide as it needs. """
+    rows = [[f"{value:.1f}" if isinstance(value, float) else str(value)
+             for value in row] for row in rows]
+    widths = [max(len(row[column]) for row in [header] + rows)
+              for column in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(value.ljust(width)
+                        for value, width in zip(row, widths)).rstrip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store graded adventure-game submissions and report "
+                    "pass rates, failure reasons and trends."
+    )
+    parser.add_argument(
+        "command",
+        help="'import' stores JSON lines records of the grader; "
+             "'pass-rate', 'failures' and 'trend' print a report.",
+        choices=["import", "pass-rate", "failures", "trend"]
+    )
+    parser.add_argument(
+        "store",
+        help="The SQLite file of the store; it is created if needed."
+    )
+    parser.add_argument(
+        "files",
+        help="JSON lines files written by the grader's batch mode, or '-' "
+             "for the standard input (import only).",
+        nargs="*"
+    )
+    parser.add_argument(
+        "--cohort",
+        help="The cohort the records belong to (required by import), or "
+             "the only cohort to report on.",
+        default=None
+    )
+    parser.add_argument(
+        "--group",
+        help="The group of every imported record (default: the directory "
+             "each submission was found in).",
+        default=None
+    )
+    parser.add_argument(
+        "--by",
+        help="What pass rates and trends are broken down by (default: "
+             "check for pass-rate, group for trend).",
+        choices=sorted(REPORT_KEYS),
+        default=None
+    )
+    parser.add_argument(
+        "--period",
+        help="The period of a trend (default: week).",
+        choices=sorted(PERIODS),
+        default="week"
+    )
+    parser.add_argument(
+        "--check",
+        help="Only report on this check (a test name such as "
+             "test_pep8_compliance).",
+        default=None
+    )
+    parser.add_argument(
+        "--latest",
+        help="Only count the latest grading of each file.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--limit",
+        help="Number of failure reasons to print (default: 20).",
+        type=int,
+        default=20
+    )
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    try:
+        if args.command == "import":
+            if args.cohort is None:
+                parser.error("import needs --cohort")
+            if not args.files:
+                parser.error("import needs the JSON lines files to store")
+            count = store.add_records(read_records(args.files), args.cohort,
+                                      args.group)
+            print(f"Stored {count} submissions in cohort {args.cohort}.")
+        elif args.command == "pass-rate":
+            by = args.by or "check"
+            print_table([by, "results", "passed", "pass %"],
+                        store.pass_rate(by, args.cohort, args.latest))
+        elif args.command == "failures":
+            print_table(["check", "subtest", "reason", "failures",
+                         "submissions"],
+                        store.failures(args.cohort, args.check, args.latest,
+                                       args.limit))
+        else:
+            by = args.by or "group"
+            print_table([args.period, by, "results", "pass %"],
+                        store.trend(by, args.period, args.cohort,
+                                    args.check))
+    finally:
+        store.close()
@@ -0,0 +1,330 @@
+# -----------------------------------------------------------------------------
+# Structural similarity index for finding copied adventure games in a cohort.
+#
+# Every submission is reduced to the shape of its code: its AST is walked in
+# order, docstrings and comments are left out, the identifiers the student
+# chose are all renamed to the same placeholder and literals are dropped, so
+# renaming variables or rewording the story does not hide a copy. The
+# resulting token stream is fingerprinted with winnowed k-gram hashes, and
+# the fingerprints are summarised by a MinHash signature. Signatures are
+# split into bands and stored in LSH buckets in an SQLite file: two
+# submissions only become a candidate pair when one of their bands lands in
+# the same bucket, so a new submission is compared with a handful of others
+# instead of the whole cohort. The index keeps growing as submissions are
+# added, and re-adding a changed file replaces it.
+#
+# Usage:
+#     python similarity_index.py add cohort.sqlite3 submissions/
+#     python similarity_index.py pairs cohort.sqlite3 --threshold 0.7
+# -----------------------------------------------------------------------------
+
+import argparse
+import array
+import ast
+import builtins
+import glob
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+
+# The shape of the index; an index file can only be used with the settings
+# it was created with.
+DEFAULT_SETTINGS = {"k": 12, "window": 8, "permutations": 128, "bands": 32,
+                    "seed": 0}
+
+# Modulus of the MinHash permutations, a Mersenne prime above 2 ** 60
+MERSENNE_PRIME = (1 << 61) - 1
+
+# Names that keep their identity: renaming them is not a way to hide a copy
+KEPT_NAMES = frozenset(dir(builtins))
+
+# What every identifier and literal chosen by the student turns into
+PLACEHOLDER = "_"
+
+
+def stable_hash(text):
+    """ A 64-bit hash of a string that is the same in every process. """
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8)
+                          .digest(), "big")
+
+
+def is_docstring(node):
+    """ Tells whether a statement is a bare string: a docstring. """
+    return isinstance(node, ast.Expr) and \
+        isinstance(node.value, ast.Constant) and \
+        isinstance(node.value.value, str)
+
+
+def normalized_tokens(tree):
+    """
+    Yields the tokens of the normalized AST in depth-first order: node type
+    names, with the names of builtins, imported modules and attributes kept
+    and every other identifier and every literal replaced by PLACEHOLDER.
+    Docstrings are skipped.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, ast.AST) or is_docstring(node):
+            continue
+        yield type(node).__name__
+        if isinstance(node, ast.Name):
+            yield node.id if node.id in KEPT_NAMES else PLACEHOLDER
+        elif isinstance(node, ast.Attribute):
+            yield node.attr
+        elif isinstance(node, ast.alias):
+            yield node.name
+        elif isinstance(node, ast.Constant):
+            yield type(node.value).__name__
+        elif isinstance(node, (ast.expr_context, ast.operator,
+                               ast.boolop, ast.unaryop, ast.cmpop)):
+            continue
+        children = [value for _, value in ast.iter_fields(node)
+                    if isinstance(value, (ast.AST, list))]
+        stack.extend(reversed(children))
+
+
+def winnow(tokens, k, window):
+    """
+    Returns the winnowed fingerprints of a token stream: the hashes of all
+    k-grams, of which the smallest in every run of "window" consecutive
+    ones is kept. Any shared run of at least k + window - 1 tokens is
+    guaranteed to share a fingerprint.
+    """
+    hashes = [stable_hash(" ".join(tokens[i:i + k]))
+              for i in range(max(1, len(tokens) - k + 1))]
+    if len(hashes) <= window:
+        return {min(hashes)}
+    fingerprints = set()
+    for start in range(len(hashes) - window + 1):
+        fingerprints.add(min(hashes[start:start + window]))
+    return fingerprints
+
+
+class SimilarityIndex:
+    """
+    A persistent MinHash/LSH index of submissions in an SQLite file. Adding
+    a submission returns the already indexed submissions that share an LSH
+    bucket with it and are at least as similar as asked; nothing else is
+    ever compared with it.
+    """
+
+    def __init__(self, path, settings=None):
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS settings ("
+            "name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, "
+            "digest TEXT NOT NULL, fingerprints BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "band INTEGER NOT NULL, key INTEGER NOT NULL, "
+            "submission INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS buckets_band_key "
+            "ON buckets (band, key);"
+            "CREATE INDEX IF NOT EXISTS buckets_submission "
+            "ON buckets (submission);")
+        stored = dict(self.connection.execute(
+            "SELECT name, value FROM settings"))
+        if stored:
+            if settings is not None and settings != stored:
+                raise ValueError(f"The index {path} was created with "
+                                 f"different settings: {stored}.")
+            settings = stored
+        else:
+            settings = dict(settings or DEFAULT_SETTINGS)
+            if settings["permutations"] % settings["bands"]:
+                raise ValueError("The number of permutations must be a "
+                                 "multiple of the number of bands.")
+            self.connection.executemany(
+                "INSERT INTO settings VALUES (?, ?)", settings.items())
+        self.settings = settings
+        generator = random.Random(settings["seed"])
+        self.permutations = [(generator.randrange(1, MERSENNE_PRIME),
+                              generator.randrange(MERSENNE_PRIME))
+                             for _ in range(settings["permutations"])]
+
+    def fingerprint(self, source):
+        """ Returns the winnowed fingerprints of a submission's source. """
+        tokens = list(normalized_tokens(ast.parse(source)))
+        return winnow(tokens, self.settings["k"], self.settings["window"])
+
+    def signature(self, fingerprints):
+        """ Returns the MinHash signature of a set of fingerprints. """
+        return [min((a * value + b) % MERSENNE_PRIME
+                    for value in fingerprints)
+                for a, b in self.permutations]
+
+    def band_keys(self, signature):
+        """
+        Returns the LSH bucket key of every band of a signature, as a signed
+        64-bit integer so that SQLite stores it as one.
+        """
+        rows = len(signature) // self.settings["bands"]
+        return [stable_hash(",".join(map(str, signature[i:i + rows])))
+                - (1 << 63)
+                for i in range(0, len(signature), rows)]
+
+    def add(self, name, source, threshold=0.0):
+        """
+        Indexes a submission under "name" and returns [(similarity, other
+        name)] for the indexed submissions it shares a bucket with, best
+        first, keeping those whose Jaccard similarity of fingerprints is at
+        least "threshold". A name that is already indexed with the same
+        content is left alone; with another content it is replaced. Raises
+        SyntaxError if the source does not parse.
+        """
+        digest = hashlib.sha256(source).hexdigest()
+        row = self.connection.execute(
+            "SELECT id, digest FROM submissions WHERE name = ?",
+            (name,)).fetchone()
+        if row is not None and row[1] == digest:
+            return self.similar(row[0], threshold)
+
+        fingerprints = self.fingerprint(source)
+        keys = self.band_keys(self.signature(fingerprints))
+        packed = array.array("Q", sorted(fingerprints)).tobytes()
+        self.connection.execute("BEGIN")
+        try:
+            if row is not None:
+                self.connection.execute(
+                    "DELETE FROM buckets WHERE submission = ?", (row[0],))
+                self.connection.execute(
+                    "DELETE FROM submissions WHERE id = ?", (row[0],))
+            submission = self.connection.execute(
+                "INSERT INTO submissions (name, digest, fingerprints) "
+                "VALUES (?, ?, ?)", (name, digest, packed)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO buckets VALUES (?, ?, ?)",
+                [(band, key, submission) for band, key in enumerate(keys)])
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return self.similar(submission, threshold)
+
+    def load_fingerprints(self, submission):
+        """ Returns the name and the fingerprints of a submission. """
+        name, packed = self.connection.execute(
+            "SELECT name, fingerprints FROM submissions WHERE id = ?",
+            (submission,)).fetchone()
+        return name, set(array.array("Q", packed))
+
+    def similar(self, submission, threshold=0.0):
+        """
+        Returns [(similarity, name)] for the submissions that share a bucket
+        with the given one and reach "threshold", best first.
+        """
+        _, fingerprints = self.load_fingerprints(submission)
+        candidates = [other for (other,) in self.connection.execute(
+            "SELECT DISTINCT b.submission FROM buckets a JOIN buckets b "
+            "ON a.band = b.band AND a.key = b.key "
+            "WHERE a.submission = ? AND b.submission != ?",
+            (submission, submission))]
+        found = []
+        for other in candidates:
+            name, other_fingerprints = self.load_fingerprints(other)
+            similarity = jaccard(fingerprints, other_fingerprints)
+            if similarity >= threshold:
+                found.append((similarity, name))
+        return sorted(found, key=lambda pair: (-pair[0], pair[1]))
+
+    def pairs(self, threshold=0.0):
+        """
+        Returns [(similarity, name, other name)] for every pair of indexed
+        submissions that share an LSH bucket and reach "threshold", best
+        first. Only pairs within a bucket are compared.
+        """
+        candidates = self.connection.execute(
+            "SELECT DISTINCT a.submission, b.submission FROM buckets a "
+            "JOIN buckets b ON a.band = b.band AND a.key = b.key "
+            "AND a.submission < b.submission").fetchall()
+        loaded = {}
+        found = []
+        for first, second in candidates:
+            for submission in (first, second):
+                if submission not in loaded:
+                    loaded[submission] = self.load_fingerprints(submission)
+            (name, fingerprints), (other, other_fingerprints) = \
+                loaded[first], loaded[second]
+            similarity = jaccard(fingerprints, other_fingerprints)
+            if similarity >= threshold:
+                found.append((similarity, name, other))
+        return sorted(found, key=lambda pair: (-pair[0], pair[1], pair[2]))
+
+    def close(self):
+        self.connection.close()
+
+
+def jaccard(first, second):
+    """ The Jaccard similarity of two sets of fingerprints. """
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def collect_files(targets):
+    """ Expands files and directories into the sorted Python files. """
+    files = []
+    for target in targets:
+        if os.path.isdir(target):
+            files.extend(glob.glob(os.path.join(target, "**", "*.py"),
+                                   recursive=True))
+        else:
+            files.append(target)
+    return sorted(files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find structurally similar adventure games across a "
+                    "cohort with a persistent MinHash/LSH index."
+    )
+    parser.add_argument(
+        "command",
+        help="'add' indexes files and prints the similar submissions "
+             "already indexed; 'pairs' prints every similar pair.",
+        choices=["add", "pairs"]
+    )
+    parser.add_argument(
+        "index",
+        help="The SQLite file of the index; it is created if needed."
+    )
+    parser.add_argument(
+        "files",
+        help="Python files or directories of them to add.",
+        nargs="*"
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Smallest Jaccard similarity of fingerprints to report "
+             "(default: 0.5).",
+        type=float,
+        default=0.5
+    )
+    args = parser.parse_args()
+
+    index = SimilarityIndex(args.index)
+    try:
+        if args.command == "add":
+            for path in collect_files(args.files):
+                with open(path, "rb") as f:
+                    source = f.read()
+                try:
+                    matches = index.add(path, source, args.threshold)
+                except (SyntaxError, ValueError) as e:
+                    print(f"{path}: skipped, it does not parse ({e}).",
+                          file=sys.stderr)
+                    continue
+                for similarity, other in matches:
+                    print(f"{similarity:.2f}  {path}  {other}")
+        else:
+            for similarity, name, other in index.pairs(args.threshold):
+                print(f"{similarity:.2f}  {name}  {other}")
+    finally:
+        index.close()
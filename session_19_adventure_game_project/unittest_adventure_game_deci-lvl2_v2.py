@@ -11,18 +11,68 @@
 
 import argparse
 import ast
+import bisect
+import codecs
+import collections
+import contextlib
+import dataclasses
+import fnmatch
+import functools
+import glob
+import hashlib
+import importlib.util
 import io
+import json
+import math
+import operator
 import os
 import re
-import subprocess
+import sqlite3
 import sys
+import tempfile
+import time
 import tokenize
 import unittest
 
-import pycodestyle
+# Modules only some runs need are imported where they are used, so that a
+# single file graded from an editor hook does not pay for them: pycodestyle
+# (the first time a submission is linted), asyncio and signal (the grading
+# server), concurrent.futures (batch mode), zipfile and tarfile (archives),
+# and cProfile, pstats and tracemalloc (--profile).
 
 python_command = sys.executable
 
+# The submission under test and whether pycodestyle runs on it. Both are set
+# by the command line for a single run, or by grade_file() for each
+# submission of a batch.
+file_name = None
+pycodestyle_run = False
+
+# The GradingProfile of the submission being graded, when grading is
+# profiled; set by grade_source().
+grading_profile = None
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache",
+                                  "adventure_game_grader", "results.sqlite3")
+DEFAULT_CACHE_SIZE_MB = 256
+
+# Archives whose Python members can be graded without extracting them, and
+# the largest member that is read; bigger ones are reported, not graded.
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2",
+                      ".tar.xz", ".txz")
+MAX_MEMBER_BYTES = 1024 * 1024
+
+# The files that are graded
+SUBMISSION_EXTENSIONS = (".py", ".ipynb")
+
+# Jupyter notebooks are read in chunks of this size, so their outputs are
+# skipped without ever being held in memory whole.
+NOTEBOOK_CHUNK_SIZE = 64 * 1024
+
+# Where the grading server listens; grade_client.py uses the same default.
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(),
+                                   "adventure_game_grader.sock")
+
 
 def msg_color(message, color):
     color_codes = {
@@ -81,24 +131,210 @@ def remove_comments(source_code):
     return ''.join(out)
 
 
-def check_pep8_compliance(file_target, errors):
+@functools.lru_cache(maxsize=1)
+def style_guide():
+    """
+    The pycodestyle StyleGuide of the grader, configured once per process:
+    incremental regrading runs pycodestyle once per changed function. This
+    is where pycodestyle is imported, so a verdict replayed from the cache
+    never loads it.
+    """
+    import pycodestyle
+
+    class CollectingReport(pycodestyle.BaseReport):
+        """
+        A pycodestyle report that keeps every error as a structured
+        (line, column, code, message) record instead of printing it. The
+        column is the 0-based offset, as pycodestyle reports it internally.
+        """
+
+        def __init__(self, options):
+            super().__init__(options)
+            self._repeat = options.repeat
+            self.records = []
+
+        def init_file(self, filename, lines, expected, line_offset):
+            self.records = []
+            return super().init_file(filename, lines, expected, line_offset)
+
+        def error(self, line_number, offset, text, check):
+            code = super().error(line_number, offset, text, check)
+            # Same filtering as pycodestyle's StandardReport: without
+            # "--first", every occurrence of a code is kept
+            if code and (self.counters[code] == 1 or self._repeat):
+                self.records.append((line_number, offset, code, text[5:]))
+            return code
+
+    return pycodestyle.StyleGuide(reporter=CollectingReport)
+
+
+def run_pycodestyle(path, source_lines):
+    """
+    Runs every pycodestyle check once over the given lines, in-process, and
+    returns the sorted (line, column, code, message) records.
+    """
+    style = style_guide()
+    report = style.options.report
+    report.start()
+    style.input_file(path, lines=list(source_lines))
+    report.stop()
+    return tuple(sorted(report.records))
+
+
+def pep8_violations(index, errors):
+    """
+    Lists the pycodestyle records of the submission whose code is one of
+    "errors", formatted as "Line: <line>, Column: <offset>: <message>".
+    """
+    return [f"Line: {index.line_label(line)}, Column: {col}: {message}"
+            for line, col, error_code, message in index.pycodestyle_records
+            if error_code in errors]
+
+
+def check_pep8_compliance(index, errors):
     """
     This function serves to verify the compliance of a Python source file
-    with the PEP 8 style guide."""
-
-    old_stdout = sys.stdout
-    new_stdout = io.StringIO()
-    sys.stdout = new_stdout
-    style = pycodestyle.StyleGuide(show_source=False)
-    result = style.check_files([file_target])
-    sys.stdout = old_stdout
-    if hasattr(result, '_deferred_print'):
-        # noinspection PyProtectedMember
-        for line, col, error_code, message in (item[:4] for item in
-                                               result._deferred_print):
-            if error_code in errors:
-                return f"Line: {line}, Column: {col}: {message}"
-    return None
+    with the PEP 8 style guide. It is answered from the pycodestyle records
+    of the submission's SourceIndex, so no extra lint pass is run. Returns
+    the first matching error, or None."""
+
+    violations = pep8_violations(index, errors)
+    return violations[0] if violations else None
+
+
+# Tokens that end a logical line or open/close an indented block
+LINE_BOUNDARY_TOKENS = {tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT,
+                        tokenize.ENCODING}
+
+# Tokens that start a string literal: a whole string, or the start of an
+# f-string on Python 3.12 and later
+STRING_START_TOKENS = {tokenize.STRING,
+                       getattr(tokenize, "FSTRING_START", tokenize.STRING)}
+
+# Whitespace that counts as trailing whitespace, as in pycodestyle's W291
+TRAILING_WHITESPACE = " \t\v\f"
+
+FUNCTION_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def find_lines(text, needle):
+    """
+    Yields (line number, offset) for every occurrence of "needle" in
+    "text". The text is searched with str.find, so a clean file costs one
+    scan at C speed and no Python-level work per line.
+    """
+    line_number, counted = 1, 0
+    position = text.find(needle)
+    while position != -1:
+        line_number += text.count("\n", counted, position)
+        counted = position
+        yield line_number, position
+        position = text.find(needle, position + 1)
+
+
+def token_at(tokens, position):
+    """
+    Returns the index of the first token that starts at or after the
+    (line, column) "position", by bisection on the token start positions.
+    """
+    return bisect.bisect_left(tokens, position,
+                              key=operator.attrgetter("start"))
+
+
+def lint_lines(index):
+    """
+    Checks the line-level PEP 8 rules of the grader and returns every
+    violation as a (line, message) pair, in line order:
+    tabs, lines of 80 characters or more, several modules imported by one
+    "import" statement, both quote characters used as string delimiters,
+    trailing whitespace and function names that are not lower_case.
+
+    The text is searched as a whole for the characters each rule is about,
+    so only the lines that contain them are looked at one by one. Quote
+    styles come from the string tokens, so quotes inside strings or
+    comments, triple quotes and escapes are never mistaken for delimiters;
+    imports are confirmed on the token stream for the same reason.
+    """
+    text, lines, tokens = index.text, index.lines, index.tokens
+    violations = []
+
+    for line_number in dict.fromkeys(
+            line_number for line_number, _ in find_lines(text, "\t")):
+        violations.append((line_number, 0,
+                           f"Line {index.line_label(line_number)}: Tab "
+                           f"character detected."))
+
+    if max(map(len, lines), default=0) >= 80:
+        for line_number, line in enumerate(lines, start=1):
+            if len(line) >= 80:
+                violations.append((line_number, 1,
+                                   f"Line {index.line_label(line_number)}: "
+                                   f"Exceeds 80 characters."))
+
+    # Searching for a single character is far cheaper than for a pair, so
+    # the rarer kinds of whitespace are only paired with "\n" when present
+    trailing = {line_number
+                for char in TRAILING_WHITESPACE if char in text
+                for line_number, _ in find_lines(text, char + "\n")}
+    if lines and lines[-1][-1:] and lines[-1][-1] in TRAILING_WHITESPACE:
+        trailing.add(len(lines))
+    for line_number in trailing:
+        violations.append((line_number, 4,
+                           f"Line {index.line_label(line_number)}: "
+                           f"Trailing whitespace detected."))
+
+    for line_number, position in find_lines(text, "import"):
+        column = position - text.rfind("\n", 0, position) - 1
+        i = token_at(tokens, (line_number, column))
+        if (i == len(tokens) or tokens[i].string != "import" or
+                tokens[i].start != (line_number, column)):
+            continue
+        previous = i - 1
+        while previous >= 0 and tokens[previous].type in (tokenize.COMMENT,
+                                                          tokenize.NL):
+            previous -= 1
+        if previous >= 0 and \
+                tokens[previous].type not in LINE_BOUNDARY_TOKENS:
+            continue
+        i += 1
+        while i < len(tokens) and tokens[i].type != tokenize.NEWLINE:
+            if tokens[i].type == tokenize.OP and tokens[i].string == ",":
+                violations.append((line_number, 2,
+                                   f"Line {index.line_label(line_number)}: "
+                                   f"Multiple imports on one line."))
+                break
+            i += 1
+
+    # Without both quote characters in the text, there cannot be both kinds
+    # of string delimiters, and the token stream need not be searched.
+    if "'" in text and '"' in text:
+        first_quote_line = {}
+        for token in tokens:
+            if token.type in STRING_START_TOKENS:
+                quote = token.string.lstrip("rRbBuUfF")[:1]
+                if quote not in first_quote_line:
+                    first_quote_line[quote] = token.start[0]
+                    if len(first_quote_line) == 2:
+                        break
+        if "'" in first_quote_line and '"' in first_quote_line:
+            single, double = first_quote_line["'"], first_quote_line['"']
+            line_number = max(single, double)
+            single, double = index.line_label(single), index.line_label(double)
+            violations.append((line_number, 3,
+                               f"Line {single} and {double}: Both single "
+                               f"quotes (line {single}) and double (line "
+                               f"{double}) quotes are used for string "
+                               f"delimiters."))
+
+    for line_number, name, _ in index.function_summary.functions:
+        if not FUNCTION_NAME_RE.match(name):
+            violations.append((line_number, 5,
+                               f"Line {index.line_label(line_number)}: "
+                               f"Function name '{name}()' does not follow "
+                               f"PEP 8 naming conventions."))
+
+    return [(line_number, message)
+            for line_number, _, message in sorted(violations)]
 
 
 class StudentFileDetector(ast.NodeVisitor):
@@ -108,9 +344,14 @@ class StudentFileDetector(ast.NodeVisitor):
     analysis on a Python source file to identify and catalog various constructs
     and idioms used within the code. The class relies on the visitor pattern
     for traversal and analysis of AST nodes.
+
+    Every set is filled in a single traversal. The enclosing functions are
+    tracked on a scope stack instead of being looked up through parent
+    links, so the tree is never modified and the cost stays linear in the
+    number of nodes.
     """
 
-    def __init__(self):
+    def __init__(self, rubric=None, import_aliases=None):
         self.stdout_write_statements = set()
         self.function_definitions = set()
         self.variable_assignments = set()
@@ -119,46 +360,76 @@ class StudentFileDetector(ast.NodeVisitor):
         self.function_names = set()
         self.recursive_calls = set()
         self.print_statements = set()
-
-    @staticmethod
-    def set_parents(tree):
+        # The module or module attribute each imported name stands for
+        # ("t" for "time" after "import time as t"), for the rubric's calls:
+        # those given, then those of the imports visited
+        self.import_aliases = dict(import_aliases or {})
+        # One [name, has_while] frame per enclosing "FunctionDef", innermost
+        # last, plus how many open frames carry each name.
+        self._scope = []
+        self._open_names = {}
+        # The AST checks of a Rubric ride along on the same traversal: the
+        # matchers registered for a node's type count it for their check.
+        self.rubric = rubric
+        self._rubric_matchers = rubric.node_matchers if rubric else {}
+        self.rubric_counts = [0] * len(rubric.checks) if rubric else []
+
+    def visit(self, node):
+        """
+        Visits a node like "ast.NodeVisitor.visit", after counting it for
+        every rubric check that matches it.
+        """
+        matchers = self._rubric_matchers.get(type(node))
+        if matchers:
+            for check, match in matchers:
+                if match(node, self):
+                    self.rubric_counts[check] += 1
+        method = "visit_" + node.__class__.__name__
+        return getattr(self, method, self.generic_visit)(node)
+
+    def current_function(self):
         """
-        Annotates each AST node in the tree with its corresponding parent node.
+        Returns the name of the innermost "FunctionDef" being visited, or
+        None when the visitor is at module or class level.
         """
-        for parent in ast.walk(tree):
-            for child in ast.iter_child_nodes(parent):
-                child.parent = parent
+        return self._scope[-1][0] if self._scope else None
 
-    @staticmethod
-    def find_parent_function(node):
+    def qualified_name(self, name):
         """
-        Traverses the AST hierarchy in search of a parent "FunctionDef" node
-        for a given node. Returns the name of the parent function if found;
-        otherwise, returns None.
+        Returns a dotted name with its first part replaced by what the
+        imports visited so far bound it to: "t.sleep" is "time.sleep" after
+        "import time as t", and "nap" is "time.sleep" after "from time
+        import sleep as nap".
         """
-        current = node
-        while current:
-            if isinstance(current, ast.FunctionDef):
-                return current.name
-            current = getattr(current, "parent", None)
+        head, dot, rest = name.partition(".")
+        target = self.import_aliases.get(head)
+        return name if target is None else target + dot + rest
+
+    def visit_Import(self, node):
+        """ Records the names an "import" statement binds. """
+        self.import_aliases.update(import_bindings(node))
+        self.generic_visit(node)
+
+    visit_ImportFrom = visit_Import
 
     def visit_Call(self, node):
         """
         Visits "Call" nodes to identify instances where the "input()" function
         is invoked. Adds the name of the parent function to the
-        "function_with_input" set if it exists.
+        "function_with_input" set if it exists. A call to the name of any
+        enclosing function is recorded as a recursive call.
         """
+        parent_function = self.current_function()
         if isinstance(node.func, ast.Name):
+            if node.func.id in self._open_names:
+                self.recursive_calls.add(node.func.id)
             if node.func.id == "input":
-                parent_function = self.find_parent_function(node)
                 if parent_function is not None:
                     self.function_with_input.add(parent_function)
             elif node.func.id == "print":
-                parent_function = self.find_parent_function(node)
                 if parent_function is not None:
                     self.print_statements.add((parent_function, node.lineno))
         elif isinstance(node.func, ast.Attribute):
-            parent_function = self.find_parent_function(node)
             if node.func.attr == "write" and isinstance(
                     node.func.value, ast.Attribute
             ) and node.func.value.attr == 'stdout':
@@ -175,9 +446,7 @@ class StudentFileDetector(ast.NodeVisitor):
         of parent function name, variable name, and the node itself to the
         "variable_assignments" set.
         """
-        parent_function = self.find_parent_function(node)
-        parent_function = parent_function if parent_function \
-            else "global_scope"
+        parent_function = self.current_function() or "global_scope"
         for target in node.targets:
             if isinstance(target, ast.Name):
                 variable_name = target.id
@@ -191,15 +460,26 @@ class StudentFileDetector(ast.NodeVisitor):
         "-=", etc. Adds a tuple of parent function name, variable name, and
         the node itself to the "variable_assignments" set.
         """
-        parent_function = self.find_parent_function(node)
-        parent_function = parent_function if parent_function \
-            else "global_scope"
+        parent_function = self.current_function() or "global_scope"
         if isinstance(node.target, ast.Name):
             variable_name = node.target.id
             self.variable_assignments.add(
                 (parent_function, variable_name, node))
         self.generic_visit(node)
 
+    def visit_While(self, node):
+        """
+        Visits "While" nodes and marks every enclosing function as containing
+        a "while" loop. Frames are marked from the innermost outwards; the
+        walk stops at the first frame that is already marked, because all the
+        frames below it were marked at the same time.
+        """
+        for frame in reversed(self._scope):
+            if frame[1]:
+                break
+            frame[1] = True
+        self.generic_visit(node)
+
     def visit_FunctionDef(self, node):
         """
         Visits "FunctionDef" nodes to identify function definitions, "while"
@@ -211,14 +491,1060 @@ class StudentFileDetector(ast.NodeVisitor):
         self.function_names.add(function_name)
         self.function_definitions.add((function_name, node))
 
-        for sub_node in ast.walk(node):
-            if isinstance(sub_node, ast.While):
-                self.function_with_while.add(function_name)
-            elif (isinstance(sub_node, ast.Call) and
-                  isinstance(sub_node.func, ast.Name) and
-                  sub_node.func.id == function_name):
-                self.recursive_calls.add(function_name)
-        self.generic_visit(node)
+        frame = [function_name, False]
+        self._scope.append(frame)
+        self._open_names[function_name] = \
+            self._open_names.get(function_name, 0) + 1
+        try:
+            self.generic_visit(node)
+        finally:
+            self._scope.pop()
+            self._open_names[function_name] -= 1
+            if not self._open_names[function_name]:
+                del self._open_names[function_name]
+        if frame[1]:
+            self.function_with_while.add(function_name)
+
+
+# JSON whitespace, a run of characters inside a JSON string (up to its
+# closing quote, or a backslash at the end of the buffer) and a number,
+# "true", "false" or "null"
+JSON_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+JSON_STRING_RUN_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+JSON_SCALAR_RE = re.compile(r'[^ \t\n\r"{}\[\],:]*')
+
+# An IPython line magic or shell escape at the start of a line ("%pip
+# install ...", "!ls"); a cell that starts with "%%" is a cell magic
+MAGIC_RE = re.compile(r"[ \t]*(?:%|!)[A-Za-z_./~$]")
+
+
+class JsonStream:
+    """
+    A pull parser over a JSON document read from a binary stream, one chunk
+    at a time. The caller walks the document with iter_object() and
+    iter_array(), and reads each value it needs with read_value() or skips
+    it with skip_value(). A skipped value is never held in memory whole,
+    however large it is, so only the parts of the document that are read
+    cost memory.
+    """
+
+    def __init__(self, stream, chunk_size=NOTEBOOK_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.position = 0
+        # Characters dropped from the front of the buffer so far
+        self.consumed = 0
+        self.at_end = False
+
+    def error(self, message):
+        """ A ValueError that tells where in the document it happened. """
+        return ValueError(f"{message} at character "
+                          f"{self.consumed + self.position}")
+
+    def fill(self):
+        """
+        Drops the consumed part of the buffer and appends the next chunk.
+        Returns False when the stream has nothing more.
+        """
+        if self.at_end:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.at_end = not chunk
+        self.consumed += self.position
+        self.buffer = self.buffer[self.position:] + \
+            self.decoder.decode(chunk, final=self.at_end)
+        self.position = 0
+        return not self.at_end
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character, or "" at the end
+        of the document.
+        """
+        while True:
+            self.position = JSON_WHITESPACE_RE.match(self.buffer,
+                                                     self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        """ Consumes the next character, which must be "char". """
+        if self.peek() != char:
+            raise self.error(f"Expected {char!r}")
+        self.position += 1
+
+    def scan_string(self, keep):
+        """
+        Finds the closing quote of the string that starts at the current
+        position and returns its index in the buffer. Unless "keep" is
+        true, the scanned characters are dropped as the buffer is refilled,
+        so that the string is never in memory whole.
+        """
+        scan = self.position + 1
+        while True:
+            scan = JSON_STRING_RUN_RE.match(self.buffer, scan).end()
+            if scan < len(self.buffer) and self.buffer[scan] == '"':
+                return scan
+            # The buffer ends inside the string, maybe on a backslash
+            if not keep:
+                self.position = scan
+            offset = scan - self.position
+            if not self.fill():
+                raise self.error("Unterminated string")
+            scan = self.position + offset
+
+    def read_string(self):
+        """ Reads and decodes the string at the current position. """
+        if self.peek() != '"':
+            raise self.error("Expected a string")
+        self.scan_string(keep=True)
+        text, self.position = json.decoder.scanstring(self.buffer,
+                                                      self.position + 1)
+        return text
+
+    def read_scalar(self):
+        """ Reads a number, "true", "false" or "null" as its JSON text. """
+        while True:
+            end = JSON_SCALAR_RE.match(self.buffer, self.position).end()
+            if end < len(self.buffer) or not self.fill():
+                break
+        if end == self.position:
+            raise self.error("Unexpected character")
+        text, self.position = self.buffer[self.position:end], end
+        return text
+
+    def iter_object(self):
+        """
+        Yields the keys of the object at the current position. The value
+        of each key must be read or skipped before the next key is asked
+        for.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.read_string()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.position += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise self.error("Expected ',' or '}'")
+
+    def iter_array(self):
+        """
+        Yields the index of every element of the array at the current
+        position. Each element must be read or skipped before the next one
+        is asked for.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self.peek()
+            self.position += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise self.error("Expected ',' or ']'")
+
+    def read_value(self):
+        """ Reads the value at the current position as Python objects. """
+        char = self.peek()
+        if char == '"':
+            return self.read_string()
+        if char == "{":
+            return {key: self.read_value() for key in self.iter_object()}
+        if char == "[":
+            return [self.read_value() for _ in self.iter_array()]
+        try:
+            return json.loads(self.read_scalar())
+        except ValueError:
+            raise self.error("Invalid value") from None
+
+    def skip_value(self):
+        """
+        Skips the value at the current position without building it. Long
+        strings, such as the base64 images of notebook outputs, go through
+        the buffer one chunk at a time.
+        """
+        depth = 0
+        while True:
+            char = self.peek()
+            if char == '"':
+                self.position = self.scan_string(keep=False) + 1
+            elif char in ("{", "["):
+                depth += 1
+                self.position += 1
+            elif char in ("}", "]"):
+                depth -= 1
+                self.position += 1
+            elif char in (",", ":") and depth > 0:
+                self.position += 1
+            elif char == "":
+                raise self.error("Unexpected end of the document")
+            else:
+                self.read_scalar()
+            if depth <= 0:
+                if depth < 0:
+                    raise self.error(f"Unexpected {char!r}")
+                return
+
+
+@dataclasses.dataclass(frozen=True)
+class Notebook:
+    """
+    The code of a Jupyter notebook as one Python source: the code cells in
+    order, two blank lines apart, like top-level blocks of a script. For
+    every line of "source", "cell_lines" has the (cell, line) it comes
+    from, both counted from 1 and cells counted among all the cells of the
+    notebook, or None for the lines between cells.
+    """
+    source: str
+    cell_lines: tuple
+
+
+def read_cells(reader, source_key):
+    """
+    Yields the (cell type, source) of every cell in the array at the
+    current position of a JsonStream. Only "cell_type" and "source_key" are
+    read; outputs, attachments and metadata are skipped, and so is the
+    source of a cell already known not to be code.
+    """
+    for _ in reader.iter_array():
+        cell_type = source = None
+        for key in reader.iter_object():
+            if key == "cell_type":
+                cell_type = reader.read_value()
+            elif key == source_key and cell_type in (None, "code"):
+                source = reader.read_value()
+            else:
+                reader.skip_value()
+        yield cell_type, source
+
+
+def read_notebook(stream):
+    """
+    Reads a Jupyter notebook (nbformat 3 or 4) from a binary stream with a
+    JsonStream and returns its code as a Notebook. No kernel is started and
+    nothing is run. IPython line magics and shell escapes are turned into
+    comments, and cells that start with a cell magic are left out, so that
+    the rest of the code can be parsed. Raises ValueError if the notebook
+    is not valid JSON or not UTF-8.
+    """
+    reader = JsonStream(stream)
+    cells = []
+    for key in reader.iter_object():
+        if key == "cells":
+            cells.extend(read_cells(reader, "source"))
+        elif key == "worksheets":
+            for _ in reader.iter_array():
+                for sheet_key in reader.iter_object():
+                    if sheet_key == "cells":
+                        cells.extend(read_cells(reader, "input"))
+                    else:
+                        reader.skip_value()
+        else:
+            reader.skip_value()
+    if reader.peek() != "":
+        raise reader.error("Extra data after the notebook")
+
+    lines, cell_lines = [], []
+    for number, (cell_type, source) in enumerate(cells, start=1):
+        if cell_type != "code" or not source:
+            continue
+        if isinstance(source, list):
+            source = "".join(source)
+        cell = source.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        while cell and not cell[-1].strip():
+            cell.pop()
+        first = 0
+        while first < len(cell) and not cell[first].strip():
+            first += 1
+        if first == len(cell) or cell[first].lstrip().startswith("%%"):
+            continue
+        if lines:
+            lines.extend(["", ""])
+            cell_lines.extend([None, None])
+        for line_number in range(first, len(cell)):
+            line = cell[line_number]
+            if MAGIC_RE.match(line):
+                line = line[:len(line) - len(line.lstrip())] + "# " + \
+                    line.lstrip()
+            lines.append(line)
+            cell_lines.append((number, line_number + 1))
+    return Notebook("".join(line + "\n" for line in lines),
+                    tuple(cell_lines))
+
+
+def is_notebook(path):
+    """ Tells whether a submission is a Jupyter notebook. """
+    return path.lower().endswith(".ipynb")
+
+
+@dataclasses.dataclass(frozen=True)
+class FunctionUnit:
+    """
+    A function defined at module level, the unit of incremental regrading:
+    its decorators and "def" start on line "start", its body on line
+    "body_start" (the same line for a one-line function) and it ends on line
+    "end". "key" identifies its source and its surroundings as far as the
+    checks can see them.
+    """
+    node: ast.FunctionDef
+    start: int
+    body_start: int
+    end: int
+    key: str
+
+    @property
+    def one_line(self):
+        """ Whether the body is on the line of the "def" header. """
+        return self.body_start == self.node.lineno
+
+
+@dataclasses.dataclass(frozen=True)
+class FunctionSummary:
+    """
+    What the function-scoped checks need to know about a submission: every
+    function definition as (line, name, documented), in line order, the
+    names of the functions that call input(), contain a "while" loop or
+    call themselves, and the AST counts of the rubric checks.
+    """
+    functions: tuple
+    with_input: frozenset
+    with_while: frozenset
+    recursive: frozenset
+    rubric_counts: tuple
+
+
+def summarize_functions(index, node, offset=0):
+    """
+    Runs a StudentFileDetector with the index's rubric over "node" and
+    returns what it found as a JSON-able dict, with the line numbers of the
+    functions made relative to line "offset" so that the summary of a
+    function stays valid when the function moves.
+    """
+    detector = StudentFileDetector(index.rubric, index.import_aliases)
+    detector.visit(node)
+    functions = []
+    for name, function in detector.function_definitions:
+        lineno = function.lineno
+        documented = any(line in index.comment_lines
+                         for line in (lineno - 1, lineno, lineno + 1)) or \
+            ast.get_docstring(function, clean=False) is not None
+        functions.append([lineno - offset, name, documented])
+    return {"functions": sorted(functions),
+            "with_input": sorted(detector.function_with_input),
+            "with_while": sorted(detector.function_with_while),
+            "recursive": sorted(detector.recursive_calls),
+            "rubric_counts": detector.rubric_counts}
+
+
+@dataclasses.dataclass(frozen=True)
+class SourceIndex:
+    """
+    An immutable snapshot of one submission, built once and shared by every
+    check. It holds the raw bytes, the decoded text, the line table, the
+    token stream and the AST, so that the file is read, decoded, tokenized
+    and parsed exactly once per submission; what the checks derive from them
+    is computed on first use.
+
+    With a "function_cache" (a ResultCache), the results of every function
+    defined at module level, detector findings and pycodestyle records, are
+    looked up by the function's source before they are computed: a student
+    who resubmits after fixing one function only has that function checked
+    again.
+
+    A Jupyter notebook is indexed as the code of its Notebook, and
+    "cell_lines" maps the lines back to the cells they come from.
+    """
+    path: str
+    raw: bytes
+    encoding: str
+    text: str
+    lines: tuple
+    source_lines: tuple
+    tokens: tuple
+    comment_lines: frozenset
+    tree: ast.Module
+    rubric: object = None
+    function_cache: object = None
+    cell_lines: tuple = None
+
+    @classmethod
+    def from_file(cls, path, rubric=None, function_cache=None):
+        """
+        Reads the submission at "path" and indexes it; a notebook is read
+        with read_notebook(), without loading its outputs.
+        """
+        with open(path, "rb") as f:
+            if is_notebook(path):
+                notebook = read_notebook(f)
+                return cls.from_bytes(path, notebook.source.encode(), rubric,
+                                      function_cache, notebook.cell_lines)
+            return cls.from_bytes(path, f.read(), rubric, function_cache)
+
+    @classmethod
+    def from_bytes(cls, path, raw, rubric=None, function_cache=None,
+                   cell_lines=None):
+        """
+        Indexes a submission given as bytes. The encoding is detected the
+        way the interpreter does it (PEP 263), and line endings are
+        normalised like a file opened in text mode. The AST checks of
+        "rubric", if given, are counted in the function summary. The code
+        of a notebook comes with its "cell_lines", which a syntax error is
+        reported with.
+        """
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(raw).readline)
+        text = io.TextIOWrapper(io.BytesIO(raw), encoding=encoding).read()
+        try:
+            tree = ast.parse(text)
+        except SyntaxError as e:
+            if cell_lines and e.lineno and e.lineno <= len(cell_lines) and \
+                    cell_lines[e.lineno - 1] is not None:
+                cell, e.lineno = cell_lines[e.lineno - 1]
+                e.filename = f"cell {cell}"
+            raise
+        source_lines = tuple(io.StringIO(text).readlines())
+        tokens = tuple(tokenize.generate_tokens(iter(source_lines).__next__))
+        comment_lines = frozenset(token.start[0] for token in tokens
+                                  if token.type == tokenize.COMMENT)
+        return cls(path=path, raw=raw, encoding=encoding, text=text,
+                   lines=tuple(text.split("\n")), source_lines=source_lines,
+                   tokens=tokens, comment_lines=comment_lines, tree=tree,
+                   rubric=rubric, function_cache=function_cache,
+                   cell_lines=cell_lines)
+
+    def cell_location(self, line):
+        """
+        Returns "cell <cell>, line <line in cell>" for a line of a notebook,
+        or None for a Python file and the lines between cells.
+        """
+        if self.cell_lines is None or not 0 < line <= len(self.cell_lines) \
+                or self.cell_lines[line - 1] is None:
+            return None
+        cell, cell_line = self.cell_lines[line - 1]
+        return f"cell {cell}, line {cell_line}"
+
+    def line_label(self, line):
+        """
+        How a line is named in messages: its number, followed for a
+        notebook by the cell and the line in the cell it comes from.
+        """
+        location = self.cell_location(line)
+        return str(line) if location is None else f"{line} ({location})"
+
+    @functools.cached_property
+    def detector(self):
+        """ A StudentFileDetector run over the whole submission. """
+        detector = StudentFileDetector(self.rubric, self.import_aliases)
+        detector.visit(self.tree)
+        return detector
+
+    @functools.cached_property
+    def import_aliases(self):
+        """
+        The names the imports outside of the functions bind (see
+        import_bindings()). A function's body is summarized on its own, so
+        its detector starts from these to resolve "t.sleep" to "time.sleep".
+        """
+        aliases = {}
+        for statement in self.tree.body:
+            if isinstance(statement, ast.FunctionDef):
+                continue
+            for node in ast.walk(statement):
+                if isinstance(node, (ast.Import, ast.ImportFrom)):
+                    aliases.update(import_bindings(node))
+        return aliases
+
+    @functools.cached_property
+    def function_units(self):
+        """
+        The FunctionUnit of every function defined at module level. Its key
+        covers the grader, the exact source lines of the function, whether
+        the lines just around it carry a comment and the module's import
+        aliases, which is all its checks depend on.
+        """
+        prefix = hashlib.sha256(grader_fingerprint().encode())
+        prefix.update(json.dumps(sorted(self.import_aliases.items()))
+                      .encode())
+        units = []
+        for node in self.tree.body:
+            if not isinstance(node, ast.FunctionDef):
+                continue
+            start = min([node.lineno] + [decorator.lineno
+                                         for decorator in node.decorator_list])
+            body = node.body[0]
+            body_line = self.source_lines[body.lineno - 1]
+            body_start = body.lineno if not body_line[:body.col_offset]\
+                .strip() else node.lineno
+            digest = prefix.copy()
+            digest.update(f"{start - 1 in self.comment_lines}|"
+                          f"{node.end_lineno + 1 in self.comment_lines}|"
+                          .encode())
+            digest.update("".join(
+                self.source_lines[start - 1:node.end_lineno]).encode())
+            units.append(FunctionUnit(node, start, body_start,
+                                      node.end_lineno, digest.hexdigest()))
+        return tuple(units)
+
+    @functools.cached_property
+    def unit_results(self):
+        """
+        The results of every FunctionUnit, as dicts with its "summary"
+        (see summarize_functions()) and, when a function cache is used, its
+        "pycodestyle" records: those of the lines from its body onwards, as
+        pycodestyle reports them for the function on its own, relative to
+        its first line. They are taken from the cache when it has them, and
+        stored there otherwise.
+        """
+        units = self.function_units
+        cached = {}
+        if self.function_cache is not None:
+            cached = self.function_cache.get_functions(
+                [unit.key for unit in units])
+        results, fresh = [], {}
+        for unit in units:
+            result = cached.get(unit.key)
+            if result is None:
+                result = {"summary": summarize_functions(
+                    self, unit.node, unit.start - 1), "pycodestyle": None}
+                if self.function_cache is not None and not unit.one_line:
+                    with measure("pycodestyle", "pycodestyle"):
+                        records = run_pycodestyle(
+                            self.path,
+                            self.source_lines[unit.start - 1:unit.end])
+                    result["pycodestyle"] = [
+                        list(record) for record in records
+                        if record[0] >= unit.body_start - unit.start + 1]
+                fresh[unit.key] = result
+            results.append(result)
+        if fresh and self.function_cache is not None:
+            self.function_cache.put_functions(fresh)
+        return results
+
+    @functools.cached_property
+    def function_summary(self):
+        """
+        The FunctionSummary of the submission: that of each function defined
+        at module level (from unit_results) merged with that of the rest of
+        the module, which is always traversed again.
+        """
+        units = self.function_units
+        unit_nodes = {id(unit.node) for unit in units}
+        rest = ast.Module(body=[node for node in self.tree.body
+                                if id(node) not in unit_nodes],
+                          type_ignores=[])
+        parts = [(0, summarize_functions(self, rest))]
+        parts.extend((unit.start - 1, result["summary"])
+                     for unit, result in zip(units, self.unit_results))
+        functions = []
+        with_input, with_while, recursive = set(), set(), set()
+        rubric_counts = [0] * (len(self.rubric.checks) if self.rubric
+                               else 0)
+        for offset, summary in parts:
+            functions.extend((line + offset, name, documented)
+                             for line, name, documented
+                             in summary["functions"])
+            with_input.update(summary["with_input"])
+            with_while.update(summary["with_while"])
+            recursive.update(summary["recursive"])
+            for check, count in enumerate(summary["rubric_counts"]):
+                rubric_counts[check] += count
+        return FunctionSummary(tuple(sorted(functions)),
+                               frozenset(with_input), frozenset(with_while),
+                               frozenset(recursive), tuple(rubric_counts))
+
+    def incremental_style(self):
+        """
+        Tells whether the pycodestyle records can be put together from
+        those of the functions: pycodestyle decides how the whole file is
+        indented from its first indented line, so a file with tabs or form
+        feeds is always checked as a whole, and so is a file that does not
+        end with a newline.
+        """
+        return self.function_cache is not None and \
+            self.text.endswith("\n") and "\t" not in self.text and \
+            "\f" not in self.text
+
+    def skeleton_lines(self):
+        """
+        Returns the submission with the body of every function that is not
+        a one-liner replaced by a single "pass", indented like the last
+        logical line of the body, so that the lines after it are checked
+        by pycodestyle in the same state, and the original line number of
+        every kept line (None for the stand-ins).
+        """
+        lines, numbers = [], []
+        line = 1
+        for unit in self.function_units:
+            if unit.one_line:
+                continue
+            lines.extend(self.source_lines[line - 1:unit.body_start - 1])
+            numbers.extend(range(line, unit.body_start))
+            # The first token of the logical line that ends on "end"
+            i = token_at(self.tokens, (unit.end + 1, 0)) - 1
+            while self.tokens[i].type != tokenize.NEWLINE:
+                i -= 1
+            i -= 1
+            while self.tokens[i].type not in LINE_BOUNDARY_TOKENS:
+                i -= 1
+            i += 1
+            while self.tokens[i].type in (tokenize.NL, tokenize.COMMENT):
+                i += 1
+            last_line = self.source_lines[self.tokens[i].start[0] - 1]
+            lines.append(last_line[:len(last_line) - len(last_line.lstrip())]
+                         + "pass\n")
+            numbers.append(None)
+            line = unit.end + 1
+        lines.extend(self.source_lines[line - 1:])
+        numbers.extend(range(line, len(self.source_lines) + 1))
+        return lines, numbers
+
+    @functools.cached_property
+    def pycodestyle_records(self):
+        """
+        The (line, column, code, message) records of pycodestyle for the
+        submission, computed on first use and shared by every style check.
+        When incremental_style() allows it, they are put together from the
+        records of the function bodies (see unit_results) and those of one
+        pycodestyle pass over the rest of the file, skeleton_lines();
+        otherwise one pass runs over the whole file.
+        """
+        if not self.incremental_style():
+            with measure("pycodestyle", "pycodestyle"):
+                return run_pycodestyle(self.path, self.source_lines)
+        lines, numbers = self.skeleton_lines()
+        with measure("pycodestyle", "pycodestyle"):
+            skeleton = run_pycodestyle(self.path, lines)
+        records = [(numbers[line - 1], col, code, message)
+                   for line, col, code, message in skeleton
+                   if numbers[line - 1] is not None]
+        for unit, result in zip(self.function_units, self.unit_results):
+            if not unit.one_line:
+                records.extend((line + unit.start - 1, col, code, message)
+                               for line, col, code, message
+                               in result["pycodestyle"])
+        return tuple(sorted(records))
+
+    def pycodestyle_issues(self):
+        """
+        Formats the pycodestyle records the way the pycodestyle command line
+        prints them: "path:line:column: code message", 1-based column. In a
+        notebook, the cell and the line in the cell follow in parentheses.
+        """
+        issues = []
+        for line, col, code, message in self.pycodestyle_records:
+            issue = f"{self.path}:{line}:{col + 1}: {code} {message}"
+            location = self.cell_location(line)
+            issues.append(issue if location is None
+                          else f"{issue} ({location})")
+        return issues
+
+
+# The default rubric, next to this script
+RUBRIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "rubric.toml")
+
+# Operators an "assignments" check can ask for
+RUBRIC_OPERATORS = {"+": ast.Add, "-": ast.Sub, "*": ast.Mult, "/": ast.Div,
+                    "//": ast.FloorDiv, "%": ast.Mod, "**": ast.Pow}
+
+
+def dotted_name(node):
+    """
+    Returns the dotted name a call goes to ("print", "time.sleep",
+    "sys.stdout.write"), or None when it is not a plain name or attribute
+    chain.
+    """
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def import_bindings(node):
+    """
+    Returns the names an "import" or "from ... import" node binds, mapped
+    to the module or module attribute each stands for: {"t": "time"} for
+    "import time as t" and {"nap": "time.sleep"} for "from time import
+    sleep as nap". Plain "import time" binds "time" to itself and is left
+    out, as are relative and "*" imports.
+    """
+    if isinstance(node, ast.Import):
+        return {alias.asname: alias.name
+                for alias in node.names if alias.asname}
+    if node.level or not node.module:
+        return {}
+    return {alias.asname or alias.name: f"{node.module}.{alias.name}"
+            for alias in node.names if alias.name != "*"}
+
+
+@dataclasses.dataclass(frozen=True)
+class RubricCheck:
+    """ One check of a rubric, reported as one subtest of its test. """
+    test: str
+    kind: str
+    subtest: str
+    message: str
+    minimum: int = 1
+    color: str = None
+
+
+class Rubric:
+    """
+    A rubric read from a TOML or YAML file and compiled for grading. The
+    checks on the AST become matchers keyed by node type, which the
+    StudentFileDetector runs during its traversal; the "pattern" checks
+    become one combined regular expression. However many checks there are,
+    a submission is traversed once and searched once.
+    """
+
+    def __init__(self, document, digest=""):
+        self.digest = digest
+        self.checks = []
+        self.tests = {}
+        self.node_matchers = {}
+        self.patterns = {}
+        for test in document.get("tests", []):
+            name = test.get("name", "")
+            if not name.startswith("test_"):
+                raise ValueError(f"Rubric test names must start with "
+                                 f"'test_', not {name!r}.")
+            if name in self.tests:
+                raise ValueError(f"Rubric test {name!r} is defined twice.")
+            self.tests[name] = (" ".join(test.get("description", "").split()),
+                                [])
+            for spec in test.get("checks", []):
+                self.add_check(name, spec)
+        self.combined_pattern = re.compile("|".join(
+            f"(?P<check_{number}>{pattern.pattern})"
+            for number, pattern in self.patterns.items()), re.MULTILINE) \
+            if self.patterns else None
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Reads and compiles a rubric file; files ending in .yaml or .yml are
+        read with PyYAML, anything else as TOML.
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        if os.path.splitext(path)[1] in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading a YAML rubric needs PyYAML "
+                                 "(pip install pyyaml).") from None
+            document = yaml.safe_load(raw)
+        else:
+            import tomllib
+            document = tomllib.loads(raw.decode("utf-8"))
+        return cls(document, hashlib.sha256(raw).hexdigest())
+
+    def add_check(self, test, spec):
+        """ Compiles one [[tests.checks]] entry of test "test". """
+        number = len(self.checks)
+        kind = spec.get("kind")
+        try:
+            check = RubricCheck(test, kind, spec["subtest"], spec["message"],
+                                spec.get("minimum", 1), spec.get("color"))
+            if kind == "pattern":
+                self.patterns[number] = re.compile(spec["regex"],
+                                                   re.MULTILINE)
+            elif kind in ("imports", "calls", "nodes", "assignments"):
+                node_types, match = getattr(self, f"compile_{kind}")(spec)
+                if spec.get("inside_function"):
+                    match = functools.partial(self.inside_function, match)
+                for node_type in node_types:
+                    self.node_matchers.setdefault(node_type, []).append(
+                        (number, match))
+            else:
+                raise ValueError(f"unknown kind {kind!r}")
+        except (KeyError, TypeError, ValueError, re.error) as e:
+            message = f"missing {e}" if isinstance(e, KeyError) else e
+            raise ValueError(f"Check {len(self.tests[test][1]) + 1} of "
+                             f"rubric test {test!r}: {message}.") from None
+        self.checks.append(check)
+        self.tests[test][1].append(number)
+
+    @staticmethod
+    def inside_function(match, node, detector):
+        return detector.current_function() is not None and \
+            match(node, detector)
+
+    @staticmethod
+    def compile_imports(spec):
+        modules = set(spec["modules"])
+
+        def match(node, detector):
+            if isinstance(node, ast.ImportFrom):
+                names = [node.module or ""] if not node.level else []
+            else:
+                names = [alias.name for alias in node.names]
+            return any(name in modules or name.split(".")[0] in modules
+                       for name in names)
+        return (ast.Import, ast.ImportFrom), match
+
+    @staticmethod
+    def compile_calls(spec):
+        functions = list(spec["functions"])
+
+        def match(node, detector):
+            # The name as written or as imported: "t.sleep" is "time.sleep"
+            # after "import time as t"
+            name = dotted_name(node.func)
+            if name is None:
+                return False
+            names = {name, detector.qualified_name(name)}
+            return any(fnmatch.fnmatchcase(name, pattern)
+                       for name in names for pattern in functions)
+        return (ast.Call,), match
+
+    @staticmethod
+    def compile_nodes(spec):
+        node_types = []
+        for type_name in spec["types"]:
+            node_type = getattr(ast, type_name, None)
+            if not (isinstance(node_type, type) and
+                    issubclass(node_type, ast.AST)):
+                raise ValueError(f"{type_name!r} is not an AST node type")
+            node_types.append(node_type)
+        return node_types, lambda node, detector: True
+
+    @staticmethod
+    def compile_assignments(spec):
+        fragment = spec["name_contains"].lower()
+        operators = tuple(RUBRIC_OPERATORS[symbol]
+                          for symbol in spec["operators"])
+
+        def match(node, detector):
+            if isinstance(node, ast.AugAssign):
+                targets, operation = [node.target], node.op
+            elif isinstance(node.value, ast.BinOp):
+                targets, operation = node.targets, node.value.op
+            else:
+                return False
+            return isinstance(operation, operators) and any(
+                isinstance(target, ast.Name) and
+                fragment in target.id.lower() for target in targets)
+        return (ast.Assign, ast.AugAssign), match
+
+    def evaluate(self, index):
+        """
+        Returns the count of every check on the submission of "index". The
+        AST counts come from the index's function summary when it was built
+        with this rubric. The patterns are searched for together; the combined
+        search cannot see overlapping matches, so a pattern that falls short
+        of its minimum is counted again on its own before it fails.
+        """
+        if index.rubric is self:
+            counts = list(index.function_summary.rubric_counts)
+        else:
+            detector = StudentFileDetector(self, index.import_aliases)
+            detector.visit(index.tree)
+            counts = list(detector.rubric_counts)
+        if self.combined_pattern is not None:
+            for match in self.combined_pattern.finditer(index.text):
+                counts[int(match.lastgroup[len("check_"):])] += 1
+            for number, pattern in self.patterns.items():
+                if counts[number] < self.checks[number].minimum:
+                    counts[number] = sum(
+                        1 for _ in pattern.finditer(index.text))
+        return counts
+
+    def test_methods(self):
+        """ Yields (name, method) for each test of the rubric. """
+        for name, (description, numbers) in self.tests.items():
+            yield name, rubric_test(name, description, numbers)
+
+
+def rubric_test(name, description, numbers):
+    """
+    Builds the AdventureGameTests method of one rubric test. Each of its
+    checks is reported as a subtest that fails when the count found is
+    below the check's minimum.
+    """
+    def test(self):
+        try:
+            for number in numbers:
+                check = self.rubric.checks[number]
+                subtest_message = check.subtest
+                if check.color is not None:
+                    subtest_message = msg_color(subtest_message, check.color)
+                with self.subTest(subtest_message):
+                    count = self.rubric_counts[number]
+                    if count < check.minimum:
+                        self.fail(msg_color(
+                            check.message.format(count=count,
+                                                 minimum=check.minimum),
+                            "red"))
+        except AssertionError as ae:
+            self.fail(
+                msg_color(f"Assertion error occurred: {ae}", "red")
+            )
+        except Exception as e:
+            self.fail(
+                msg_color(f"An unspecified exception occurred: {e}", "red")
+            )
+
+    test.__name__ = name
+    test.__doc__ = description
+    return test
+
+
+# Color codes in test and subtest descriptions
+ANSI_ESCAPE_RE = re.compile(r"\033\[[0-9;]*m")
+
+# The subtest label in the description of a test outcome
+SUBTEST_LABEL_RE = re.compile(r"(SubTest: [^]]+)")
+
+
+class GradingProfile:
+    """
+    Records the wall time, the CPU time and the peak of memory allocated
+    (through tracemalloc, which must be tracing) by the steps of grading
+    one submission: setUpClass, the pycodestyle run, every test and every
+    subtest. Steps may nest; the peak of a step includes those of the steps
+    inside it.
+    """
+
+    def __init__(self):
+        self.records = []
+        # [kind, name, wall, cpu, memory at start, peak so far] of every
+        # open step, innermost last
+        self._open = []
+
+    def start(self, kind, name):
+        """ Opens a step; it is recorded when stop() closes it. """
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self._open:
+            self._open[-1][5] = max(self._open[-1][5], peak)
+        tracemalloc.reset_peak()
+        self._open.append([kind, ANSI_ESCAPE_RE.sub("", name),
+                           time.perf_counter(), time.process_time(),
+                           current, current])
+
+    def stop(self):
+        """ Closes and records the innermost open step. """
+        import tracemalloc
+
+        kind, name, wall, cpu, start_memory, peak = self._open.pop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self._open:
+            self._open[-1][5] = max(self._open[-1][5], peak)
+        self.records.append({"kind": kind, "name": name,
+                             "wall_seconds": wall, "cpu_seconds": cpu,
+                             "peak_bytes": peak - start_memory})
+
+
+@contextlib.contextmanager
+def measure(kind, name):
+    """
+    Records the enclosed step in the GradingProfile of the submission being
+    graded; does nothing when grading is not profiled.
+    """
+    profile = grading_profile
+    if profile is None:
+        yield
+        return
+    profile.start(kind, name)
+    try:
+        yield
+    finally:
+        profile.stop()
+
+
+def percentile(values, fraction):
+    """ The nearest-rank percentile of a non-empty list of numbers. """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize_profiles(records):
+    """
+    Aggregates the profiles of the graded records by step: a step that
+    occurs several times in one submission (the subtests of a loop) is
+    summed first, then the p50 and p95 over the submissions are taken.
+    """
+    per_step = {}
+    for record in records:
+        totals = {}
+        for step in record.get("profile", {}).get("steps", []):
+            key = f"{step['kind']}: {step['name']}"
+            total = totals.setdefault(key, [0.0, 0.0, 0])
+            total[0] += step["wall_seconds"]
+            total[1] += step["cpu_seconds"]
+            total[2] = max(total[2], step["peak_bytes"])
+        for key, total in totals.items():
+            per_step.setdefault(key, []).append(total)
+    summary = {}
+    for key, totals in sorted(per_step.items()):
+        summary[key] = {"submissions": len(totals)}
+        for column, label in enumerate(("wall_seconds", "cpu_seconds",
+                                        "peak_bytes")):
+            values = [total[column] for total in totals]
+            summary[key][f"{label}_p50"] = percentile(values, 0.50)
+            summary[key][f"{label}_p95"] = percentile(values, 0.95)
+    return summary
+
+
+def write_profile(profile_dir, records):
+    """
+    Writes the profiling results of the graded records to "profile_dir":
+    timings.json with every step of every submission and the per-step
+    summary, and grader.pstats with the cProfile statistics of all of them
+    merged (the per-submission dumps are removed). Returns the summary.
+    """
+    summary = summarize_profiles(records)
+    with open(os.path.join(profile_dir, "timings.json"), "w",
+              encoding="utf-8") as f:
+        json.dump({"submissions": [
+            {"file": record["file"], "steps": record["profile"]["steps"]}
+            for record in records if "profile" in record],
+            "summary": summary}, f, indent=2)
+    dumps = [record["profile"]["pstats"] for record in records
+             if "profile" in record]
+    if dumps:
+        import pstats
+
+        pstats.Stats(*dumps).dump_stats(
+            os.path.join(profile_dir, "grader.pstats"))
+        for dump in dumps:
+            os.remove(dump)
+    return summary
+
+
+def print_profile_summary(summary, stream):
+    """ Prints the per-step p50/p95 of a profile summary as a table. """
+    stream.write(f"{'step':<60} {'n':>5} {'wall p50':>9} {'wall p95':>9} "
+                 f"{'cpu p95':>9} {'peak p95':>10}\n")
+    for key, row in summary.items():
+        stream.write(f"{key[:60]:<60} {row['submissions']:>5} "
+                     f"{row['wall_seconds_p50'] * 1000:>7.2f}ms "
+                     f"{row['wall_seconds_p95'] * 1000:>7.2f}ms "
+                     f"{row['cpu_seconds_p95'] * 1000:>7.2f}ms "
+                     f"{row['peak_bytes_p95'] / 1024:>8.1f}KB\n")
 
 
 class SuppressTracebackTextTestResult(unittest.TextTestResult):
@@ -230,9 +1556,47 @@ class SuppressTracebackTextTestResult(unittest.TextTestResult):
     separator2 = ''
     separator3 = '=' * 70
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (kind, description, message) for every outcome, in order, so that
+        # the run can be stored in the ResultCache and replayed later
+        self.events = []
+
+    def startTest(self, test):
+        super().startTest(test)
+        if grading_profile is not None:
+            grading_profile.start("test", test.id().rpartition(".")[2])
+
+    def stopTest(self, test):
+        if grading_profile is not None:
+            grading_profile.stop()
+        super().stopTest(test)
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self.events.append(("success", str(test), None))
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.events.append(
+            ("failure", str(test), self._exc_info_to_string(err, test)))
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self.events.append(
+            ("error", str(test), self._exc_info_to_string(err, test)))
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            kind = ("failure" if issubclass(err[0], test.failureException)
+                    else "error")
+            self.events.append(
+                (kind, str(subtest), self._exc_info_to_string(err, subtest)))
+
     def getDescription(self, test):
         description = super().getDescription(test)
-        match = re.search(r'(SubTest: [^]]+)', description)
+        match = SUBTEST_LABEL_RE.search(description)
         if match:
             return msg_color(match.group(1), "blue")
         return description
@@ -261,176 +1625,278 @@ class SuppressTracebackTextTestRunner(unittest.TextTestRunner):
     resultclass = SuppressTracebackTextTestResult
 
 
-class AdventureGameTests(unittest.TestCase):
-    """ This class serves as a testing framework for evaluating
-    functionalities associated with adventure games. """
-    tree = None
-    detector = None
-    file_content = None
-    longMessage = False
+class ReplayedTest:
+    """ Stands in for a test or subtest whose outcome comes from the cache.
+    It describes itself exactly like the test it replaces. """
 
-    def shortDescription(self):
+    def __init__(self, description):
+        self.description = description
+
+    def __str__(self):
+        return self.description
+
+    @staticmethod
+    def shortDescription():
         return None
 
-    @classmethod
-    def setUpClass(cls):
-        """ A class method responsible for initializing class-level variables.
-        It reads the content of the Python file under test, instantiates the
-        StudentFileDetector, parses the content into an AST, and invokes the
-        visit method from the detector."""
 
-        # Setup for load file
-        with open(file_name, "r") as f:
-            cls.file_content = f.read()
-        cls.detector = StudentFileDetector()
-        cls.tree = ast.parse(cls.file_content)
-        cls.detector.set_parents(cls.tree)
-        cls.detector.visit(cls.tree)
+def check_outcomes(events):
+    """
+    Turns the (kind, description, message) events of a run into one entry
+    per test, in the order the tests ran, for results_store.py:
+    {"test": method name, "outcome": "success", "failure" or "error",
+    "failures": [{"subtest": label or None, "message": text}]}. An error
+    outweighs failures, and the color codes are removed.
+    """
+    checks = {}
+    for kind, description, message in events:
+        name, _, rest = description.partition(" ")
+        check = checks.setdefault(name, {"test": name, "outcome": "success",
+                                         "failures": []})
+        if kind == "success":
+            continue
+        if kind == "error" or check["outcome"] != "error":
+            check["outcome"] = kind
+        subtest = rest.partition(") [")[2][:-1]
+        check["failures"].append(
+            {"subtest": ANSI_ESCAPE_RE.sub("", subtest) or None,
+             "message": ANSI_ESCAPE_RE.sub("", message or "")})
+    return list(checks.values())
+
+
+def replay_verdict(verdict, stream):
+    """
+    Feeds a cached verdict back through SuppressTracebackTextTestRunner and
+    SuppressTracebackTextTestResult, which print it exactly as they printed
+    the original run. Returns the result object.
+    """
+    def replay(result):
+        for kind, description, message in verdict["events"]:
+            test = ReplayedTest(description)
+            if kind == "success":
+                result.addSuccess(test)
+            elif kind == "failure":
+                result.addFailure(test, (AssertionError, message, None))
+            else:
+                result.addError(test, (Exception, message, None))
+        result.testsRun = verdict["tests_run"]
+
+    return SuppressTracebackTextTestRunner(stream=stream).run(replay)
+
+
+@functools.lru_cache(maxsize=1)
+def grader_fingerprint():
+    """
+    Identifies this version of the grader: a digest of its own source and
+    of its rubric, the Python version (which decides how the AST looks) and
+    the source of the installed pycodestyle, which is found without being
+    imported. Any change to one of them invalidates every cached verdict.
+    """
+    with open(os.path.abspath(__file__), "rb") as f:
+        digest = hashlib.sha256(f.read())
+    with open(importlib.util.find_spec("pycodestyle").origin, "rb") as f:
+        digest.update(f.read())
+    rubric = AdventureGameTests.rubric
+    digest.update(f"{sys.version_info[:2]}|"
+                  f"{rubric.digest if rubric else ''}".encode())
+    return digest.hexdigest()
+
 
-    def test_output_to_console(self):
+class ResultCache:
+    """
+    An on-disk SQLite cache of grading verdicts, keyed by the submission's
+    content hash, the grader fingerprint and the enabled options. The total
+    size of the stored verdicts is bounded; when it grows past the limit the
+    least recently used entries are evicted.
+
+    The same file keeps the results of single functions for incremental
+    regrading (see SourceIndex), under the keys of FunctionUnit; they count
+    towards the same limit.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH,
+                 max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Batch workers share the file, so wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, verdict TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS verdicts_last_used "
+            "ON verdicts (last_used)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS functions ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS functions_last_used "
+            "ON functions (last_used)")
+
+    @staticmethod
+    def key(raw, path, run_pycodestyle, cell_lines=None):
         """
-        A unit test that verifies the presence of console outputs in the Python
-        script, based on specific criteria. Utilizes the `print_statements`
-        attribute of the `StudentFileDetector` class to ascertain the locations
-        of `print()` statements.
+        Computes the cache key of a submission. The pycodestyle messages
+        name the file, so the path is only part of the key when they are
+        enabled; otherwise identical files share one entry. The messages
+        about a notebook name its cells, so its "cell_lines" are part of
+        the key, and "raw" is the code of the notebook: notebooks that only
+        differ by their outputs share one entry.
         """
-        subtest_message = "SubTest: Checking for output descriptions..."
-        try:
-            with self.subTest(subtest_message):
-                # Check for print statements
-                has_print_statements = any(
-                    line for function, line in self.detector.print_statements)
-
-                # Check for sys.stdout.write statements
-                # This assumes that stdout_write_statements is an attribute
-                # in StudentFileDetector
-                has_stdout_write_statements = any(
-                    line for function,
-                    line in self.detector.stdout_write_statements)
-
-                self.assertTrue(
-                    has_print_statements or has_stdout_write_statements,
-                    msg_color(
-                        "Neither 'print()' nor 'sys.stdout.write()' "
-                        "statement was found in the code.", "red")
-                )
-        except AssertionError as ae:
-            self.fail(
-                msg_color(f"Assertion error occurred: {ae}", "red")
-            )
-        except Exception as e:
-            self.fail(
-                msg_color(f"An unspecified exception occurred: {e}", "red")
-            )
-
-    def test_import_and_function_usage(self):
+        options = {"pycodestyle": bool(run_pycodestyle),
+                   "path": path if run_pycodestyle else None}
+        digest = hashlib.sha256(grader_fingerprint().encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        if cell_lines is not None:
+            digest.update(json.dumps(cell_lines).encode())
+        digest.update(raw)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """ Returns the cached verdict for "key", or None on a miss. """
+        row = self.connection.execute(
+            "SELECT verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "UPDATE verdicts SET last_used = ? WHERE key = ?",
+            (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, verdict):
+        """ Stores a verdict, then evicts old entries beyond the limit. """
+        data = json.dumps(verdict)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time()))
+        self.evict()
+
+    def get_functions(self, keys):
         """
-        Verifies the importation of specific modules and the utilization of
-        particular functions within a Python script. The method employs regular
-        expressions to search for these elements in the content of the file.
+        Returns {key: result} for the function results stored under any of
+        "keys", in one query, and marks them as used.
         """
-        subtest_message = "SubTest: Checking for import of 'time' module..."
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        # Far below SQLite's limit on the number of parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            hits = self.connection.execute(
+                f"SELECT key, result FROM functions WHERE key IN "
+                f"({', '.join('?' * len(chunk))})", chunk).fetchall()
+            if hits:
+                self.connection.execute(
+                    f"UPDATE functions SET last_used = ? WHERE key IN "
+                    f"({', '.join('?' * len(hits))})",
+                    [time.time()] + [key for key, _ in hits])
+            found.update((key, json.loads(result)) for key, result in hits)
+        return found
+
+    def put_functions(self, results):
+        """
+        Stores {key: result} function results in one transaction, then
+        evicts old entries beyond the limit.
+        """
+        now = time.time()
+        rows = []
+        for key, result in results.items():
+            data = json.dumps(result)
+            rows.append((key, data, len(data), now))
+        self.connection.execute("BEGIN")
         try:
-            # Regular expressions to find import statements and function usage
-            import_time_re = re.compile(
-                r"^\s*import\s+(?:[\w, ]*,\s*)?time(?:\s*,\s*[\w, ]*)?$|^\s*"
-                r"from\s+time\s+import\s+\w+",
-                re.MULTILINE)
-            import_random_re = re.compile(
-                r"^\s*import\s+(?:[\w, ]*,\s*)?random(?:\s*,\s*[\w, ]*)?$|^\s*"
-                r"from\s+random\s+import\s+\w+",
-                re.MULTILINE)
-            time_sleep_re = re.compile(r"(time\.sleep\()|(sleep\()",
-                                       re.MULTILINE)
-            random_function_re = re.compile(r"random\.\w+\(",
-                                            re.MULTILINE)
-
-            # SubTest for import of "time" module
-            with self.subTest(subtest_message):
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO functions VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Drops least recently used verdicts and function results until under
+        max_bytes.
+        """
+        total = self.connection.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM verdicts) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM functions)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = {"verdicts": [], "functions": []}
+        for table, key, size, _ in self.connection.execute(
+                "SELECT 'verdicts', key, size, last_used FROM verdicts "
+                "UNION ALL SELECT 'functions', key, size, last_used "
+                "FROM functions ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            stale[table].append((key,))
+            total -= size
+        for table, keys in stale.items():
+            self.connection.executemany(
+                f"DELETE FROM {table} WHERE key = ?", keys)
+
+
+@functools.lru_cache(maxsize=None)
+def open_cache(path, max_bytes):
+    """ Opens a ResultCache once per process and reuses it afterwards. """
+    return ResultCache(path, max_bytes)
 
-                self.assertTrue(
-                    import_time_re.search(self.file_content),
-                    msg_color("The 'time' module was not imported.", "red")
-                )
 
-            # SubTest for import of "random" module
-            with self.subTest(
-                    msg_color(
-                        "SubTest: Checking import of 'random' module",
-                        "blue")):
-                self.assertTrue(
-                    import_random_re.search(self.file_content),
-                    msg_color("The 'random' module was not imported.",
-                              "red")
-                )
+class AdventureGameTests(unittest.TestCase):
+    """ This class serves as a testing framework for evaluating
+    functionalities associated with adventure games. """
+    source_bytes = None
+    cell_lines = None
+    function_cache = None
+    rubric = None
+    rubric_counts = None
+    index = None
+    tree = None
+    file_content = None
+    longMessage = False
 
-            # SubTest for usage of "time.sleep" function
-            with self.subTest(
-                    msg_color("SubTest: Checking usage of "
-                              "'time.sleep' function", "blue")):
-                self.assertTrue(
-                    time_sleep_re.search(self.file_content),
-                    msg_color("The 'time.sleep' function was not "
-                              "used.", "red")
-                )
+    def shortDescription(self):
+        return None
 
-                # SubTest for usage of any function from "random" module
-                with self.subTest(
-                        msg_color(
-                            "SubTest: Checking usage of functions "
-                            "from 'random' module", "blue")):
-                    self.assertTrue(
-                        random_function_re.search(self.file_content),
-                        msg_color(
-                            "No function from the 'random' module was used.",
-                            "red")
-                    )
-        except AssertionError as ae:
-            self.fail(
-                msg_color(f"Assertion error occurred: {ae}", "red")
-            )
-        except Exception as e:
-            self.fail(
-                msg_color(f"An unspecified exception occurred: {e}", "red")
-            )
+    @contextlib.contextmanager
+    def subTest(self, msg, **params):
+        """ A unittest subtest that is timed when grading is profiled. """
+        with measure("subtest", f"{self._testMethodName} {msg}"), \
+                super().subTest(msg, **params):
+            yield
 
-    def test_interactive_elements(self):
-        """
-        Validates the presence of key interactive constructs such as "input",
-        "if/elif/else", and "while" in the Python script. Regular expressions
-        are employed to detect these constructs in the file content.
-        """
-        try:
-            # Define regular expressions for the constructs
-            input_re = re.compile(r"input\s?\(", re.MULTILINE)
-            if_elif_else_re = re.compile(r"\bif\b|\belif\b|\belse\b",
-                                         re.MULTILINE)
-            while_re = re.compile(r"\bwhile\b", re.MULTILINE)
-
-            constructs = [
-                ("input", input_re),
-                ("if/elif/else", if_elif_else_re),
-                ("while", while_re)
-            ]
-
-            for name, regex in constructs:
-                subtest_message = f"SubTest: Checking for usage of '{name}'..."
-                with self.subTest(subtest_message):
-                    count = len(regex.findall(self.file_content))
-                    self.assertGreaterEqual(
-                        count, 1,
-                        msg_color(f"The statement '{name}' "
-                                  f"was found {count} times in your code.",
-                                  "red")
-                    )
-        except AssertionError as ae:
-            self.fail(
-                msg_color(f"Assertion error occurred: {ae}", "red")
-            )
-        except Exception as e:
-            self.fail(
-                msg_color(f"An unspecified exception occurred: {e}", "red")
-            )
+    @classmethod
+    def setUpClass(cls):
+        """ A class method responsible for initializing class-level variables.
+        It builds the SourceIndex of the Python file under test, which reads
+        and parses the file once for all the tests. When the caller has
+        already read the file, its bytes are in "source_bytes" (for a
+        notebook, the bytes of its code, with "cell_lines") and the file is
+        not opened again; when it has a ResultCache in "function_cache",
+        the functions that were already graded are not checked again. The
+        checks of the rubric are counted with the function summary, and
+        their counts are kept in "rubric_counts" for the tests generated
+        from the rubric."""
+
+        # Setup for load file
+        with measure("setup", "setUpClass"):
+            if cls.source_bytes is not None:
+                cls.index = SourceIndex.from_bytes(
+                    file_name, cls.source_bytes, cls.rubric,
+                    cls.function_cache, cls.cell_lines)
+            else:
+                cls.index = SourceIndex.from_file(file_name, cls.rubric,
+                                                  cls.function_cache)
+            cls.file_content = cls.index.text
+            cls.tree = cls.index.tree
+            if cls.rubric is not None:
+                cls.rubric_counts = cls.rubric.evaluate(cls.index)
 
     def test_input_while_or_recursive(self):
         """
@@ -442,9 +1908,10 @@ class AdventureGameTests(unittest.TestCase):
         """
         subtest_message = "SubTest: Checking for 'input()' validation..."
         try:
-            functions_with_input = self.detector.function_with_input
-            functions_with_while = self.detector.function_with_while
-            functions_with_recursive_calls = self.detector.recursive_calls
+            summary = self.index.function_summary
+            functions_with_input = summary.with_input
+            functions_with_while = summary.with_while
+            functions_with_recursive_calls = summary.recursive
 
             with self.subTest(subtest_message):
                 for func in functions_with_input:
@@ -464,87 +1931,14 @@ class AdventureGameTests(unittest.TestCase):
                 msg_color(f"An unspecified exception occurred: {e}", "red")
             )
 
-    def test_variable_for_score_exists(self):
-        """
-        Inspects the Python script for the presence of a variable that appears
-        to maintain and update a game score. The method examines both regular
-        assignment operations and augmented assignment operations
-        (e.g., +=, -=) with respect to the variable. It specifically looks for
-        binary operations involving addition or subtraction in the assignment.
-        """
-        subtest_message = "SubTest: Checking for the scoring system..."
-        # Variable to hold whether the criteria are met
-        criteria_met = False
-
-        try:
-            with self.subTest(subtest_message):
-                for func_name, variable_name, node \
-                        in self.detector.variable_assignments:
-                    variable_name = variable_name.lower()
-                    if "score" not in variable_name:
-                        continue
-                    if isinstance(node, ast.Assign):
-                        if isinstance(node.value, ast.BinOp) and (
-                                isinstance(node.value.op, ast.Add) or
-                                isinstance(node.value.op, ast.Sub)):
-                            criteria_met = True
-                            break
-                    elif isinstance(node, ast.AugAssign):
-                        if isinstance(node.op, (ast.Add, ast.Sub)):
-                            criteria_met = True
-                            break
-
-                    if criteria_met:
-                        break
-
-                self.assertTrue(criteria_met, msg_color(
-                    "No variable found for maintaining and updating the game "
-                    "score based on contextual analysis.", "red"))
-        except AssertionError as ae:
-            self.fail(
-                msg_color(f"Assertion error occurred: {ae}", "red")
-            )
-        except Exception as e:
-            self.fail(
-                msg_color(f"An unspecified exception occurred: {e}", "red")
-            )
-
-    def test_function_definitions(self):
-        """
-        Conducts an assessment to ascertain the existence of a minimum of four
-        function definitions within the code under examination. The method
-        employs the Abstract Syntax Tree (AST) to identify said function
-        definitions.
-        """
-        subtest_message = ("SubTest: Checking the existence of at "
-                           "least four function definitions...")
-        # Retrieve the set of function definitions from the AST detector
-        function_definitions = self.detector.function_definitions
-        try:
-            # Assert that at least four function definitions exist
-            with self.subTest(subtest_message):
-                self.assertGreaterEqual(
-                    len(function_definitions), 4,
-                    msg_color(f"Only {len(function_definitions)} "
-                              f"function definitions were found, at least "
-                              f"four are required.", "red")
-                )
-        except AssertionError as ae:
-            self.fail(
-                msg_color(f"Assertion error occurred: {ae}", "red")
-            )
-        except Exception as e:
-            self.fail(
-                msg_color(f"An unspecified exception occurred: {e}", "red")
-            )
-
     def test_pep8_compliance(self):
         """
         Executes a suite of subtests aimed at verifying the compliance of the
-        code under scrutiny with the PEP8 style guidelines. Utilizes string
-        manipulation and regular expression matching for the assessment of
-        various aspects such as indentation, line length, and quoting
-        conventions.
+        code under scrutiny with the PEP8 style guidelines. The indentation
+        rules come from the shared pycodestyle records; tabs, line length,
+        imports, quoting and naming come from one pass of lint_lines() over
+        the line table and the token stream. Every violation found is
+        reported as its own subtest.
         """
         subtest_message = "SubTest: Checking for PEP8 compliance..."
         try:
@@ -557,101 +1951,15 @@ class AdventureGameTests(unittest.TestCase):
                           'E125', 'E126', 'E127', 'E128', 'E129', 'E131',
                           'E133', 'W191']
 
-                result = check_pep8_compliance(file_name, errors)
-
-                self.assertIsNone(
-                    result, msg_color(
-                        f"PEP8 errors found: {result}", "red"))
-
-                lines = self.file_content.split("\n")
-
-                single_quotes = []
-                double_quotes = []
-
-                for line_number, line in enumerate(lines, start=1):
-
-                    # 2. Spaces are used, not tabs
-                    self.assertFalse(
-                        "\t" in line, msg_color(
-                            f"Line {line_number}: Tab character "
-                            f"detected.", "red"
-                        )
-                    )
-
-                    # 3. Line length is less than 80 characters
-                    self.assertLess(
-                        len(line), 80, msg_color(
-                            f"Line {line_number}: Exceeds 80 characters.",
-                            "red"
-                        )
-                    )
+                for result in pep8_violations(self.index, errors):
+                    with self.subTest(subtest_message):
+                        self.fail(msg_color(f"PEP8 errors found: {result}",
+                                            "red"))
 
-                    # 4. import statements are on separate lines
-                    self.assertFalse(
-                        "," in line and line.lstrip().startswith("import "),
-                        msg_color(f"Line {line_number}: Multiple "
-                                  f"imports on one line.", "red"))
-
-                    # 5. code uses single quotes or double quotes
-                    # Keep track the type of string we are in
-                    # (None, "'", or '"')
-                    in_string = None
-                    in_comment = False
-
-                    for char in line:
-                        # Detect if we are in a comment
-                        if char == '#' and in_string is None:
-                            in_comment = True
-
-                        # Skip quote checks if in a comment
-                        if in_comment:
-                            continue
-
-                        # This condition ensures we are not inside a
-                        # single-quoted string
-                        if char == '"' and in_string != "'":
-                            if in_string == '"':
-                                # We are closing a double-quoted string
-                                in_string = None
-                            else:
-                                double_quotes.append(line_number)
-                                # We are opening a double-quoted string
-                                in_string = '"'
-                        # This condition ensures we are not inside a
-                        # double-quoted string
-                        elif char == "'" and in_string != '"':
-                            if in_string == "'":
-                                # We are closing a single-quoted string
-                                in_string = None
-                            else:
-                                single_quotes.append(line_number)
-                                # We are opening a single-quoted string
-                                in_string = "'"
-                    # If both types of quotes are used for string delimiters,
-                    # fail the test.
-                    if single_quotes and double_quotes:
-                        text = (f"Line {single_quotes[0]} and "
-                                f"{double_quotes[0]}: Both single quotes "
-                                f"(line {single_quotes[0]}) and double (line "
-                                f"{double_quotes[0]}) quotes are used for "
-                                f"string delimiters.")
-                        self.fail(msg_color(text, "red"))
-
-                    # 6. there are no trailing blank spaces
-                    self.assertFalse(
-                        len(line) != len(line.rstrip()), msg_color(
-                            f"Line {line_number}: Trailing whitespace "
-                            f"detected.", "red"))
-
-                    # 7. function names use lower_case_with_underscores
-                    if line.lstrip().startswith("def "):
-                        func_name = line.lstrip()[4:].split("(")[0].strip()
-                        self.assertTrue(
-                            re.match("^[a-z_][a-z0-9_]*$", func_name),
-                            msg_color(f"Line {line_number}: Function "
-                                      f"name '{func_name}()' does not follow "
-                                      f"PEP 8 naming conventions.",
-                                      "red"))
+                # 2. to 7. the line rules
+                for _, message in lint_lines(self.index):
+                    with self.subTest(subtest_message):
+                        self.fail(msg_color(message, "red"))
         except AssertionError as ae:
             self.fail(
                 msg_color(f"Assertion error occurred: {ae}", "red")
@@ -667,59 +1975,27 @@ class AdventureGameTests(unittest.TestCase):
         function definitions. The subtest evaluates two criteria for each
         function: the presence of comments immediately above or below the
         function definition and the inclusion of a docstring within the
-        function. The subtest employs the Abstract Syntax Tree (AST) to
-        identify function definitions and the tokenize module to locate
-        comments.
+        function. Both are answered by the function summary of the
+        SourceIndex, which only looks again at the functions that changed
+        since they were last graded.
         """
         subtest_message = "SubTest: Checking for code comments..."
         try:
             with self.subTest(subtest_message):
-                # Get the positions of function definitions in the AST
-                function_positions = {node.lineno: node.name for (_, node) in
-                                      self.detector.function_definitions}
-
-                # Use the tokenize module to identify comments
-                with tokenize.open(file_name) as f:
-                    tokens = list(tokenize.generate_tokens(f.readline))
-
-                for token_info in tokens:
-                    lineno = token_info.start[0]
-
-                    # If we encounter a line that contains a function
-                    # definition in the AST
-                    function_name = function_positions.get(lineno)
-
-                    if function_name:
-                        function_name = function_positions[lineno]
-
-                        # Search for a comment immediately above, below,
-                        # or in-line with the definition
-                        comments_near_function = any(
-                            t_type == tokenize.COMMENT and
-                            (t_lineno == lineno - 1 or
-                             t_lineno == lineno + 1 or t_lineno == lineno)
-                            for t_info in tokens
-                            for t_lineno in [t_info.start[0]]
-                            for t_type in [t_info.type]
-                        )
-
-                        # Search for a docstring (triple-quoted comment)
-                        # within the function
-                        function_node = next(node for (_, node) in
-                                             self.detector.function_definitions
-                                             if node.name == function_name)
-                        has_docstring = isinstance(function_node.body[0],
-                                                   ast.Expr) and isinstance(
-                            function_node.body[0].value, ast.Str)
-
-                        # Test whether at least one of the two types of
-                        # comments is present
-                        self.assertTrue(
-                            comments_near_function or has_docstring,
-                            msg_color(f"The function '{function_name}()' "
-                                      f"does not have enough comments for "
-                                      f"description.", "red")
-                        )
+                # Function definitions in source order, each with whether
+                # a comment is immediately above, below or in-line with the
+                # definition, or a docstring is within the function
+                for _, function_name, documented in \
+                        self.index.function_summary.functions:
+
+                    # Test whether at least one of the two types of
+                    # comments is present
+                    self.assertTrue(
+                        documented,
+                        msg_color(f"The function '{function_name}()' "
+                                  f"does not have enough comments for "
+                                  f"description.", "red")
+                    )
         except AssertionError as ae:
             self.fail(
                 msg_color(f"Assertion error occurred: {ae}", "red")
@@ -732,25 +2008,19 @@ class AdventureGameTests(unittest.TestCase):
     def test_pycodestyle(self):
         """
         Executes a subtest utilizing the PycodeStyle tool to evaluate the
-        code's adherence to PEP 8 style guidelines. The subtest invokes the
-        PycodeStyle tool via a subprocess and parses its standard output to
-        assert the absence of style issues. If the PycodeStyle tool is not
-        installed, the test will gracefully fail with an appropriate message.
+        code's adherence to PEP 8 style guidelines. The issues come from the
+        single in-process pycodestyle pass stored on the SourceIndex, which is
+        also used by the indentation checks of test_pep8_compliance, and are
+        reported in the same format as the pycodestyle command line.
         """
         subtest_message = "SubTest: Running the PycodeStyle test..."
         if pycodestyle_run:
             try:
                 with self.subTest(subtest_message):
-
-                    result = subprocess.run(["pycodestyle", file_name], capture_output=True, text=True)
-
-                    errors_and_warnings = result.stdout.split("\n")
-                    for index, issue in enumerate(errors_and_warnings):
+                    for issue in self.index.pycodestyle_issues():
                         with self.subTest("SubTest: PyCodeStyle..."):
-                            self.assertEqual(
-                                issue, "",
-                                msg_color(f"PycodeStyle fail: {issue}",
-                                          "red"))
+                            self.fail(msg_color(f"PycodeStyle fail: {issue}",
+                                                "red"))
             except AssertionError as ae:
                 self.fail(
                     msg_color(f"Assertion error occurred: {ae}", "red")
@@ -759,20 +2029,433 @@ class AdventureGameTests(unittest.TestCase):
                 self.fail(
                     msg_color(f"An unspecified exception occurred: {e}", "red")
                 )
-            except FileNotFoundError as fe:
-                msg_color(f"An unspecified exception occurred: {fe}", "red")
+
+
+def install_rubric(path):
+    """
+    Compiles the rubric at "path" and makes its tests the rubric tests of
+    AdventureGameTests, in place of those of the rubric installed before.
+    Raises OSError or ValueError if the rubric cannot be read.
+    """
+    rubric = Rubric.from_file(path)
+    clashes = [name for name in rubric.tests
+               if name in vars(AdventureGameTests) and
+               (AdventureGameTests.rubric is None or
+                name not in AdventureGameTests.rubric.tests)]
+    if clashes:
+        raise ValueError(f"Rubric test {clashes[0]!r} would replace a "
+                         f"built-in test.")
+    if AdventureGameTests.rubric is not None:
+        for name in AdventureGameTests.rubric.tests:
+            delattr(AdventureGameTests, name)
+    for name, method in rubric.test_methods():
+        setattr(AdventureGameTests, name, method)
+    AdventureGameTests.rubric = rubric
+    grader_fingerprint.cache_clear()
+
+
+install_rubric(RUBRIC_PATH)
+
+
+def validate_file(path):
+    """
+    Checks that the given path names an existing Python file or Jupyter
+    notebook. Returns the
+    message to show the user if it does not; otherwise, returns None.
+    """
+    if not os.path.exists(path):
+        return f"The specified Python file {path} does not exist."
+    return validate_name(path)
+
+
+def validate_name(path):
+    """
+    Checks that a submission is named like a Python file or a Jupyter
+    notebook, for submissions that do not come from the file system.
+    Returns the message to show the user if it is not; otherwise, returns
+    None.
+    """
+    if os.path.splitext(path)[1] not in SUBMISSION_EXTENSIONS:
+        return ("Please provide a Python file (.py) or a Jupyter notebook "
+                "(.ipynb) as an argument.")
+    return None
+
+
+def grade_file(path, run_pycodestyle=False, cache_path=None,
+               cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+               profile_dir=None):
+    """
+    Runs AdventureGameTests against a single submission in the current
+    process and returns a machine-readable record of the outcome. The
+    "output" entry holds exactly the text a per-file run prints.
+
+    With a "cache_path", a verdict already stored for the same content,
+    grader and options is replayed instead of running the tests, and a
+    fresh verdict is stored for next time. When the content changed, the
+    functions that are the same as in a submission graded before are not
+    checked again.
+
+    With a "profile_dir", the grading is profiled (and never replayed from
+    the cache): the record gets a "profile" entry with the timed steps and
+    the path of a cProfile dump written to that directory.
+
+    A Jupyter notebook is read as it is parsed, so that its outputs are
+    never loaded.
+    """
+    message = validate_file(path)
+    if message is not None:
+        return invalid_record(path, message)
+
+    with open(path, "rb") as f:
+        if is_notebook(path):
+            return grade_notebook(path, f, run_pycodestyle, cache_path,
+                                  cache_size, profile_dir)
+        raw = f.read()
+    return grade_source(path, raw, run_pycodestyle, cache_path, cache_size,
+                        profile_dir)
+
+
+def grade_notebook(path, stream, run_pycodestyle=False, cache_path=None,
+                   cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+                   profile_dir=None):
+    """
+    Grades the Jupyter notebook read from the binary "stream" like a
+    Python file made of its code cells (see read_notebook()); the messages
+    name the cell and the line in the cell of every line they mention.
+    """
+    try:
+        notebook = read_notebook(stream)
+    except ValueError as e:
+        return invalid_record(path, f"The notebook {path} could not be "
+                                    f"read: {e}")
+    return grade_source(path, notebook.source.encode(), run_pycodestyle,
+                        cache_path, cache_size, profile_dir,
+                        notebook.cell_lines)
+
+
+def invalid_record(path, message):
+    """ The record of a submission that could not be graded at all. """
+    return {"file": path, "valid": False, "successful": False,
+            "cached": False, "tests_run": 0, "failures": 0, "errors": 0,
+            "output": message + "\n"}
+
+
+def grade_source(path, raw, run_pycodestyle=False, cache_path=None,
+                 cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+                 profile_dir=None, cell_lines=None):
+    """
+    Grades a submission given as bytes; "path" is only used to name it.
+    This is the part of grade_file() that does not touch the file system
+    (apart from the cache), so it also serves submissions sent to the
+    grading server. A notebook given as bytes is handed to
+    grade_notebook(); "cell_lines" comes with the code of a notebook that
+    was already read.
+    """
+    global file_name, pycodestyle_run, grading_profile
+    if cell_lines is None and is_notebook(path):
+        return grade_notebook(path, io.BytesIO(raw), run_pycodestyle,
+                              cache_path, cache_size, profile_dir)
+    file_name = path
+    pycodestyle_run = run_pycodestyle
+    if profile_dir is not None:
+        # A replayed verdict says nothing about the cost of grading
+        cache_path = None
+
+    stream = io.StringIO()
+    cache = key = verdict = profiler = None
+    if cache_path is not None:
+        cache = open_cache(cache_path, cache_size)
+        key = cache.key(raw, path, run_pycodestyle, cell_lines)
+        verdict = cache.get(key)
+
+    if verdict is not None:
+        result = replay_verdict(verdict, stream)
+    else:
+        AdventureGameTests.source_bytes = raw
+        AdventureGameTests.cell_lines = cell_lines
+        AdventureGameTests.function_cache = cache
+        if profile_dir is not None:
+            import cProfile
+            import tracemalloc
+
+            grading_profile = GradingProfile()
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+        try:
+            suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+                AdventureGameTests)
+            runner = SuppressTracebackTextTestRunner(stream=stream)
+            if profiler is not None:
+                result = profiler.runcall(runner.run, suite)
+            else:
+                result = runner.run(suite)
+        finally:
+            AdventureGameTests.source_bytes = None
+            AdventureGameTests.cell_lines = None
+            AdventureGameTests.function_cache = None
+            if profiler is not None:
+                tracemalloc.stop()
+        if cache is not None:
+            cache.put(key, {"tests_run": result.testsRun,
+                            "events": result.events})
+
+    record = {"file": path, "valid": True,
+              "successful": result.wasSuccessful(),
+              "cached": verdict is not None,
+              "tests_run": result.testsRun,
+              "failures": len(result.failures),
+              "errors": len(result.errors),
+              "graded_at": time.time(),
+              "checks": check_outcomes(result.events),
+              "output": stream.getvalue()}
+    if profiler is not None:
+        handle, dump = tempfile.mkstemp(suffix=".pstats", dir=profile_dir)
+        os.close(handle)
+        profiler.dump_stats(dump)
+        record["profile"] = {"steps": grading_profile.records,
+                             "pstats": dump}
+        grading_profile = None
+    return record
+
+
+def collect_submissions(target):
+    """
+    Expands a directory or a glob pattern into the sorted list of Python
+    files and Jupyter notebooks it contains. Directories are searched
+    recursively; the copies Jupyter keeps in ".ipynb_checkpoints" are left
+    out.
+    """
+    if os.path.isdir(target):
+        paths = [path for extension in SUBMISSION_EXTENSIONS
+                 for path in glob.glob(os.path.join(target, "**",
+                                                    "*" + extension),
+                                       recursive=True)]
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path) and
+                  ".ipynb_checkpoints" not in path.split(os.sep))
+
+
+def grade_batch(paths, run_pycodestyle=False, jobs=None, cache_path=None,
+                cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+                profile_dir=None):
+    """
+    Grades many submissions over a pool of worker processes, one per core
+    unless "jobs" says otherwise. Yields one record per submission, in the
+    order of "paths", as soon as it is available. Every worker opens the
+    result cache at "cache_path" on its own.
+    """
+    import concurrent.futures
+
+    jobs = jobs or os.cpu_count() or 1
+    count = len(paths)
+    # Forked workers inherit pycodestyle instead of each importing it
+    style_guide()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(1, count // (jobs * 4))
+        yield from pool.map(grade_file, paths,
+                            [run_pycodestyle] * count,
+                            [cache_path] * count,
+                            [cache_size] * count,
+                            [profile_dir] * count,
+                            chunksize=chunksize)
+
+
+def is_archive(target):
+    """ Tells whether the "file" argument names a zip or tar archive. """
+    return os.path.isfile(target) and \
+        target.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_batch_target(target):
+    """ Tells whether the "file" argument names a batch of submissions. """
+    return os.path.isdir(target) or glob.has_magic(target) or \
+        is_archive(target)
+
+
+def is_submission_member(name):
+    """
+    Tells whether an archive member is a submission: a Python file or a
+    Jupyter notebook that is not one of the metadata files macOS adds to
+    the archives it creates, nor a Jupyter checkpoint.
+    """
+    base = os.path.basename(name)
+    return name.endswith(SUBMISSION_EXTENSIONS) and \
+        not name.startswith("__MACOSX/") and not base.startswith("._") and \
+        ".ipynb_checkpoints" not in name.split("/")
+
+
+def archive_members(path):
+    """
+    Yields (name, size, stream) for every submission in the zip or tar
+    archive at "path", in archive order, named "<archive>/<member>". The
+    binary "stream" of a member is only valid until the next one is asked
+    for. Nothing is written to disk; tar archives are even read as a
+    stream.
+    """
+    import tarfile
+    import zipfile
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_submission_member(info.filename):
+                    continue
+                with archive.open(info) as stream:
+                    yield f"{path}/{info.filename}", info.file_size, stream
+    else:
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile() or \
+                        not is_submission_member(member.name):
+                    continue
+                yield f"{path}/{member.name}", member.size, \
+                    archive.extractfile(member)
+
+
+def grade_archive(path, run_pycodestyle=False, jobs=None, cache_path=None,
+                  cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+                  profile_dir=None):
+    """
+    Grades every submission in a zip or tar archive over a pool of worker
+    processes, without extracting it, and yields one record per submission
+    in archive order as soon as it is available. Only a couple of
+    submissions per worker are read ahead, so memory stays bounded however
+    large the archive is: Python files are read into memory one at a time,
+    up to MAX_MEMBER_BYTES (bigger ones are reported, not graded), and
+    notebooks are parsed from the archive as a stream, whatever their
+    size, so that only their code reaches the workers.
+    """
+    import concurrent.futures
+
+    jobs = jobs or os.cpu_count() or 1
+    pending = collections.deque()
+    # Forked workers inherit pycodestyle instead of each importing it
+    style_guide()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for name, size, stream in archive_members(path):
+            record = None
+            if is_notebook(name):
+                try:
+                    notebook = read_notebook(stream)
+                except ValueError as e:
+                    record = invalid_record(name, f"The notebook {name} "
+                                                  f"could not be read: {e}")
+                else:
+                    pending.append(pool.submit(
+                        grade_source, name, notebook.source.encode(),
+                        run_pycodestyle, cache_path, cache_size, profile_dir,
+                        notebook.cell_lines))
+            elif size > MAX_MEMBER_BYTES:
+                record = invalid_record(name, f"The file {name} is larger "
+                                              f"than {MAX_MEMBER_BYTES} "
+                                              f"bytes.")
+            else:
+                pending.append(pool.submit(grade_source, name, stream.read(),
+                                           run_pycodestyle, cache_path,
+                                           cache_size, profile_dir))
+            if record is not None:
+                pending.append(concurrent.futures.Future())
+                pending[-1].set_result(record)
+            while len(pending) > 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+async def handle_client(reader, writer, pool, cache_path, cache_size):
+    """
+    Serves one connection to the grading server. Each request is a JSON
+    header line {"file": name, "size": n, "pycodestyle": bool} followed by
+    the n bytes of the submission; each answer is the grade_file() record
+    as one JSON line. A connection may send any number of requests.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # A header over the reader's limit raises ValueError, answered
+            # as a malformed request like the rest
+            try:
+                header_line = await reader.readline()
+                if not header_line:
+                    break
+                header = json.loads(header_line)
+                name = header["file"]
+                raw = await reader.readexactly(header["size"])
+            except (ValueError, KeyError, TypeError,
+                    asyncio.IncompleteReadError) as e:
+                writer.write(json.dumps(
+                    {"error": f"Malformed request: {e}"}).encode() + b"\n")
+                await writer.drain()
+                break
+
+            message = validate_name(name)
+            if message is not None:
+                record = invalid_record(name, message)
+            else:
+                record = await loop.run_in_executor(
+                    pool, grade_source, name, raw,
+                    bool(header.get("pycodestyle")), cache_path, cache_size)
+            writer.write(json.dumps(record).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(socket_path, jobs=None, cache_path=None,
+                cache_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+    """
+    Runs the grading server on a Unix socket until it is interrupted. The
+    grading happens in a pool of worker processes forked from this one, so
+    pycodestyle, unittest and the compiled patterns are already loaded when
+    a submission arrives.
+    """
+    import asyncio
+    import concurrent.futures
+    import signal
+
+    jobs = jobs or os.cpu_count() or 1
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    style_guide()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        server = await asyncio.start_unix_server(
+            functools.partial(handle_client, pool=pool,
+                              cache_path=cache_path, cache_size=cache_size),
+            path=socket_path)
+        # Shut down cleanly when the service manager stops the server
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                      server.close)
+        print(f"Grading server listening on {socket_path} "
+              f"with {jobs} workers.")
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
 
 
 if __name__ == "__main__":
     # Instantiate the argument parser
     parser = argparse.ArgumentParser(
-        description="Run unit tests on a given student file."
+        description="Run unit tests on a given student file, or on every "
+                    "Python file and Jupyter notebook in a directory, glob "
+                    "pattern or archive."
     )
 
-    # Define the "file" argument as a required positional argument
+    # Define the "file" argument as a positional argument, required unless
+    # the grading server is started
     parser.add_argument(
         "file",
-        help="The name of the file to test."
+        help="The name of the file (.py or .ipynb) to test, or a directory "
+             "/ glob pattern of files or a zip / tar archive to grade in "
+             "batch mode.",
+        nargs="?"
     )
 
     parser.add_argument(
@@ -784,33 +2467,157 @@ if __name__ == "__main__":
         default=False
     )
 
+    parser.add_argument(
+        "-j", "--jobs",
+        help="Number of worker processes in batch and server mode "
+             "(default: one per CPU core).",
+        type=int,
+        default=None
+    )
+
+    parser.add_argument(
+        "-o", "--output",
+        help="Where batch mode writes its JSON lines, one record per "
+             "submission (default: standard output).",
+        default="-"
+    )
+
+    parser.add_argument(
+        "--serve",
+        help=f"Start a resident grading server on this Unix socket instead "
+             f"of grading files; use grade_client.py to send it "
+             f"submissions (default socket: {DEFAULT_SOCKET_PATH}).",
+        nargs="?",
+        const=DEFAULT_SOCKET_PATH,
+        default=None,
+        metavar="SOCKET"
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        help="Grade every submission from scratch, without reading or "
+             "writing the result cache.",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--cache",
+        help=f"Location of the result cache (default: {DEFAULT_CACHE_PATH}).",
+        default=DEFAULT_CACHE_PATH
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        help=f"Size limit of the result cache in MB; the least recently used "
+             f"verdicts and function results are evicted beyond it "
+             f"(default: {DEFAULT_CACHE_SIZE_MB}).",
+        type=int,
+        default=DEFAULT_CACHE_SIZE_MB
+    )
+
+    parser.add_argument(
+        "--rubric",
+        help=f"TOML or YAML file with the checks to grade against "
+             f"(default: {RUBRIC_PATH}).",
+        default=None
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Time every step of grading (setUpClass, pycodestyle, each "
+             "test and subtest) and write timings.json and grader.pstats "
+             "to this directory; the result cache is bypassed.",
+        default=None,
+        metavar="DIR"
+    )
+
     # Parse the arguments
     args = parser.parse_args()
 
-    # Extract the file name from the parsed arguments
-    file_name = args.file
+    # Replace the default rubric if another one is given
+    if args.rubric is not None:
+        try:
+            install_rubric(args.rubric)
+        except (OSError, ValueError) as e:
+            print(f"The rubric {args.rubric} could not be loaded: {e}")
+            sys.exit(1)
 
     # Define whether pycodestyle will be executed or not
     pycodestyle_run = args.pycodestyle
 
-    # Extract the file root and extension from the file name
-    file_root, file_ext = os.path.splitext(file_name)
+    # Define where grading results are cached, if anywhere
+    cache_path = None if args.no_cache else args.cache
+    cache_size = args.cache_size * 1024 * 1024
 
-    # Validate that the file exists
-    if not os.path.exists(file_name):
-        print(f"The specified Python file {file_name} does not exist.")
-        sys.exit(1)
+    # Define where profiling results go, if grading is profiled
+    profile_dir = args.profile
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    if args.serve is not None:
+        import asyncio
+
+        try:
+            asyncio.run(serve(args.serve, args.jobs, cache_path, cache_size))
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if args.file is None:
+        parser.error("the following arguments are required: file")
+
+    if is_batch_target(args.file):
+        import tarfile
+        import zipfile
 
-    # Validate that the file is a Python file
-    if file_ext != ".py":
-        print("Please provide a Python file (.py) as an argument.")
+        if is_archive(args.file):
+            records = grade_archive(args.file, pycodestyle_run, args.jobs,
+                                    cache_path, cache_size, profile_dir)
+        else:
+            submissions = collect_submissions(args.file)
+            if not submissions:
+                print(f"No Python files or notebooks found in "
+                      f"{args.file}.")
+                sys.exit(1)
+            records = grade_batch(submissions, pycodestyle_run, args.jobs,
+                                  cache_path, cache_size, profile_dir)
+
+        graded = []
+        out = sys.stdout if args.output == "-" else open(
+            args.output, "w", encoding="utf-8")
+        try:
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                if profile_dir is not None:
+                    record.pop("output")
+                    graded.append(record)
+                else:
+                    graded.append(None)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            print(f"The archive {args.file} could not be read: {e}")
+            sys.exit(1)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if not graded:
+            print(f"No Python files or notebooks found in {args.file}.")
+            sys.exit(1)
+        if profile_dir is not None:
+            print_profile_summary(write_profile(profile_dir, graded),
+                                  sys.stderr)
+        sys.exit(0)
+
+    # Validate that the file exists and is a Python file
+    error_message = validate_file(args.file)
+    if error_message is not None:
+        print(error_message)
         sys.exit(1)
 
     # Run unittest
-    unittest.main(
-        argv=["first-arg-is-ignored"],
-        exit=False,
-        testRunner=SuppressTracebackTextTestRunner(),
-        buffer=None,
-        verbosity=0,
-    )
+    record = grade_file(args.file, pycodestyle_run, cache_path, cache_size,
+                        profile_dir)
+    sys.stderr.write(record["output"])
+    if profile_dir is not None:
+        print_profile_summary(write_profile(profile_dir, [record]),
+                              sys.stderr)